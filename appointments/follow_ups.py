@@ -0,0 +1,108 @@
+"""
+Follow-up worklist and draft booking.
+
+A medical record with a ``follow_up_date`` asks for the patient to be seen
+again, and stays outstanding until the patient has an appointment after
+that visit. The worklist is a single query: the partial index on
+``follow_up_date`` picks the due records and a NOT EXISTS subquery on the
+(patient, appointment_date) index drops the ones already booked.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from core.models import User
+from patients.models import MedicalRecord
+from .models import Appointment
+from .scheduling import after_bulk_create, find_clashes, next_free_slots
+
+
+def due_follow_ups(days=None, doctor_id=None):
+    """
+    Records whose follow-up falls due within ``days`` (or is overdue by up to
+    FOLLOW_UP_LOOKBACK_DAYS) and has not been booked, earliest first.
+    """
+    days = settings.FOLLOW_UP_DAYS if days is None else days
+    today = timezone.localdate()
+    booked = Appointment.objects.filter(
+        patient_id=OuterRef('patient_id'),
+        appointment_date__gt=OuterRef('visit_date'),
+        status__in=Appointment.BLOCKING_STATUSES,
+    )
+    records = MedicalRecord.summaries.filter(
+        follow_up_date__gte=today - timedelta(days=settings.FOLLOW_UP_LOOKBACK_DAYS),
+        follow_up_date__lte=today + timedelta(days=days),
+    ).exclude(Exists(booked))
+    if doctor_id:
+        records = records.filter(doctor_id=doctor_id)
+    return records.order_by('follow_up_date', 'pk')
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def book_follow_ups(days=None, doctor_id=None):
+    """
+    Create a draft appointment for every due follow-up in one bulk insert.
+
+    Each patient goes back to the doctor who asked for the follow-up. A
+    doctor's patients take that doctor's free slots in turn, in follow-up
+    date order, each at the first free slot on or after their follow-up
+    date (or from now, if it has passed). A patient with several due
+    records gets one appointment.
+
+    Returns:
+        tuple: the created appointments and the records no slot was found for.
+    """
+    records = due_follow_ups(days, doctor_id).select_related('patient').only(
+        'patient_id', 'doctor_id', 'visit_date', 'follow_up_date', 'preview', 'patient__clinic',
+    )
+    by_doctor, seen = defaultdict(list), set()
+    for record in records:
+        if record.patient_id not in seen:
+            seen.add(record.patient_id)
+            by_doctor[record.doctor_id].append(record)
+
+    now = timezone.now()
+    drafts, unassigned = [], []
+    with transaction.atomic():
+        # Lock in a fixed order so concurrent runs cannot deadlock
+        list(User.objects.select_for_update().filter(pk__in=by_doctor).order_by('pk').values_list('pk'))
+        for doctor, doctor_records in by_doctor.items():
+            after = max(now, _day_start(doctor_records[0].follow_up_date))
+            window = (doctor_records[-1].follow_up_date - timezone.localdate(after)).days + settings.SLOT_SEARCH_DAYS
+            slots = iter(next_free_slots([doctor], count=None, after=after, days=max(window, 1)))
+            slot = next(slots, None)
+            doctor_drafts = []
+            for record in doctor_records:
+                not_before = max(now, _day_start(record.follow_up_date))
+                while slot and slot['start'] < not_before:
+                    slot = next(slots, None)
+                if slot is None:
+                    unassigned.append(record)
+                    continue
+                doctor_drafts.append(Appointment(
+                    patient_id=record.patient_id, doctor_id=doctor, clinic_id=record.patient.clinic_id,
+                    appointment_date=slot['start'], ends_at=slot['end'],
+                    duration_minutes=(slot['end'] - slot['start']).seconds // 60,
+                    status='draft', follow_up_for=record, reason=f'Follow-up: {record.preview}',
+                ))
+                slot = next(slots, None)
+
+            # The slot bitmaps are cached; confirm against the table before inserting
+            clashes = find_clashes(doctor, doctor_drafts)
+            for i, draft in enumerate(doctor_drafts):
+                if i in clashes:
+                    unassigned.append(draft.follow_up_for)
+                else:
+                    drafts.append(draft)
+
+        created = Appointment.objects.bulk_create(drafts)
+        after_bulk_create(created)
+    return created, unassigned
+
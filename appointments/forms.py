@@ -1,12 +1,47 @@
 from django import forms
 from .models import Appointment
+from .scheduling import MAX_OCCURRENCES, expand_recurrence
 
 class AppointmentForm(forms.ModelForm):
     class Meta:
         model = Appointment
-        fields = ['patient', 'doctor', 'appointment_date', 'reason', 'notes']
+        fields = ['patient', 'doctor', 'appointment_date', 'duration_minutes', 'reason', 'notes']
         widgets = {
             'appointment_date': forms.DateTimeInput(attrs={'type': 'datetime-local'}),
             'reason': forms.Textarea(attrs={'rows': 3}),
             'notes': forms.Textarea(attrs={'rows': 2}),
-        }
\ No newline at end of file
+        }
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['duration_minutes'].required = False
+        self.fields['duration_minutes'].help_text = 'Minutes; defaults to %d.' % Appointment.DEFAULT_DURATION
+    
+    def clean_duration_minutes(self):
+        return self.cleaned_data.get('duration_minutes') or Appointment.DEFAULT_DURATION
+
+class AppointmentSeriesForm(AppointmentForm):
+    """An appointment plus the rule it repeats by, e.g. weekly dressing changes."""
+    UNIT_CHOICES = (
+        ('weeks', 'Weeks'),
+        ('days', 'Days'),
+    )
+    
+    every = forms.IntegerField(min_value=1, max_value=52, initial=1)
+    unit = forms.ChoiceField(choices=UNIT_CHOICES, initial='weeks')
+    count = forms.IntegerField(min_value=1, max_value=MAX_OCCURRENCES, required=False, help_text='Number of appointments.')
+    until = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}), help_text='Or repeat up to this date.')
+    skip_conflicts = forms.BooleanField(required=False, label='Book the free dates even if some clash')
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('count') and not cleaned_data.get('until'):
+            raise forms.ValidationError('Give the number of appointments or an end date.')
+        return cleaned_data
+    
+    def occurrences(self):
+        data = self.cleaned_data
+        return expand_recurrence(
+            data['appointment_date'], every=data['every'], unit=data['unit'],
+            count=data.get('count'), until=data.get('until'),
+        )
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from appointments.follow_ups import book_follow_ups
+
+class Command(BaseCommand):
+    help = 'Creates draft appointments for due follow-ups in the requesting doctor\'s free slots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.FOLLOW_UP_DAYS, help='Book follow-ups due within this many days')
+        parser.add_argument('--doctor', type=int, help='Only this doctor\'s patients')
+
+    def handle(self, *args, **options):
+        created, unassigned = book_follow_ups(days=options['days'], doctor_id=options['doctor'])
+        self.stdout.write(self.style.SUCCESS(f'Created {len(created)} draft follow-up appointments.'))
+        for record in unassigned:
+            self.stdout.write(self.style.WARNING(
+                f'No free slot for patient {record.patient_id} (follow-up {record.follow_up_date}, doctor {record.doctor_id}).'
+            ))
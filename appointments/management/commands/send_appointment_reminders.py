@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+from appointments.reminders import dispatch_reminders, enqueue_reminders
+
+class Command(BaseCommand):
+    help = "Queues reminders for tomorrow's appointments and sends everything due in the outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=parse_date, help='Day to remind about (YYYY-MM-DD, default tomorrow)')
+        parser.add_argument('--workers', type=int, default=settings.REMINDER_WORKERS, help='Sending threads (1 runs inline)')
+        parser.add_argument('--batch-size', type=int, default=settings.REMINDER_BATCH_SIZE)
+        parser.add_argument('--no-send', action='store_true', help='Only queue reminders')
+
+    def handle(self, *args, **options):
+        queued = enqueue_reminders(day=options['date'], batch_size=options['batch_size'])
+        self.stdout.write(f'Queued {queued} reminders.')
+        if options['no_send']:
+            return
+        sent, failed = dispatch_reminders(workers=options['workers'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Sent {sent} reminders, {failed} failed.'))
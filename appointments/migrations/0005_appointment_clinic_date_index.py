@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0004_doctor_scheduling'),
+        ('core', '0001_initial'),
+        ('patients', '0006_medicalrecord_preview'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['clinic', 'appointment_date'], name='appointment_clinic__843526_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0006_appointment_checked_in_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='series',
+            field=models.UUIDField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -1,20 +1,30 @@
 from django.db import models
-from core.models import User, Clinic
-from patients.models import Patient
+from django.utils import timezone
+from core.models import User, Clinic, Department
+from patients.models import MedicalRecord, Patient
 
 class Appointment(models.Model):
     STATUS_CHOICES = (
+        ('draft', 'Draft'),
         ('scheduled', 'Scheduled'),
         ('confirmed', 'Confirmed'),
+        ('checked_in', 'Checked In'),
         ('in_progress', 'In Progress'),
         ('completed', 'Completed'),
         ('cancelled', 'Cancelled'),
         ('no_show', 'No Show'),
     )
     
+    # Statuses that occupy the doctor's time; a draft holds its slot until confirmed
+    BLOCKING_STATUSES = ('draft', 'scheduled', 'confirmed', 'checked_in', 'in_progress', 'completed')
+    DEFAULT_DURATION = 30  # minutes
+    MAX_DURATION = 240  # minutes; bounds the range scanned by conflict checks
+    
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
     doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='doctor_appointments')
     appointment_date = models.DateTimeField()
+    duration_minutes = models.PositiveSmallIntegerField(default=DEFAULT_DURATION)
+    ends_at = models.DateTimeField(editable=False)  # appointment_date + duration, maintained on save
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='scheduled')
     reason = models.TextField()
     notes = models.TextField(blank=True)
@@ -22,9 +32,117 @@ class Appointment(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     clinic = models.ForeignKey(Clinic, on_delete=models.CASCADE)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_appointments', null=True, blank=True)
+    series = models.UUIDField(null=True, blank=True, editable=False, db_index=True)  # shared by a recurring booking
+    follow_up_for = models.ForeignKey(MedicalRecord, on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='follow_up_appointments')
+    
+    def save(self, *args, **kwargs):
+        self.ends_at = self.appointment_date + timezone.timedelta(minutes=self.duration_minutes)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'ends_at'}
+        super().save(*args, **kwargs)
+    
+    @classmethod
+    def get_conflicts(cls, doctor_id, start, end, exclude_pk=None):
+        """
+        Appointments of a doctor that overlap ``[start, end)``.
+        
+        The (doctor, appointment_date) index narrows the scan to appointments
+        starting less than MAX_DURATION before ``start``; only those are
+        checked against their end time.
+        """
+        conflicts = cls.objects.filter(
+            doctor_id=doctor_id,
+            status__in=cls.BLOCKING_STATUSES,
+            appointment_date__gt=start - timezone.timedelta(minutes=cls.MAX_DURATION),
+            appointment_date__lt=end,
+            ends_at__gt=start,
+        )
+        if exclude_pk:
+            conflicts = conflicts.exclude(pk=exclude_pk)
+        return conflicts
     
     def __str__(self):
         return f"Appointment: {self.patient} with {self.doctor} on {self.appointment_date}"
     
     class Meta:
         ordering = ['-appointment_date']
+        indexes = [
+            models.Index(fields=['doctor', 'appointment_date']),
+            models.Index(fields=['clinic', 'appointment_date']),
+            models.Index(fields=['status', 'appointment_date']),
+            models.Index(fields=['patient', 'appointment_date']),
+        ]
+
+class DoctorSchedule(models.Model):
+    """Weekly working-hours template: one row per doctor, weekday and session."""
+    WEEKDAY_CHOICES = (
+        (0, 'Monday'),
+        (1, 'Tuesday'),
+        (2, 'Wednesday'),
+        (3, 'Thursday'),
+        (4, 'Friday'),
+        (5, 'Saturday'),
+        (6, 'Sunday'),
+    )
+    
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='schedules')
+    department = models.ForeignKey(Department, on_delete=models.SET_NULL, null=True, blank=True, related_name='schedules')
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    slot_minutes = models.PositiveSmallIntegerField(default=Appointment.DEFAULT_DURATION)
+    is_active = models.BooleanField(default=True)
+    
+    def __str__(self):
+        return f"{self.doctor} {self.get_weekday_display()} {self.start_time}-{self.end_time}"
+    
+    class Meta:
+        ordering = ['doctor', 'weekday', 'start_time']
+        indexes = [
+            models.Index(fields=['doctor', 'weekday']),
+            models.Index(fields=['department', 'weekday']),
+        ]
+
+class ReminderOutbox(models.Model):
+    """
+    One reminder message per appointment and start time, waiting to be sent.
+    
+    The unique key makes queueing idempotent, and a moved appointment gets
+    a fresh reminder for its new time.
+    """
+    CHANNEL_CHOICES = (
+        ('email', 'Email'),
+        ('sms', 'SMS'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),  # the appointment was cancelled or moved before sending
+    )
+    
+    appointment = models.ForeignKey(Appointment, on_delete=models.CASCADE, related_name='reminders')
+    appointment_date = models.DateTimeField()
+    channel = models.CharField(max_length=10, choices=CHANNEL_CHOICES)
+    recipient = models.CharField(max_length=254)
+    subject = models.CharField(max_length=200, blank=True)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)  # also the lease expiry while sending
+    lease = models.UUIDField(null=True, blank=True, editable=False)  # identifies the dispatcher holding the row
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Reminder for appointment {self.appointment_id} to {self.recipient} ({self.status})"
+    
+    class Meta:
+        ordering = ['next_attempt_at']
+        unique_together = ['appointment', 'appointment_date']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
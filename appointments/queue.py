@@ -0,0 +1,161 @@
+"""
+Live queue updates for waiting-room and doctor screens.
+
+Status changes are published to an in-process broker, and each open
+server-sent-events stream holds a subscription to its clinic or doctor
+channel. A connected screen costs one query when it opens and none
+afterwards.
+
+Holding a stream open needs an ASGI server (see README, e.g. uvicorn
+hms_project.asgi:application). Under WSGI, including runserver, a stream
+would tie up a worker thread for as long as the screen is open, so there
+the view sends a single snapshot with an SSE ``retry`` interval and ends
+the response: the browser's EventSource reconnects every
+QUEUE_POLL_SECONDS and so polls for a fresh snapshot instead.
+
+The broker only reaches streams served by the same process. Deployments
+running several ASGI workers should put a shared pub/sub (e.g. Redis)
+behind the same ``subscribe``/``publish`` interface.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+QUEUE_STATUSES = ('scheduled', 'confirmed', 'checked_in', 'in_progress', 'completed')
+SUBSCRIPTION_BUFFER = 100
+KEEPALIVE_SECONDS = 15
+QUEUE_POLL_SECONDS = 5
+
+
+def channels_for(clinic_id, doctor_id):
+    return (f'clinic:{clinic_id}', f'doctor:{doctor_id}')
+
+
+class Subscription:
+    """An async iterator of events published to any of its channels."""
+
+    def __init__(self, broker, channels):
+        self.broker = broker
+        self.channels = channels
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=SUBSCRIPTION_BUFFER)
+
+    def deliver(self, event):
+        # Called from whichever thread published; hand over to the stream's loop
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            self.close()  # the loop has shut down
+
+    def _put(self, event):
+        if self.queue.full():
+            self.queue.get_nowait()  # a slow screen loses its oldest update, not the newest
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channels):
+        """Subscribe the running event loop to ``channels``."""
+        subscription = Subscription(self, tuple(channels))
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscriptions[channel].discard(subscription)
+                if not self._subscriptions[channel]:
+                    del self._subscriptions[channel]
+
+    def publish(self, channels, event):
+        """Deliver ``event`` once to every subscription on any of ``channels``. Thread-safe."""
+        with self._lock:
+            subscriptions = set().union(*(self._subscriptions.get(channel, ()) for channel in channels))
+        for subscription in subscriptions:
+            subscription.deliver(event)
+
+
+broker = LocalBroker()
+
+
+def queue_entry(appointment):
+    return {
+        'id': appointment.pk,
+        'status': appointment.status,
+        'status_display': appointment.get_status_display(),
+        'appointment_date': appointment.appointment_date,
+        'patient': f"{appointment.patient.first_name} {appointment.patient.last_name}",
+        'doctor_id': appointment.doctor_id,
+        'clinic_id': appointment.clinic_id,
+    }
+
+
+def publish_status_change(appointment):
+    broker.publish(channels_for(appointment.clinic_id, appointment.doctor_id), queue_entry(appointment))
+
+
+def today_queue(clinic_id=None, doctor_id=None):
+    """Today's queue for a clinic or doctor, for the snapshot a screen starts from."""
+    from .models import Appointment
+
+    today = timezone.localdate()
+    appointments = Appointment.objects.filter(
+        appointment_date__date=today, status__in=QUEUE_STATUSES
+    ).select_related('patient').only(
+        'status', 'appointment_date', 'doctor_id', 'clinic_id', 'patient__first_name', 'patient__last_name'
+    ).order_by('appointment_date')
+    if clinic_id:
+        appointments = appointments.filter(clinic_id=clinic_id)
+    if doctor_id:
+        appointments = appointments.filter(doctor_id=doctor_id)
+    return appointments
+
+
+def format_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def event_stream(channels, snapshot_queryset):
+    """
+    Server-sent events: one ``snapshot`` of today's queue, then a ``queue``
+    event per status change, with keepalive comments in between.
+    """
+    # Subscribe before reading the snapshot so no change falls in between
+    subscription = broker.subscribe(channels)
+    try:
+        snapshot = [queue_entry(appointment) async for appointment in snapshot_queryset]
+        yield format_event('snapshot', snapshot)
+        while True:
+            try:
+                event = await subscription.get(timeout=KEEPALIVE_SECONDS)
+            except TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            yield format_event('queue', event)
+    finally:
+        subscription.close()
+
+
+def snapshot_events(snapshot_queryset):
+    """
+    The WSGI fallback: one ``snapshot`` event, after which the client
+    reconnects in QUEUE_POLL_SECONDS.
+    """
+    yield f"retry: {QUEUE_POLL_SECONDS * 1000}\n\n"
+    yield format_event('snapshot', [queue_entry(appointment) for appointment in snapshot_queryset])
@@ -0,0 +1,306 @@
+"""
+Appointment reminders through an outbox table.
+
+Queueing and sending are separate steps. ``enqueue_reminders`` reads a
+day's bookable appointments with one range query on the (status,
+appointment_date) index, renders the messages and bulk-inserts them into
+ReminderOutbox; appointments that already have a reminder for their
+current time are skipped, so queueing can be repeated safely.
+
+``dispatch_reminders`` drains the outbox on a pool of worker threads.
+Each worker leases a batch of due rows, hands it to the transport for the
+row's channel and records the outcome: sent rows are never picked up
+again, failed ones are retried with exponential backoff until
+REMINDER_MAX_ATTEMPTS. Just before sending, the leased rows are checked
+against their appointments: a row whose appointment has since been
+cancelled or moved to another time is marked cancelled instead (a moved
+appointment is queued again for its new time). A worker that dies
+mid-batch leaves its rows leased; they become due again when the lease
+runs out, so a message can at worst be delivered twice, never lost.
+
+Transports are configured per channel in REMINDER_BACKENDS as dotted paths
+to BaseBackend subclasses.
+"""
+import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Exists, F, OuterRef
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Appointment, ReminderOutbox
+
+REMIND_STATUSES = ('scheduled', 'confirmed')
+
+
+class BaseBackend:
+    """A reminder transport. Instances are used by one worker thread at a time."""
+
+    def send_messages(self, reminders):
+        """
+        Deliver a batch of ReminderOutbox rows.
+
+        Returns:
+            dict: an error message for each reminder pk that was not delivered.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ConsoleBackend(BaseBackend):
+    """Writes reminders to stdout, for development."""
+    lock = threading.Lock()
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def format(self, reminder):
+        return f"To: {reminder.recipient} ({reminder.channel})\nSubject: {reminder.subject}\n\n{reminder.body}\n{'-' * 72}\n"
+
+    def send_messages(self, reminders):
+        text = ''.join(self.format(reminder) for reminder in reminders)
+        with self.lock:
+            self.stream.write(text)
+            self.stream.flush()
+        return {}
+
+
+class FileBackend(ConsoleBackend):
+    """Appends reminders to REMINDER_FILE_PATH."""
+
+    def __init__(self):
+        super().__init__(stream=open(settings.REMINDER_FILE_PATH, 'a', encoding='utf-8'))
+
+    def close(self):
+        self.stream.close()
+
+
+class EmailBackend(BaseBackend):
+    """Sends email reminders over Django's EMAIL_BACKEND (SMTP in production) on one connection."""
+
+    def __init__(self):
+        self.connection = get_connection(fail_silently=False)
+
+    def send_messages(self, reminders):
+        errors = {}
+        self.connection.open()
+        for reminder in reminders:
+            message = EmailMessage(reminder.subject, reminder.body, to=[reminder.recipient], connection=self.connection)
+            try:
+                message.send()
+            except Exception as e:
+                errors[reminder.pk] = str(e) or e.__class__.__name__
+        return errors
+
+    def close(self):
+        self.connection.close()
+
+
+def get_backends():
+    """Fresh transport instances per channel, for one worker."""
+    return {channel: import_string(path)() for channel, path in settings.REMINDER_BACKENDS.items()}
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def build_reminder(appointment, template):
+    """An unsaved outbox row for an appointment, by email if the patient has an address, else by SMS."""
+    patient = appointment.patient
+    channel, recipient = ('email', patient.email) if patient.email else ('sms', patient.phone)
+    if not recipient:
+        return None
+    when = timezone.localtime(appointment.appointment_date)
+    body = template.render({
+        'appointment': appointment,
+        'patient': patient,
+        'doctor': appointment.doctor.get_full_name() or appointment.doctor.username,
+        'clinic': appointment.clinic,
+        'when': when,
+        'channel': channel,
+    }).strip()
+    return ReminderOutbox(
+        appointment_id=appointment.pk,
+        appointment_date=appointment.appointment_date,
+        channel=channel,
+        recipient=recipient,
+        subject=f"Appointment reminder: {when:%a %d %b %H:%M}" if channel == 'email' else '',
+        body=body,
+    )
+
+
+def enqueue_reminders(day=None, batch_size=None):
+    """
+    Queue reminders for the appointments on ``day`` (tomorrow by default).
+
+    Returns:
+        int: the number of reminders queued.
+    """
+    day = day or timezone.localdate() + timedelta(days=1)
+    batch_size = batch_size or settings.REMINDER_BATCH_SIZE
+    start, end = day_bounds(day)
+    already_queued = ReminderOutbox.objects.filter(
+        appointment=OuterRef('pk'), appointment_date=OuterRef('appointment_date')
+    )
+    appointments = Appointment.objects.filter(
+        status__in=REMIND_STATUSES, appointment_date__gte=start, appointment_date__lt=end,
+    ).exclude(Exists(already_queued)).select_related('patient', 'doctor', 'clinic').only(
+        'appointment_date', 'duration_minutes',
+        'patient__first_name', 'patient__last_name', 'patient__email', 'patient__phone',
+        'doctor__first_name', 'doctor__last_name', 'doctor__username',
+        'clinic__name', 'clinic__phone',
+    ).order_by()
+
+    template = get_template('appointments/reminder.txt')
+    queued, batch = 0, []
+    for appointment in appointments.iterator(chunk_size=batch_size):
+        reminder = build_reminder(appointment, template)
+        if reminder:
+            batch.append(reminder)
+        if len(batch) >= batch_size:
+            queued, batch = queued + _insert_reminders(batch), []
+    if batch:
+        queued += _insert_reminders(batch)
+    return queued
+
+
+def _insert_reminders(batch):
+    """Insert outbox rows, skipping any a concurrent run queued first. Returns the number inserted."""
+    existing = ReminderOutbox.objects.filter(appointment_id__in=[reminder.appointment_id for reminder in batch])
+    with transaction.atomic():
+        before = existing.count()
+        # ignore_conflicts hides which rows were dropped, so count them instead
+        ReminderOutbox.objects.bulk_create(batch, ignore_conflicts=True)
+        return existing.count() - before
+
+
+def claim_batch(batch_size):
+    """
+    Lease up to ``batch_size`` due reminders to the caller.
+
+    The conditional update only takes rows that are still due, so two
+    dispatchers never lease the same row; ``skip_locked`` keeps them from
+    queueing behind each other where the database supports it.
+    """
+    now = timezone.now()
+    lease = uuid.uuid4()
+    due = ReminderOutbox.objects.filter(status__in=('pending', 'sending'), next_attempt_at__lte=now)
+    with transaction.atomic():
+        ids = list(due.select_for_update(skip_locked=True).order_by('next_attempt_at').values_list('pk', flat=True)[:batch_size])
+        due.filter(pk__in=ids).update(
+            status='sending', lease=lease,
+            next_attempt_at=now + timedelta(seconds=settings.REMINDER_LEASE_SECONDS),
+        )
+    return list(ReminderOutbox.objects.filter(lease=lease, status='sending'))
+
+
+def drop_stale(reminders):
+    """
+    Mark leased reminders whose appointment is no longer bookable or has
+    moved as cancelled. Returns the reminders that are still current.
+    """
+    current = set(ReminderOutbox.objects.filter(
+        pk__in=[reminder.pk for reminder in reminders],
+        appointment__status__in=REMIND_STATUSES,
+        appointment__appointment_date=F('appointment_date'),
+    ).values_list('pk', flat=True))
+    stale = [reminder.pk for reminder in reminders if reminder.pk not in current]
+    if stale:
+        ReminderOutbox.objects.filter(pk__in=stale).update(
+            status='cancelled', lease=None, last_error='Appointment cancelled or moved before sending.',
+        )
+    return [reminder for reminder in reminders if reminder.pk in current]
+
+
+def send_batch(reminders, backends):
+    """Send leased reminders and record the outcome. Returns ``(sent, failed)`` counts."""
+    reminders = drop_stale(reminders)
+    by_channel = {}
+    for reminder in reminders:
+        by_channel.setdefault(reminder.channel, []).append(reminder)
+    errors = {}
+    for channel, batch in by_channel.items():
+        backend = backends.get(channel)
+        if backend is None:
+            errors.update((reminder.pk, f'No backend for {channel} reminders.') for reminder in batch)
+            continue
+        try:
+            errors.update(backend.send_messages(batch))
+        except Exception as e:
+            errors.update((reminder.pk, str(e) or e.__class__.__name__) for reminder in batch)
+
+    now = timezone.now()
+    sent_ids = [reminder.pk for reminder in reminders if reminder.pk not in errors]
+    ReminderOutbox.objects.filter(pk__in=sent_ids).update(
+        status='sent', sent_at=now, attempts=F('attempts') + 1, last_error='', lease=None,
+    )
+    failed = [reminder for reminder in reminders if reminder.pk in errors]
+    for reminder in failed:
+        reminder.attempts += 1
+        reminder.last_error = errors[reminder.pk]
+        reminder.lease = None
+        if reminder.attempts >= settings.REMINDER_MAX_ATTEMPTS:
+            reminder.status = 'failed'
+        else:
+            reminder.status = 'pending'
+            backoff = settings.REMINDER_RETRY_MINUTES * 2 ** (reminder.attempts - 1)
+            reminder.next_attempt_at = now + timedelta(minutes=backoff)
+    ReminderOutbox.objects.bulk_update(failed, ['attempts', 'last_error', 'lease', 'status', 'next_attempt_at'])
+    return len(sent_ids), len(failed)
+
+
+def _drain(batch_size):
+    backends = get_backends()
+    sent = failed = 0
+    try:
+        while True:
+            reminders = claim_batch(batch_size)
+            if not reminders:
+                break
+            batch_sent, batch_failed = send_batch(reminders, backends)
+            sent += batch_sent
+            failed += batch_failed
+    finally:
+        for backend in backends.values():
+            backend.close()
+    return sent, failed
+
+
+def _drain_in_thread(batch_size):
+    # Pool threads live outside the request cycle, so honour CONN_MAX_AGE here
+    close_old_connections()
+    try:
+        return _drain(batch_size)
+    finally:
+        connection.close()
+
+
+def dispatch_reminders(workers=None, batch_size=None):
+    """
+    Send every due reminder using ``workers`` threads, each with its own
+    database connection and transports.
+
+    Databases without ``SKIP LOCKED`` (SQLite) allow one writer at a time,
+    so there the outbox is drained on the calling thread.
+
+    Returns:
+        tuple: the number of reminders sent and the number that failed.
+    """
+    workers = workers or settings.REMINDER_WORKERS
+    batch_size = batch_size or settings.REMINDER_BATCH_SIZE
+    if workers <= 1 or connection.in_atomic_block or not connection.features.has_select_for_update_skip_locked:
+        return _drain(batch_size)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reminders') as executor:
+        results = list(executor.map(_drain_in_thread, [batch_size] * workers))
+    return sum(sent for sent, _ in results), sum(failed for _, failed in results)
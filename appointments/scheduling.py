@@ -0,0 +1,359 @@
+"""
+Doctor availability and conflict-free booking.
+
+A doctor's working day is the set of slots generated from their active
+DoctorSchedule sessions for that weekday. Which of those slots are still
+free is kept as an integer bitmap per doctor and day in the cache, so
+"next free slot" searches touch the database only for days that are not
+cached yet. The bitmaps are dropped when an appointment on that day
+changes, and a schedule change retires all of a doctor's bitmaps at once.
+
+Recurring series are expanded up front and booked together: one query
+finds every existing appointment any occurrence would overlap, and the
+free occurrences are inserted with a single bulk insert.
+
+Bookings for one doctor are serialized by locking the doctor's User row.
+SQLite has no row locks, so there two concurrent bookings both read and
+the second to write fails with "database is locked"; ``_serialized``
+retries it, and the retry sees the first booking as a conflict.
+"""
+import random
+import uuid
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from time import sleep
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import User
+from patients.timeline import invalidate_timeline
+from .models import Appointment, DoctorSchedule
+from .queue import publish_status_change
+
+RECURRENCE_UNITS = {'days': 1, 'weeks': 7}
+MAX_OCCURRENCES = 52
+BOOKING_ATTEMPTS = 5
+
+
+def _version_key(doctor_id):
+    return f'slot-bitmap:{doctor_id}:version'
+
+
+def _day_key(doctor_id, day):
+    version = cache.get_or_set(_version_key(doctor_id), lambda: uuid.uuid4().hex, None)
+    return f'slot-bitmap:{doctor_id}:{version}:{day.isoformat()}'
+
+
+def invalidate_doctor_slots(doctor_id):
+    """Forget every cached day of a doctor, e.g. after a schedule change."""
+    cache.set(_version_key(doctor_id), uuid.uuid4().hex, None)
+
+
+def invalidate_day_slots(doctor_id, start, end):
+    """Forget the cached days an appointment from ``start`` to ``end`` touches."""
+    day = timezone.localdate(start)
+    last_day = timezone.localdate(end)
+    keys = []
+    while day <= last_day:
+        keys.append(_day_key(doctor_id, day))
+        day += timedelta(days=1)
+    cache.delete_many(keys)
+
+
+def get_schedules(doctor_ids):
+    """Active sessions as ``{doctor_id: {weekday: [schedule, ...]}}`` in one query."""
+    schedules = defaultdict(lambda: defaultdict(list))
+    for schedule in DoctorSchedule.objects.filter(doctor_id__in=doctor_ids, is_active=True).order_by('start_time'):
+        schedules[schedule.doctor_id][schedule.weekday].append(schedule)
+    return schedules
+
+
+def slot_starts(day, sessions):
+    """Return ``(start, end)`` pairs for the slots of ``day`` in the given sessions."""
+    slots = []
+    for session in sessions:
+        length = timedelta(minutes=session.slot_minutes)
+        start = timezone.make_aware(datetime.combine(day, session.start_time))
+        session_end = timezone.make_aware(datetime.combine(day, session.end_time))
+        while start + length <= session_end:
+            slots.append((start, start + length))
+            start += length
+    return slots
+
+
+def free_mask(doctor_id, day, slots):
+    """
+    Bitmap of free slots for a doctor's day; bit ``i`` is set when ``slots[i]`` is free.
+
+    Built with one indexed query on a cache miss.
+    """
+    key = _day_key(doctor_id, day)
+    mask = cache.get(key)
+    if mask is None:
+        mask = (1 << len(slots)) - 1
+        if slots:
+            booked = Appointment.objects.filter(
+                doctor_id=doctor_id,
+                status__in=Appointment.BLOCKING_STATUSES,
+                appointment_date__gt=slots[0][0] - timedelta(minutes=Appointment.MAX_DURATION),
+                appointment_date__lt=slots[-1][1],
+                ends_at__gt=slots[0][0],
+            ).values_list('appointment_date', 'ends_at')
+            for booked_start, booked_end in booked:
+                for i, (start, end) in enumerate(slots):
+                    if booked_start < end and booked_end > start:
+                        mask &= ~(1 << i)
+        cache.set(key, mask, settings.SLOT_CACHE_TIMEOUT)
+    return mask
+
+
+def next_free_slots(doctor_ids, count=5, after=None, days=None):
+    """
+    The earliest ``count`` free slots across the given doctors (all of them
+    within ``days`` if ``count`` is None).
+
+    Returns:
+        list: dicts with ``doctor_id``, ``start`` and ``end``, in start order.
+    """
+    after = after or timezone.now()
+    days = days or settings.SLOT_SEARCH_DAYS
+    schedules = get_schedules(doctor_ids)
+
+    found = []
+    day = timezone.localdate(after)
+    for _ in range(days):
+        day_slots = []
+        for doctor_id, by_weekday in schedules.items():
+            slots = slot_starts(day, by_weekday.get(day.weekday(), []))
+            mask = free_mask(doctor_id, day, slots)
+            day_slots.extend(
+                {'doctor_id': doctor_id, 'start': start, 'end': end}
+                for i, (start, end) in enumerate(slots)
+                if mask >> i & 1 and start >= after
+            )
+        found.extend(sorted(day_slots, key=lambda slot: (slot['start'], slot['doctor_id'])))
+        if count is not None and len(found) >= count:
+            break
+        day += timedelta(days=1)
+    return found[:count]
+
+
+def doctors_in_department(department_id):
+    return list(DoctorSchedule.objects.filter(
+        department_id=department_id, is_active=True
+    ).values_list('doctor_id', flat=True).distinct())
+
+
+def within_working_hours(sessions_by_weekday, start, end):
+    """Whether ``[start, end)`` falls inside one of the doctor's sessions for that weekday."""
+    local_start = timezone.localtime(start)
+    local_end = timezone.localtime(end)
+    end_time = local_end.time()
+    if local_end.date() != local_start.date():
+        if local_end.date() - local_start.date() > timedelta(days=1) or end_time != time(0):
+            return False  # runs past midnight
+        end_time = time.max
+    return any(
+        session.start_time <= local_start.time() and end_time <= session.end_time
+        for session in sessions_by_weekday.get(local_start.weekday(), [])
+    )
+
+
+def check_working_hours(doctor_id, start, end):
+    """Raise ValidationError if a doctor with a schedule is not working at that time."""
+    sessions = get_schedules([doctor_id]).get(doctor_id)
+    if not sessions:
+        return  # no template configured: any time may be booked
+    if not within_working_hours(sessions, start, end):
+        raise ValidationError('The doctor is not working at this time.')
+
+
+def _serialized(book):
+    """
+    Run ``book``, a booking transaction for one doctor, retrying it when
+    SQLite reports the database locked by a concurrent booking.
+
+    Raises:
+        ValidationError: the lock could not be had, or the booking is part
+        of an outer transaction and so cannot be retried.
+    """
+    for attempt in range(BOOKING_ATTEMPTS):
+        try:
+            return book()
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            if connection.in_atomic_block or attempt == BOOKING_ATTEMPTS - 1:
+                raise ValidationError('Another booking for this doctor is being saved. Please try again.')
+            sleep(random.uniform(0.05, 0.2) * (attempt + 1))
+
+
+def book_appointment(appointment):
+    """
+    Save an appointment unless it overlaps another booking of the same doctor.
+
+    The doctor's row is locked for the duration of the check and insert, so
+    concurrent bookings for one doctor are handled one at a time and cannot
+    both pass the conflict check (on SQLite, see ``_serialized``).
+
+    Raises:
+        ValidationError: if the time is outside working hours or already taken.
+    """
+    start = appointment.appointment_date
+    end = start + timedelta(minutes=appointment.duration_minutes)
+    if appointment.duration_minutes > Appointment.MAX_DURATION:
+        raise ValidationError(f'Appointments cannot be longer than {Appointment.MAX_DURATION} minutes.')
+
+    def book():
+        with transaction.atomic():
+            list(User.objects.select_for_update().filter(pk=appointment.doctor_id).values_list('pk'))
+            if appointment.status in Appointment.BLOCKING_STATUSES:
+                check_working_hours(appointment.doctor_id, start, end)
+                conflict = Appointment.get_conflicts(
+                    appointment.doctor_id, start, end, exclude_pk=appointment.pk
+                ).order_by('appointment_date').first()
+                if conflict:
+                    raise ValidationError(
+                        'The doctor already has an appointment from %s to %s.' % (
+                            timezone.localtime(conflict.appointment_date).strftime('%H:%M'),
+                            timezone.localtime(conflict.ends_at).strftime('%H:%M'),
+                        )
+                    )
+            appointment.save()
+
+    _serialized(book)
+    return appointment
+
+
+def expand_recurrence(start, every=1, unit='weeks', count=None, until=None):
+    """
+    Start times of a series repeating every ``every`` days or weeks.
+
+    The series stops after ``count`` occurrences or at the last one on or
+    before the date ``until``, and never exceeds MAX_OCCURRENCES. Each
+    occurrence keeps the local time of day of ``start``, also across
+    daylight-saving changes.
+    """
+    if count is None and until is None:
+        raise ValueError('A series needs a count or an end date.')
+    step = timedelta(days=every * RECURRENCE_UNITS[unit])
+    limit = min(count or MAX_OCCURRENCES, MAX_OCCURRENCES)
+    local = timezone.localtime(start).replace(tzinfo=None)
+    starts = []
+    while len(starts) < limit and (until is None or local.date() <= until):
+        starts.append(timezone.make_aware(local))
+        local += step
+    return starts
+
+
+def find_clashes(doctor_id, occurrences):
+    """
+    Check unsaved appointments of one doctor against the schedule and existing bookings.
+
+    Every appointment any occurrence would overlap is read in one query, and
+    the occurrences are matched against them in Python. Call this with the
+    doctor's row locked, as book_appointment does.
+
+    Returns:
+        dict: a reason for each clashing occurrence, keyed by its index.
+    """
+    if not occurrences:
+        return {}
+    reach = timedelta(minutes=Appointment.MAX_DURATION)
+    sessions = get_schedules([doctor_id]).get(doctor_id)
+    overlapping = Q()
+    for occurrence in occurrences:
+        overlapping |= Q(
+            appointment_date__gt=occurrence.appointment_date - reach,
+            appointment_date__lt=occurrence.ends_at,
+            ends_at__gt=occurrence.appointment_date,
+        )
+    booked = list(Appointment.objects.filter(
+        overlapping, doctor_id=doctor_id, status__in=Appointment.BLOCKING_STATUSES,
+    ).order_by().values_list('appointment_date', 'ends_at'))
+
+    clashes = {}
+    for i, occurrence in enumerate(occurrences):
+        start, end = occurrence.appointment_date, occurrence.ends_at
+        if sessions and not within_working_hours(sessions, start, end):
+            clashes[i] = 'The doctor is not working at this time.'
+            continue
+        conflict = min((b for b in booked if b[0] < end and b[1] > start), default=None)
+        if conflict:
+            clashes[i] = 'The doctor already has an appointment from %s to %s.' % (
+                timezone.localtime(conflict[0]).strftime('%H:%M'),
+                timezone.localtime(conflict[1]).strftime('%H:%M'),
+            )
+    return clashes
+
+
+def after_bulk_create(appointments):
+    """Do for bulk-created appointments what the post_save handlers would have done."""
+    for appointment in appointments:
+        invalidate_day_slots(appointment.doctor_id, appointment.appointment_date, appointment.ends_at)
+    for patient_id in {appointment.patient_id for appointment in appointments}:
+        invalidate_timeline(patient_id)
+    today = timezone.localdate()
+    for appointment in appointments:
+        if timezone.localdate(appointment.appointment_date) == today:
+            transaction.on_commit(lambda appointment=appointment: publish_status_change(appointment))
+
+
+def book_series(template, starts, skip_conflicts=False):
+    """
+    Book a copy of ``template`` at each of ``starts`` in one transaction.
+
+    Like book_appointment, the doctor's row is locked while checking, and a
+    booking that loses a SQLite lock is retried. The
+    whole series is checked with find_clashes, and the bookable occurrences
+    are inserted with ``bulk_create``, sharing a ``series`` id.
+
+    Args:
+        template: an unsaved Appointment giving everything but the start time.
+        starts: the occurrence start times, e.g. from expand_recurrence.
+        skip_conflicts: book the free occurrences even if others clash.
+            Otherwise nothing is booked when any occurrence clashes.
+
+    Returns:
+        tuple: the created appointments and a list of ``(start, reason)``
+        for the occurrences that clashed.
+
+    Raises:
+        ValidationError: if the duration is too long.
+    """
+    if template.duration_minutes > Appointment.MAX_DURATION:
+        raise ValidationError(f'Appointments cannot be longer than {Appointment.MAX_DURATION} minutes.')
+    duration = timedelta(minutes=template.duration_minutes)
+    series = uuid.uuid4()
+    occurrences = [
+        Appointment(
+            patient=template.patient, doctor_id=template.doctor_id, clinic_id=template.clinic_id,
+            created_by_id=template.created_by_id, reason=template.reason, notes=template.notes,
+            status=template.status, appointment_date=start, duration_minutes=template.duration_minutes,
+            ends_at=start + duration,  # bulk_create skips save()
+            series=series,
+        )
+        for start in sorted(starts)
+    ]
+    if not occurrences:
+        return [], []
+
+    def book():
+        with transaction.atomic():
+            list(User.objects.select_for_update().filter(pk=template.doctor_id).values_list('pk'))
+            reasons = find_clashes(template.doctor_id, occurrences)
+            clashes = [(occurrences[i].appointment_date, reason) for i, reason in sorted(reasons.items())]
+            if clashes and not skip_conflicts:
+                return [], clashes
+            created = Appointment.objects.bulk_create(
+                [occurrence for i, occurrence in enumerate(occurrences) if i not in reasons]
+            )
+            after_bulk_create(created)
+        return created, clashes
+
+    return _serialized(book)
@@ -0,0 +1,39 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .models import Appointment, DoctorSchedule
+from .queue import publish_status_change
+from .scheduling import invalidate_day_slots, invalidate_doctor_slots
+
+@receiver(pre_save, sender=Appointment)
+def remember_previous_slot(sender, instance, raw=False, **kwargs):
+    """Note where the appointment was before, so a move frees its old slot"""
+    instance._previous_slot = None
+    instance._previous_status = None
+    if instance.pk and not raw:
+        previous = Appointment.objects.filter(pk=instance.pk).values_list(
+            'doctor_id', 'appointment_date', 'ends_at', 'status'
+        ).first()
+        if previous:
+            instance._previous_slot = previous[:3]
+            instance._previous_status = previous[3]
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def invalidate_appointment_slots(sender, instance, **kwargs):
+    """Drop the cached free-slot bitmaps of the days the appointment touches"""
+    invalidate_day_slots(instance.doctor_id, instance.appointment_date, instance.ends_at)
+    previous = getattr(instance, '_previous_slot', None)
+    if previous:
+        invalidate_day_slots(*previous)
+
+@receiver(post_save, sender=DoctorSchedule)
+@receiver(post_delete, sender=DoctorSchedule)
+def invalidate_schedule_slots(sender, instance, **kwargs):
+    invalidate_doctor_slots(instance.doctor_id)
+
+@receiver(post_save, sender=Appointment)
+def publish_queue_change(sender, instance, created, raw=False, **kwargs):
+    """Push new appointments and status changes to open queue screens once committed"""
+    if not raw and (created or instance.status != getattr(instance, '_previous_status', None)):
+        transaction.on_commit(lambda: publish_status_change(instance))
@@ -1,9 +1,23 @@
-from django.test import TestCase, Client
+import asyncio
+import json
+import threading
+from datetime import datetime, time, timedelta
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import F
+from unittest import mock
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
 from django.utils import timezone
-from core.models import User, Clinic
-from patients.models import Patient
-from .models import Appointment
+from core.models import User, Clinic, Department
+from patients.models import MedicalRecord, Patient
+from .models import Appointment, DoctorSchedule, ReminderOutbox
+from .follow_ups import book_follow_ups, due_follow_ups
+from .reminders import BaseBackend, _insert_reminders, dispatch_reminders, enqueue_reminders
+from .scheduling import book_appointment, book_series, expand_recurrence, next_free_slots
+from .queue import broker
 
 class AppointmentCreateTestCase(TestCase):
     def setUp(self):
@@ -63,3 +77,424 @@ class AppointmentListTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.context['page_obj']), 1)
         self.assertEqual(response.context['page_obj'][0], self.appointment2)
+
+
+class SchedulingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.department = Department.objects.create(name='Outpatients', clinic=self.clinic)
+        self.doctor = User.objects.create_user(username='doctor1', password='password', user_type='doctor')
+        self.other_doctor = User.objects.create_user(username='doctor2', password='password', user_type='doctor')
+        self.patient = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01', clinic=self.clinic)
+        self.client.login(username='doctor1', password='password')
+
+        today = timezone.localdate()
+        self.monday = today + timedelta(days=7 - today.weekday())
+        for doctor in (self.doctor, self.other_doctor):
+            DoctorSchedule.objects.create(doctor=doctor, department=self.department, weekday=0, start_time=time(9), end_time=time(10), slot_minutes=30)
+
+    def at(self, hour, minute=0):
+        return timezone.make_aware(datetime.combine(self.monday, time(hour, minute)))
+
+    def appointment(self, start, duration=30, doctor=None):
+        return Appointment(patient=self.patient, doctor=doctor or self.doctor, appointment_date=start,
+                           duration_minutes=duration, clinic=self.clinic, reason='Checkup')
+
+    def test_conflicts(self):
+        book_appointment(self.appointment(self.at(9), duration=45))
+        with self.assertRaises(ValidationError):
+            book_appointment(self.appointment(self.at(9, 30)))
+        book_appointment(self.appointment(self.at(9, 45), duration=15))
+        book_appointment(self.appointment(self.at(9), doctor=self.other_doctor))
+
+        Appointment.objects.filter(doctor=self.doctor).update(status='cancelled')
+        book_appointment(self.appointment(self.at(9, 30)))
+
+    def test_working_hours(self):
+        with self.assertRaises(ValidationError):
+            book_appointment(self.appointment(self.at(9, 45)))  # runs past 10:00
+        with self.assertRaises(ValidationError):
+            book_appointment(self.appointment(self.at(9) + timedelta(days=1)))  # Tuesday
+
+    def test_next_free_slots_use_cached_bitmaps(self):
+        slots = next_free_slots([self.doctor.pk], count=3, after=self.at(0))
+        self.assertEqual([slot['start'] for slot in slots], [self.at(9), self.at(9, 30), self.at(9) + timedelta(days=7)])
+
+        with self.assertNumQueries(1):  # schedules only
+            next_free_slots([self.doctor.pk], count=3, after=self.at(0))
+
+        book_appointment(self.appointment(self.at(9)))
+        slots = next_free_slots([self.doctor.pk], count=1, after=self.at(0))
+        self.assertEqual(slots[0]['start'], self.at(9, 30))
+
+    def test_free_slots_api_by_department(self):
+        book_appointment(self.appointment(self.at(9)))
+        response = self.client.get(reverse('api-free-slots'), {
+            'department': self.department.pk, 'count': 3, 'after': self.at(0).isoformat(),
+        })
+        results = response.json()['results']
+        self.assertEqual(
+            [(slot['doctor_id'], slot['start']) for slot in results],
+            [(self.other_doctor.pk, self.at(9).isoformat()),
+             (self.doctor.pk, self.at(9, 30).isoformat()),
+             (self.other_doctor.pk, self.at(9, 30).isoformat())],
+        )
+        self.assertEqual(self.client.get(reverse('api-free-slots')).status_code, 400)
+
+    def test_create_view_rejects_double_booking(self):
+        book_appointment(self.appointment(self.at(9)))
+        response = self.client.post(reverse('appointment-create'), {
+            'patient': self.patient.pk, 'doctor': self.doctor.pk,
+            'appointment_date': timezone.localtime(self.at(9, 15)).strftime('%Y-%m-%dT%H:%M'), 'reason': 'Checkup',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('already has an appointment', str(response.context['form'].non_field_errors()))
+        self.assertEqual(Appointment.objects.count(), 1)
+
+
+    def test_expand_recurrence(self):
+        self.assertEqual(expand_recurrence(self.at(9), every=2, unit='weeks', count=3),
+                         [self.at(9), self.at(9) + timedelta(days=14), self.at(9) + timedelta(days=28)])
+        until = self.monday + timedelta(days=3)
+        self.assertEqual(len(expand_recurrence(self.at(9), unit='days', until=until)), 4)
+        with self.assertRaises(ValueError):
+            expand_recurrence(self.at(9))
+
+    def test_book_series_checks_whole_series_at_once(self):
+        book_appointment(self.appointment(self.at(9, 15) + timedelta(days=14)))
+        starts = expand_recurrence(self.at(9), count=4)
+
+        with self.assertNumQueries(5):  # lock, schedules and conflicts inside a savepoint; nothing inserted
+            created, clashes = book_series(self.appointment(self.at(9)), starts)
+        self.assertEqual(created, [])
+        self.assertEqual([start for start, _ in clashes], [starts[2]])
+
+        created, clashes = book_series(self.appointment(self.at(9)), starts + [self.at(9) + timedelta(days=1)], skip_conflicts=True)
+        self.assertEqual([a.appointment_date for a in created], [starts[0], starts[1], starts[3]])
+        self.assertEqual(len(clashes), 2)  # the taken Monday and a Tuesday outside working hours
+        self.assertEqual(len({a.series for a in created}), 1)
+        self.assertTrue(all(a.ends_at == a.appointment_date + timedelta(minutes=30) for a in created))
+
+        slots = next_free_slots([self.doctor.pk], count=1, after=self.at(0))
+        self.assertEqual(slots[0]['start'], self.at(9, 30))
+
+    def test_series_view_reports_clashes(self):
+        book_appointment(self.appointment(self.at(9) + timedelta(days=7)))
+        data = {
+            'patient': self.patient.pk, 'doctor': self.doctor.pk,
+            'appointment_date': timezone.localtime(self.at(9)).strftime('%Y-%m-%dT%H:%M'), 'reason': 'Dressing change',
+            'every': 1, 'unit': 'weeks', 'count': 3,
+        }
+        response = self.client.post(reverse('appointment-series-create'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['clashes']), 1)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+        response = self.client.post(reverse('appointment-series-create'), {**data, 'skip_conflicts': 'on'})
+        self.assertRedirects(response, reverse('appointment-list'))
+        self.assertEqual(Appointment.objects.filter(series__isnull=False).count(), 2)
+
+
+class ConcurrentBookingTestCase(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.doctor = User.objects.create_user(username='doctor1', password='password', user_type='doctor')
+        self.patient = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01', clinic=self.clinic)
+        self.start = timezone.now().replace(microsecond=0) + timedelta(days=3)
+
+    def test_only_one_of_two_overlapping_bookings_succeeds(self):
+        # Hold both bookings after their conflict checks, so that both pass them before either writes
+        barrier = threading.Barrier(2, timeout=5)
+        waited = threading.local()
+        save = Appointment.save
+
+        def checked_save(appointment, *args, **kwargs):
+            if not getattr(waited, 'done', False):
+                waited.done = True
+                barrier.wait()
+            return save(appointment, *args, **kwargs)
+
+        outcomes = []
+
+        def book(minutes):
+            try:
+                book_appointment(Appointment(patient=self.patient, doctor=self.doctor, clinic=self.clinic, reason='Checkup',
+                                             appointment_date=self.start + timedelta(minutes=minutes)))
+                outcomes.append('booked')
+            except ValidationError as e:
+                outcomes.append(e.messages[0])
+            finally:
+                connection.close()
+
+        with mock.patch.object(Appointment, 'save', autospec=True, side_effect=checked_save):
+            threads = [threading.Thread(target=book, args=(minutes,)) for minutes in (0, 15)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(sorted(outcomes)[1], 'booked')
+        self.assertIn('already has an appointment', sorted(outcomes)[0])
+        self.assertEqual(Appointment.objects.count(), 1)
+
+
+class FollowUpTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.doctor = User.objects.create_user(username='doctor1', password='password', user_type='doctor')
+        self.client.login(username='doctor1', password='password')
+        today = timezone.localdate()
+        self.monday = today + timedelta(days=7 - today.weekday())
+        DoctorSchedule.objects.create(doctor=self.doctor, weekday=0, start_time=time(9), end_time=time(10), slot_minutes=30)
+        self.patients = [
+            Patient.objects.create(first_name=f'Patient{i}', last_name='Doe', date_of_birth='1990-01-01', clinic=self.clinic)
+            for i in range(4)
+        ]
+        for patient in self.patients[:3]:
+            self.record(patient)
+        self.record(self.patients[0], follow_up=self.monday + timedelta(days=1))  # second record, same patient
+        self.record(self.patients[3], follow_up=self.monday + timedelta(days=60))  # not due yet
+
+        # Already booked after the visit
+        Appointment.objects.create(patient=self.patients[1], doctor=self.doctor, clinic=self.clinic, reason='Review',
+                                   appointment_date=timezone.make_aware(datetime.combine(self.monday, time(9, 30))))
+
+    def record(self, patient, follow_up=None):
+        return MedicalRecord.objects.create(patient=patient, doctor=self.doctor, symptoms='Wound', diagnosis='Leg ulcer',
+                                            treatment='Dressing', follow_up_date=follow_up or self.monday)
+
+    def test_worklist_is_one_query(self):
+        with self.assertNumQueries(1):
+            records = list(due_follow_ups(days=14))
+        self.assertEqual([r.patient_id for r in records],
+                         [self.patients[0].pk, self.patients[2].pk, self.patients[0].pk])
+
+        response = self.client.get(reverse('follow-up-list'), {'days': 14})
+        self.assertEqual(len(response.context['page_obj']), 3)
+
+    def test_book_follow_ups_takes_free_slots_in_turn(self):
+        created, unassigned = book_follow_ups(days=14)
+        self.assertEqual(unassigned, [])
+        slots = {a.patient_id: timezone.localtime(a.appointment_date) for a in created}
+        self.assertEqual(slots, {
+            self.patients[0].pk: timezone.localtime(timezone.make_aware(datetime.combine(self.monday, time(9)))),
+            self.patients[2].pk: timezone.localtime(timezone.make_aware(datetime.combine(self.monday + timedelta(days=7), time(9)))),
+        })
+        self.assertTrue(all(a.status == 'draft' and a.follow_up_for_id for a in created))
+        self.assertEqual(list(due_follow_ups(days=14)), [])
+        self.assertEqual(book_follow_ups(days=14), ([], []))
+
+class AppointmentCalendarTestCase(TestCase):
+    def setUp(self):
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.doctor = User.objects.create_user(username='doctor1', password='password', user_type='doctor', first_name='James', last_name='Smith')
+        self.patient = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01', clinic=self.clinic)
+        self.client.login(username='doctor1', password='password')
+        self.monday = timezone.make_aware(datetime(2030, 1, 7, 9))
+        for day in range(10):
+            Appointment.objects.create(patient=self.patient, doctor=self.doctor, appointment_date=self.monday + timedelta(days=day),
+                                       clinic=self.clinic, reason='Review')
+
+    def test_week_window_in_one_query(self):
+        with self.assertNumQueries(3):  # session, user, rows
+            response = self.client.get(reverse('api-appointment-calendar'), {'date': '2030-01-09', 'doctor': self.doctor.pk})
+        data = response.json()
+        self.assertEqual(len(data['results']), 7)
+        self.assertEqual(data['results'][0]['title'], 'John Doe')
+        self.assertEqual(data['results'][0]['doctor'], 'James Smith')
+        self.assertEqual(data['start'], '2030-01-07T00:00:00+00:00')
+
+        month = self.client.get(reverse('api-appointment-calendar'), {'date': '2030-01-20', 'view': 'month'}).json()
+        self.assertEqual(len(month['results']), 10)
+
+    def test_etag_revalidation(self):
+        params = {'start': '2030-01-07', 'end': '2030-01-14'}
+        etag = self.client.get(reverse('api-appointment-calendar'), params)['ETag']
+
+        response = self.client.get(reverse('api-appointment-calendar'), params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Appointment.objects.filter(pk=Appointment.objects.order_by('appointment_date').first().pk).update(status='confirmed')
+        response = self.client.get(reverse('api-appointment-calendar'), params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        Patient.objects.filter(pk=self.patient.pk).update(last_name='Doe-Smith')
+        response = self.client.get(reverse('api-appointment-calendar'), params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['title'], 'John Doe-Smith')
+
+    def test_invalid_window(self):
+        for params in [{'start': '2030-01-01', 'end': '2030-06-01'}, {'date': '2030-02-30'},
+                       {'start': '2030-02-30', 'end': '2030-03-02'}, {'date': 'soon'}]:
+            response = self.client.get(reverse('api-appointment-calendar'), params)
+            self.assertEqual(response.status_code, 400)
+
+
+class QueueBoardTestCase(TestCase):
+    def setUp(self):
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.doctor = User.objects.create_user(username='doctor1', password='password', user_type='doctor')
+        self.patient = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01', clinic=self.clinic)
+        self.appointment = Appointment.objects.create(patient=self.patient, doctor=self.doctor, appointment_date=timezone.now(),
+                                                      clinic=self.clinic, reason='Review')
+
+    def set_status(self, status):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.appointment.status = status
+            self.appointment.save()
+
+    async def test_broker_delivers_across_threads(self):
+        subscription = broker.subscribe(['clinic:1'])
+        try:
+            thread = threading.Thread(target=broker.publish, args=(['clinic:1', 'doctor:2'], {'id': 7}))
+            thread.start()
+            self.assertEqual(await subscription.get(timeout=1), {'id': 7})
+            thread.join()
+        finally:
+            subscription.close()
+        self.assertNotIn('clinic:1', broker._subscriptions)
+
+    async def test_status_changes_are_published(self):
+        subscription = broker.subscribe([f'doctor:{self.doctor.pk}'])
+        try:
+            await sync_to_async(self.set_status)('checked_in')
+            event = await subscription.get(timeout=1)
+            self.assertEqual((event['id'], event['status'], event['patient']), (self.appointment.pk, 'checked_in', 'John Doe'))
+
+            await sync_to_async(self.appointment.save)()  # no status change, nothing published
+            with self.assertRaises(TimeoutError):
+                await subscription.get(timeout=0.05)
+        finally:
+            subscription.close()
+
+    async def test_stream_sends_snapshot_then_updates(self):
+        await self.async_client.aforce_login(self.doctor)
+        response = await self.async_client.get(reverse('queue-stream'), {'clinic': self.clinic.pk})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        stream = aiter(response.streaming_content)
+        snapshot = (await anext(stream)).decode()
+        self.assertTrue(snapshot.startswith('event: snapshot'))
+        self.assertEqual(json.loads(snapshot.split('data: ', 1)[1])[0]['id'], self.appointment.pk)
+
+        await sync_to_async(self.set_status)('in_progress')
+        update = (await asyncio.wait_for(anext(stream), 1)).decode()
+        self.assertTrue(update.startswith('event: queue'))
+        self.assertIn('"in_progress"', update)
+        await stream.aclose()
+
+    def test_stream_falls_back_to_polling_under_wsgi(self):
+        self.client.force_login(self.doctor)
+        response = self.client.get(reverse('queue-stream'), {'doctor': self.doctor.pk})
+        retry, snapshot = [chunk.decode() for chunk in response.streaming_content]
+        self.assertEqual(retry, 'retry: 5000\n\n')
+        self.assertTrue(snapshot.startswith('event: snapshot'))
+        self.assertEqual(json.loads(snapshot.split('data: ', 1)[1])[0]['id'], self.appointment.pk)
+
+    def test_stream_requires_a_target(self):
+        self.client.force_login(self.doctor)
+        self.assertEqual(self.client.get(reverse('queue-stream')).status_code, 400)
+        self.assertEqual(self.client.get(reverse('queue-board'), {'clinic': self.clinic.pk}).status_code, 200)
+
+
+class RecordingBackend(BaseBackend):
+    """Collects what would be sent, failing for recipients listed in ``failing``"""
+    sent = []
+    failing = set()
+
+    def send_messages(self, reminders):
+        errors = {}
+        for reminder in reminders:
+            if reminder.recipient in self.failing:
+                errors[reminder.pk] = 'Gateway timeout'
+            else:
+                self.sent.append(reminder.recipient)
+        return errors
+
+
+@override_settings(REMINDER_BACKENDS={
+    'email': 'appointments.tests.RecordingBackend', 'sms': 'appointments.tests.RecordingBackend',
+})
+class ReminderTestCase(TestCase):
+    def setUp(self):
+        RecordingBackend.sent = []
+        RecordingBackend.failing = set()
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', phone='555-0100', established_date=timezone.now())
+        self.doctor = User.objects.create_user(username='doctor1', password='password', user_type='doctor', last_name='Smith')
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+        at = timezone.make_aware(datetime.combine(self.tomorrow, time(10)))
+        for i, status in enumerate(['scheduled', 'confirmed', 'cancelled']):
+            patient = Patient.objects.create(first_name=f'Patient{i}', last_name='Doe', date_of_birth='1990-01-01',
+                                             phone=f'555-010{i}', email=f'p{i}@example.com' if i else '', clinic=self.clinic)
+            Appointment.objects.create(patient=patient, doctor=self.doctor, appointment_date=at + timedelta(hours=i),
+                                       status=status, clinic=self.clinic, reason='Checkup')
+        Appointment.objects.create(patient=patient, doctor=self.doctor, appointment_date=at + timedelta(days=1),
+                                   clinic=self.clinic, reason='Checkup')
+
+    def test_enqueue_is_idempotent(self):
+        self.assertEqual(enqueue_reminders(), 2)
+        self.assertEqual(enqueue_reminders(), 0)
+        sms, email = ReminderOutbox.objects.order_by('channel').reverse()
+        self.assertEqual((sms.channel, sms.recipient), ('sms', '555-0100'))
+        self.assertEqual(email.recipient, 'p1@example.com')
+        self.assertIn('Patient1', email.body)
+        self.assertIn('Smith', email.body)
+
+        # A moved appointment is reminded again for its new time
+        Appointment.objects.filter(pk=sms.appointment_id).update(appointment_date=F('appointment_date') + timedelta(hours=3))
+        self.assertEqual(enqueue_reminders(), 1)
+
+    def test_dispatch_sends_once_and_retries_failures(self):
+        enqueue_reminders()
+        RecordingBackend.failing = {'555-0100'}
+        self.assertEqual(dispatch_reminders(workers=1, batch_size=1), (1, 1))
+        self.assertEqual(RecordingBackend.sent, ['p1@example.com'])
+        failed = ReminderOutbox.objects.get(recipient='555-0100')
+        self.assertEqual((failed.status, failed.attempts, failed.last_error), ('pending', 1, 'Gateway timeout'))
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+
+        self.assertEqual(dispatch_reminders(workers=1), (0, 0))  # nothing due yet, nothing re-sent
+
+        RecordingBackend.failing = set()
+        ReminderOutbox.objects.filter(pk=failed.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(dispatch_reminders(workers=1), (1, 0))
+        self.assertEqual(RecordingBackend.sent, ['p1@example.com', '555-0100'])
+
+    def test_cancelled_and_moved_appointments_are_not_reminded(self):
+        enqueue_reminders()
+        sms, email = ReminderOutbox.objects.order_by('channel').reverse()
+        Appointment.objects.filter(pk=email.appointment_id).update(status='cancelled')
+        Appointment.objects.filter(pk=sms.appointment_id).update(appointment_date=F('appointment_date') + timedelta(hours=3))
+
+        self.assertEqual(dispatch_reminders(workers=1), (0, 0))
+        self.assertEqual(RecordingBackend.sent, [])
+        self.assertEqual(set(ReminderOutbox.objects.values_list('status', flat=True)), {'cancelled'})
+
+        # The moved appointment is queued and sent for its new time
+        self.assertEqual(enqueue_reminders(), 1)
+        self.assertEqual(dispatch_reminders(workers=1), (1, 0))
+        self.assertEqual(RecordingBackend.sent, ['555-0100'])
+
+    def test_queued_counts_only_inserted_rows(self):
+        appointment = Appointment.objects.get(status='scheduled', appointment_date__date=self.tomorrow)
+        ReminderOutbox.objects.create(appointment=appointment, appointment_date=appointment.appointment_date,
+                                      channel='sms', recipient='555-0100', body='Queued by another run')
+        batch = [
+            ReminderOutbox(appointment=appointment, appointment_date=appointment.appointment_date,
+                           channel='sms', recipient='555-0100', body='Duplicate'),
+            ReminderOutbox(appointment=appointment, appointment_date=appointment.appointment_date + timedelta(hours=1),
+                           channel='sms', recipient='555-0100', body='New time'),
+        ]
+        self.assertEqual(_insert_reminders(batch), 1)
+
+    @override_settings(REMINDER_MAX_ATTEMPTS=1)
+    def test_gives_up_after_max_attempts(self):
+        enqueue_reminders()
+        RecordingBackend.failing = {'555-0100'}
+        dispatch_reminders(workers=1)
+        self.assertEqual(ReminderOutbox.objects.get(recipient='555-0100').status, 'failed')
@@ -4,6 +4,12 @@ from . import views
 urlpatterns = [
     path('', views.appointment_list, name='appointment-list'),
     path('create/', views.appointment_create, name='appointment-create'),
+    path('series/create/', views.appointment_series_create, name='appointment-series-create'),
+    path('api/free-slots/', views.free_slots_api, name='api-free-slots'),
+    path('api/calendar/', views.appointment_calendar_api, name='api-appointment-calendar'),
+    path('follow-ups/', views.follow_up_list, name='follow-up-list'),
+    path('queue/', views.queue_board, name='queue-board'),
+    path('queue/stream/', views.queue_stream, name='queue-stream'),
     path('<int:pk>/', views.appointment_detail, name='appointment-detail'),
     path('<int:pk>/update/', views.appointment_update, name='appointment-update'),
     path('<int:pk>/delete/', views.appointment_delete, name='appointment-delete'),
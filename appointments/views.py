@@ -1,16 +1,31 @@
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from .models import Appointment
-from .forms import AppointmentForm
+from .forms import AppointmentForm, AppointmentSeriesForm
+from .scheduling import book_appointment, book_series, doctors_in_department, next_free_slots
+from .queue import event_stream, snapshot_events, today_queue
+from .follow_ups import due_follow_ups
 from core.models import Clinic, User
+from patients.models import Patient
 from django.core.paginator import Paginator
 from django.db.models import Q
+from datetime import datetime, timedelta
+import hashlib
 
 @login_required
 def appointment_list(request):
-    appointments = Appointment.objects.all().order_by('-appointment_date')
+    appointments = Appointment.objects.select_related('patient', 'doctor').defer(
+        *(f'patient__{field}' for field in Patient.LARGE_TEXT_FIELDS)
+    ).order_by('-appointment_date')
 
     # Filtering
     status = request.GET.get('status')
@@ -73,16 +88,54 @@ def appointment_create(request):
             appointment = form.save(commit=False)
             appointment.clinic = default_clinic
             appointment.created_by = request.user
-            appointment.save()
-            messages.success(request, 'Appointment created successfully.')
-            return redirect('appointment-list')
+            try:
+                book_appointment(appointment)
+            except ValidationError as e:
+                form.add_error(None, e)
+            else:
+                messages.success(request, 'Appointment created successfully.')
+                return redirect('appointment-list')
     else:
         form = AppointmentForm()
     return render(request, 'appointments/appointment_form.html', {'form': form, 'title': 'Create Appointment'})
 
+@login_required
+def appointment_series_create(request):
+    """Book a recurring series (e.g. weekly dressing changes) in one go"""
+    default_clinic = Clinic.objects.first()
+    if not default_clinic:
+        messages.error(request, "No clinic configured. Please contact administrator.")
+        return redirect('appointment-list')
+    
+    clashes = []
+    if request.method == 'POST':
+        form = AppointmentSeriesForm(request.POST)
+        if form.is_valid():
+            template = form.save(commit=False)
+            template.clinic = default_clinic
+            template.created_by = request.user
+            try:
+                created, clashes = book_series(template, form.occurrences(), skip_conflicts=form.cleaned_data['skip_conflicts'])
+            except ValidationError as e:
+                form.add_error(None, e)
+            else:
+                if created:
+                    messages.success(request, f'{len(created)} appointments booked.')
+                    for start, reason in clashes:
+                        messages.error(request, f"Not booked on {timezone.localtime(start):%Y-%m-%d %H:%M}: {reason}")
+                    return redirect('appointment-list')
+                form.add_error(None, 'No appointments were booked; see the clashing dates below.')
+    else:
+        form = AppointmentSeriesForm()
+    return render(request, 'appointments/appointment_series_form.html', {
+        'form': form, 'clashes': clashes, 'title': 'Book Recurring Appointments',
+    })
+
 @login_required
 def appointment_detail(request, pk):
-    appointment = get_object_or_404(Appointment, pk=pk)
+    appointment = get_object_or_404(
+        Appointment.objects.select_related('patient', 'doctor', 'clinic', 'created_by'), pk=pk
+    )
     return render(request, 'appointments/appointment_detail.html', {'appointment': appointment})
 
 @login_required
@@ -91,9 +144,13 @@ def appointment_update(request, pk):
     if request.method == 'POST':
         form = AppointmentForm(request.POST, instance=appointment)
         if form.is_valid():
-            form.save()
-            messages.success(request, 'Appointment updated successfully.')
-            return redirect('appointment-detail', pk=appointment.pk)
+            try:
+                book_appointment(form.save(commit=False))
+            except ValidationError as e:
+                form.add_error(None, e)
+            else:
+                messages.success(request, 'Appointment updated successfully.')
+                return redirect('appointment-detail', pk=appointment.pk)
     else:
         form = AppointmentForm(instance=appointment)
     return render(request, 'appointments/appointment_form.html', {'form': form, 'title': 'Update Appointment'})
@@ -113,7 +170,200 @@ def appointment_update_status(request, pk):
     if request.method == 'POST':
         new_status = request.POST.get('status')
         if new_status in dict(Appointment.STATUS_CHOICES):
+            reactivating = (
+                appointment.status not in Appointment.BLOCKING_STATUSES
+                and new_status in Appointment.BLOCKING_STATUSES
+            )
             appointment.status = new_status
-            appointment.save()
-            messages.success(request, f'Appointment status updated to {appointment.get_status_display()}.')
+            try:
+                if reactivating:
+                    # The slot may have been rebooked since it was cancelled
+                    book_appointment(appointment)
+                else:
+                    appointment.save()
+            except ValidationError as e:
+                messages.error(request, e.messages[0])
+            else:
+                messages.success(request, f'Appointment status updated to {appointment.get_status_display()}.')
         return redirect('appointment-detail', pk=appointment.pk)
+
+@login_required
+def free_slots_api(request):
+    """Next free slots for a doctor (?doctor=) or any doctor of a department (?department=)"""
+    try:
+        count = min(int(request.GET.get('count', 5)), 50)
+        if request.GET.get('department'):
+            doctor_ids = doctors_in_department(int(request.GET['department']))
+        else:
+            doctor_ids = [int(request.GET['doctor'])]
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Give a doctor or department id.'}, status=400)
+
+    after = parse_datetime(request.GET.get('after', '')) if request.GET.get('after') else None
+    if after and timezone.is_naive(after):
+        after = timezone.make_aware(after)
+
+    slots = next_free_slots(doctor_ids, count=count, after=after)
+    names = {
+        user.pk: user.get_full_name() or user.username
+        for user in User.objects.filter(pk__in={slot['doctor_id'] for slot in slots}).only('first_name', 'last_name', 'username')
+    }
+    results = [
+        {
+            'doctor_id': slot['doctor_id'],
+            'doctor': names.get(slot['doctor_id'], ''),
+            'start': slot['start'].isoformat(),
+            'end': slot['end'].isoformat(),
+        }
+        for slot in slots
+    ]
+    return JsonResponse({'results': results})
+
+CALENDAR_MAX_DAYS = 42
+CALENDAR_FIELDS = (
+    'id', 'appointment_date', 'ends_at', 'status', 'reason', 'doctor_id', 'patient_id',
+    'patient__first_name', 'patient__last_name',
+    'doctor__first_name', 'doctor__last_name', 'doctor__username',
+)
+
+def _parse_date(value):
+    """parse_date, with None for well-formed but impossible dates such as 2030-02-30"""
+    try:
+        return parse_date(value)
+    except ValueError:
+        return None
+
+def _calendar_window(request):
+    """
+    Date window from ``?start=&end=`` (end exclusive) or ``?date=&view=week|month``.
+
+    Returns ``(start, end)`` as aware datetimes, or None if invalid.
+    """
+    if request.GET.get('start') and request.GET.get('end'):
+        first, last = _parse_date(request.GET['start']), _parse_date(request.GET['end'])
+    else:
+        if request.GET.get('date'):
+            day = _parse_date(request.GET['date'])
+            if day is None:
+                return None
+        else:
+            day = timezone.localdate()
+        if request.GET.get('view') == 'month':
+            first = day.replace(day=1)
+            last = (first + timedelta(days=32)).replace(day=1)
+        else:
+            first = day - timedelta(days=day.weekday())
+            last = first + timedelta(days=7)
+    if not first or not last or not 0 < (last - first).days <= CALENDAR_MAX_DAYS:
+        return None
+    return (
+        timezone.make_aware(datetime.combine(first, datetime.min.time())),
+        timezone.make_aware(datetime.combine(last, datetime.min.time())),
+    )
+
+def _calendar_queryset(request, start, end):
+    # The lower bound on appointment_date keeps the scan on the (doctor|clinic, date) indexes
+    appointments = Appointment.objects.filter(
+        appointment_date__gt=start - timedelta(minutes=Appointment.MAX_DURATION),
+        appointment_date__lt=end,
+        ends_at__gt=start,
+    )
+    if request.GET.get('doctor', '').isdigit():
+        appointments = appointments.filter(doctor_id=request.GET['doctor'])
+    if request.GET.get('clinic', '').isdigit():
+        appointments = appointments.filter(clinic_id=request.GET['clinic'])
+    return appointments.order_by()
+
+@login_required
+def appointment_calendar_api(request):
+    """
+    Appointments in a week/month window for calendar widgets, as one projected query.
+    
+    The ETag is a hash of the response itself, so it changes with anything
+    shown, including patient and doctor names and rows changed by
+    queryset.update(); an unchanged window answers 304 without a body.
+    """
+    window = _calendar_window(request)
+    if window is None:
+        return JsonResponse({'error': f'Give a valid window of at most {CALENDAR_MAX_DAYS} days.'}, status=400)
+
+    rows = _calendar_queryset(request, *window).order_by('appointment_date', 'id').values_list(*CALENDAR_FIELDS)
+    results = [
+        {
+            'id': pk,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'status': status,
+            'title': f"{patient_first} {patient_last}",
+            'reason': reason,
+            'patient_id': patient_id,
+            'doctor_id': doctor_id,
+            'doctor': f"{doctor_first} {doctor_last}".strip() or doctor_username,
+        }
+        for (pk, start, end, status, reason, doctor_id, patient_id,
+             patient_first, patient_last, doctor_first, doctor_last, doctor_username) in rows
+    ]
+    response = JsonResponse({
+        'start': window[0].isoformat(),
+        'end': window[1].isoformat(),
+        'results': results,
+    })
+    response['ETag'] = quote_etag(hashlib.sha1(response.content).hexdigest())
+    return get_conditional_response(request, etag=response['ETag'], response=response)
+
+@login_required
+def queue_board(request):
+    """Waiting-room screen for a clinic or doctor, kept live by queue_stream"""
+    return render(request, 'appointments/queue_board.html', {
+        'clinics': Clinic.objects.only('name'),
+        'doctors': User.objects.filter(user_type='doctor').only('first_name', 'last_name', 'username'),
+        'clinic_id': request.GET.get('clinic', ''),
+        'doctor_id': request.GET.get('doctor', ''),
+    })
+
+@login_required
+async def queue_stream(request):
+    """
+    Server-sent events for a clinic's (?clinic=) or doctor's (?doctor=) queue.
+    
+    Only an ASGI server can hold the stream open; under WSGI the screen
+    polls for snapshots instead (see appointments/queue.py).
+    """
+    if request.GET.get('doctor', '').isdigit():
+        doctor_id = int(request.GET['doctor'])
+        channels, queue = [f'doctor:{doctor_id}'], today_queue(doctor_id=doctor_id)
+    elif request.GET.get('clinic', '').isdigit():
+        clinic_id = int(request.GET['clinic'])
+        channels, queue = [f'clinic:{clinic_id}'], today_queue(clinic_id=clinic_id)
+    else:
+        return JsonResponse({'error': 'Give a clinic or doctor id.'}, status=400)
+
+    events = event_stream(channels, queue) if isinstance(request, ASGIRequest) else snapshot_events(queue)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # let nginx pass events through unbuffered
+    return response
+
+@login_required
+def follow_up_list(request):
+    """Patients whose follow-up is due within ?days= and who have not been booked yet"""
+    days = int(request.GET['days']) if request.GET.get('days', '').isdigit() else settings.FOLLOW_UP_DAYS
+    doctor = request.GET.get('doctor')
+    records = due_follow_ups(days=days, doctor_id=int(doctor) if doctor and doctor.isdigit() else None)
+    records = records.select_related('patient', 'doctor').defer(
+        *(f'patient__{field}' for field in Patient.LARGE_TEXT_FIELDS)
+    )
+
+    paginator = Paginator(records, 25)
+    page_obj = paginator.get_page(request.GET.get('page'))
+    query_params = request.GET.copy()
+    query_params.pop('page', None)
+
+    return render(request, 'appointments/follow_up_list.html', {
+        'page_obj': page_obj,
+        'days': days,
+        'doctor': doctor,
+        'doctors': User.objects.filter(user_type='doctor'),
+        'today': timezone.localdate(),
+        'query_string': query_params.urlencode(),
+    })
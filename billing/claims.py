@@ -0,0 +1,190 @@
+"""
+Insurance claim files.
+
+Items on the unpaid bills of insured patients, billed on or after their
+cover started, are claimed from the patient's payer in batches of at most
+CLAIM_FILE_MAX_LINES lines, one file per batch in the payer's format. On
+a partly paid bill each item is claimed net of its share of the patient's
+payments, so its lines add up to the bill's balance, to within a cent per
+line. A batch takes its items with a single UPDATE that stamps them with
+the new ClaimBatch. The UPDATE only stamps items that are still unclaimed
+when it reaches them, and where the database supports it, items locked by
+another export are skipped, so concurrent exports can never claim an item
+twice. No list of ids is held in memory: the stamped items are read back
+through a streaming cursor and written out one line at a time, and the
+file's running count and total go in its trailer.
+
+Files are written under a temporary name and only moved into place once
+the batch has committed; if writing fails the whole batch is rolled back,
+so its items are claimed again next time.
+"""
+import csv
+import os
+import unicodedata
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Subquery
+from django.utils import timezone
+
+from .models import Bill, BillItem, ClaimBatch, InsurancePayer
+
+CLAIM_FIELDS = (
+    'line', 'member_number', 'last_name', 'first_name', 'date_of_birth',
+    'bill_number', 'service_date', 'description', 'quantity', 'unit_price', 'amount',
+)
+
+
+def pending_claims(payer_id):
+    """Items not yet claimed on open bills the payer's members ran up while covered."""
+    return BillItem.objects.filter(
+        claim_batch__isnull=True, bill__patient__insurance__payer_id=payer_id,
+        bill__status__in=Bill.OPEN_STATUSES,
+        bill__bill_date__date__gte=F('bill__patient__insurance__start_date'),
+    )
+
+
+def service_date(row):
+    return timezone.localtime(row['bill_date']).date()
+
+
+def claimed_amount(row):
+    """The item's amount less its proportional share of what the patient has already paid on the bill."""
+    if row['bill_paid'] <= 0 or not row['bill_total']:
+        return row['amount']
+    owed = max(row['bill_total'] - row['bill_paid'], Decimal('0'))
+    return (row['amount'] * owed / row['bill_total']).quantize(Decimal('0.01'))
+
+
+class CsvClaimWriter:
+    extension = 'csv'
+
+    def __init__(self, f):
+        self.writer = csv.writer(f)
+
+    def header(self, batch):
+        self.writer.writerow(CLAIM_FIELDS)
+
+    def line(self, number, row):
+        self.writer.writerow([
+            number, row['member_number'], row['last_name'], row['first_name'], row['date_of_birth'].isoformat(),
+            row['bill_number'], service_date(row).isoformat(), row['description'],
+            row['quantity'], f"{row['unit_price']:.2f}", f"{row['amount']:.2f}",
+        ])
+
+    def trailer(self, count, total):
+        pass
+
+
+def _ascii(value):
+    return unicodedata.normalize('NFKD', str(value)).encode('ascii', 'ignore').decode().upper()
+
+
+def _text(value, width):
+    return _ascii(value or '')[:width].ljust(width)
+
+
+def _number(value, width):
+    return str(value).rjust(width, '0')[-width:]
+
+
+def _cents(amount, width):
+    return _number(int((amount * 100).quantize(Decimal('1'))), width)
+
+
+class FixedWidthClaimWriter:
+    """
+    Header, detail and trailer records of fixed length; text is upper-case
+    ASCII, left-aligned and space-padded, numbers zero-padded and amounts
+    in cents.
+    """
+    extension = 'txt'
+
+    def __init__(self, f):
+        self.f = f
+
+    def header(self, batch):
+        self.f.write(f"H{_text(batch.payer.code, 10)}{_number(batch.pk, 10)}{timezone.localtime(batch.created_at):%Y%m%d}\n")
+
+    def line(self, number, row):
+        self.f.write(''.join((
+            'D', _number(number, 7), _text(row['member_number'], 20), _text(row['last_name'], 25),
+            _text(row['first_name'], 15), f"{row['date_of_birth']:%Y%m%d}", _text(row['bill_number'], 15),
+            f"{service_date(row):%Y%m%d}", _text(row['description'], 40), _number(row['quantity'], 5),
+            _cents(row['unit_price'], 11), _cents(row['amount'], 11),
+        )) + '\n')
+
+    def trailer(self, count, total):
+        self.f.write(f"T{_number(count, 9)}{_cents(total, 13)}\n")
+
+
+CLAIM_WRITERS = {
+    'csv': CsvClaimWriter,
+    'fixed': FixedWidthClaimWriter,
+}
+
+
+def _export_batch(payer, user, max_lines):
+    """Claim up to ``max_lines`` pending items into a new file. Returns the batch, or None if nothing was pending."""
+    writer_class = CLAIM_WRITERS[payer.claim_format]
+    out_dir = Path(settings.CLAIM_EXPORT_DIR) / payer.code
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with transaction.atomic():
+        batch = ClaimBatch.objects.create(payer=payer, created_by=user)
+        pending = pending_claims(payer.pk)
+        if connection.features.has_select_for_update_skip_locked:
+            pending = pending.select_for_update(skip_locked=True, of=('self',))
+        # The outer condition is re-checked against rows another export stamped while this one waited
+        claimed = BillItem.objects.filter(
+            claim_batch__isnull=True, pk__in=Subquery(pending.order_by('pk').values('pk')[:max_lines]),
+        ).update(claim_batch=batch)
+        if not claimed:
+            transaction.set_rollback(True)
+            return None
+
+        rows = batch.items.order_by('bill_id', 'pk').values(
+            'description', 'quantity', 'unit_price', 'amount',
+            bill_number=F('bill__bill_number'), bill_date=F('bill__bill_date'),
+            bill_total=F('bill__total_amount'), bill_paid=F('bill__paid_amount'),
+            first_name=F('bill__patient__first_name'), last_name=F('bill__patient__last_name'),
+            date_of_birth=F('bill__patient__date_of_birth'), member_number=F('bill__patient__insurance__member_number'),
+        ).iterator(chunk_size=settings.CLAIM_EXPORT_CHUNK_SIZE)
+
+        name = f'{payer.code}-{batch.pk:06d}.{writer_class.extension}'
+        tmp_path = out_dir / f'{name}.tmp'
+        count, total = 0, Decimal('0')
+        try:
+            with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+                writer = writer_class(f)
+                writer.header(batch)
+                for count, row in enumerate(rows, start=1):
+                    row['amount'] = claimed_amount(row)
+                    writer.line(count, row)
+                    total += row['amount']
+                writer.trailer(count, total)
+            batch.file_name = name
+            batch.line_count = count
+            batch.total_amount = total
+            batch.save(update_fields=['file_name', 'line_count', 'total_amount'])
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        transaction.on_commit(lambda: os.replace(tmp_path, out_dir / name))
+    return batch
+
+
+def export_claims(user=None, payers=None, max_lines=None):
+    """
+    Write claim files for every payer (or the given ones) until nothing is left to claim.
+
+    Returns:
+        list: the ClaimBatch of each file written.
+    """
+    max_lines = max_lines or settings.CLAIM_FILE_MAX_LINES
+    batches = []
+    for payer in payers if payers is not None else InsurancePayer.objects.order_by('code'):
+        while batch := _export_batch(payer, user, max_lines):
+            batches.append(batch)
+    return batches
@@ -0,0 +1,185 @@
+"""
+Automatic billing of dispensed medicines and completed appointments.
+
+Every sale StockTransaction of a dispensed prescription and every
+completed appointment is a billable source. Each becomes one BillItem that
+points back at it through a one-to-one field, so a source is billed once
+however often billing runs: the pending queries skip sources that already
+have an item, and the unique column stops a concurrent run.
+
+Medicines are charged at the transaction's unit price. Appointments are
+charged from the CONSULTATION_FEES schedule, keyed by the doctor's
+specialization; an appointment with no matching fee is left unbilled.
+
+A patient's unbilled sources go on one bill. ``bill_patient`` does this
+for one patient at the end of an encounter and ``generate_bills`` for
+every patient in chunks, at a fixed number of queries per chunk: the
+sources are read with one query each, the bills and their items are
+inserted with one bulk_create each, and the totals of the chunk's bills
+are set by one Bill.recalculate_totals.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from appointments.models import Appointment
+from inventory.models import StockTransaction
+from patients.timeline import invalidate_timeline
+from .models import Bill, BillItem
+
+NUMBERING_ATTEMPTS = 5
+
+
+def pending_dispensings(until=None):
+    """Sales of dispensed prescriptions that are not on a bill yet."""
+    sales = StockTransaction.objects.filter(
+        transaction_type='sale', prescription__is_dispensed=True, patient__isnull=False, bill_item__isnull=True,
+    )
+    return sales.filter(transaction_date__lt=until) if until else sales
+
+
+def pending_appointments(until=None):
+    """Completed appointments that are not on a bill yet."""
+    appointments = Appointment.objects.filter(status='completed', bill_item__isnull=True)
+    return appointments.filter(appointment_date__lt=until) if until else appointments
+
+
+def consultation_fee(specialization):
+    """The fee schedule entry for a doctor's specialization, or None if nothing matches."""
+    fees = settings.CONSULTATION_FEES
+    fee = fees.get((specialization or '').strip().lower(), fees.get('default'))
+    return Decimal(fee) if fee is not None else None
+
+
+def _build_items(patient_ids, until):
+    """
+    Unsaved items for the patients' pending sources.
+
+    Returns:
+        tuple: ``{patient_id: [BillItem]}`` and the appointments that have no fee.
+    """
+    items, unpriced = defaultdict(list), []
+    sales = pending_dispensings(until).filter(patient_id__in=patient_ids).select_related(
+        'inventory_item__medicine'
+    ).only(
+        'patient_id', 'prescription_id', 'quantity', 'unit_price', 'transaction_date', 'inventory_item__medicine__name',
+    ).order_by('transaction_date', 'pk')
+    for sale in sales:
+        quantity = abs(sale.quantity)
+        items[sale.patient_id].append(BillItem(
+            stock_transaction=sale,
+            description=f'{sale.inventory_item.medicine.name} (Prescription #{sale.prescription_id})'[:200],
+            quantity=quantity,
+            unit_price=sale.unit_price,
+            amount=quantity * sale.unit_price,  # bulk_create skips BillItem.save
+        ))
+
+    appointments = pending_appointments(until).filter(patient_id__in=patient_ids).select_related('doctor').only(
+        'patient_id', 'appointment_date', 'doctor__first_name', 'doctor__last_name', 'doctor__username', 'doctor__specialization',
+    ).order_by('appointment_date', 'pk')
+    for appointment in appointments:
+        fee = consultation_fee(appointment.doctor.specialization)
+        if fee is None:
+            unpriced.append(appointment)
+            continue
+        doctor = appointment.doctor.get_full_name() or appointment.doctor.username
+        when = timezone.localtime(appointment.appointment_date)
+        items[appointment.patient_id].append(BillItem(
+            appointment=appointment,
+            description=f'Consultation with Dr. {doctor} on {when:%d %b %Y}'[:200],
+            quantity=1,
+            unit_price=fee,
+            amount=fee,
+        ))
+    return items, unpriced
+
+
+def last_bill_sequence(prefix):
+    """The highest sequence number used after ``prefix`` by generated bills, 0 if none."""
+    last = Bill.objects.filter(bill_number__regex=rf'^{prefix}[0-9]{{5}}$').aggregate(last=Max('bill_number'))['last']
+    return int(last[len(prefix):]) if last else 0
+
+
+def _insert_bills(patient_ids, user, now):
+    """
+    Insert numbered bills for the patients, continuing after the day's
+    highest bill number. Deleted bills leave gaps rather than numbers to
+    reuse, and a concurrent run that takes the same numbers first makes
+    this one renumber and try again.
+    """
+    prefix = f"BL{now.strftime('%y%m%d')}"
+    for attempt in range(NUMBERING_ATTEMPTS):
+        sequence = last_bill_sequence(prefix)
+        try:
+            with transaction.atomic():
+                return Bill.objects.bulk_create([
+                    Bill(
+                        bill_number=f'{prefix}{sequence + i:05d}',
+                        patient_id=patient_id,
+                        due_date=timezone.localdate(now) + timezone.timedelta(days=settings.BILL_DUE_DAYS),
+                        created_by=user,
+                        notes='Generated automatically',
+                    )
+                    for i, patient_id in enumerate(patient_ids, start=1)
+                ])
+        except IntegrityError:
+            if attempt == NUMBERING_ATTEMPTS - 1:
+                raise
+
+
+def _create_bills(items_by_patient, user):
+    """Insert one bill per patient with its items. Returns the bills."""
+    bills = _insert_bills(list(items_by_patient), user, timezone.now())
+    for bill in bills:
+        for item in items_by_patient[bill.patient_id]:
+            item.bill = bill
+    BillItem.objects.bulk_create([item for items in items_by_patient.values() for item in items])
+    Bill.recalculate_totals([bill.pk for bill in bills])
+    for bill in bills:
+        bill.total_amount = sum(item.amount for item in items_by_patient[bill.patient_id])  # as just stored
+        invalidate_timeline(bill.patient_id)
+    return bills
+
+
+def bill_patient(patient_id, user, until=None):
+    """
+    Bill everything a patient has been given and not yet billed for, e.g.
+    at checkout.
+
+    Returns:
+        tuple: the new bill (None if there was nothing to bill) and the
+        appointments that could not be priced.
+    """
+    with transaction.atomic():
+        items, unpriced = _build_items([patient_id], until)
+        bills = _create_bills(items, user) if items else []
+    return (bills[0] if bills else None), unpriced
+
+
+def generate_bills(user, until=None, batch_size=None):
+    """
+    Bill every patient with pending sources from before ``until`` (all of
+    them by default), one transaction per chunk of ``batch_size`` patients.
+
+    Returns:
+        tuple: the number of bills created and the appointments that could not be priced.
+    """
+    batch_size = batch_size or settings.BILLING_BATCH_SIZE
+    patient_ids = sorted(
+        set(pending_dispensings(until).order_by().values_list('patient_id', flat=True).distinct())
+        | set(pending_appointments(until).order_by().values_list('patient_id', flat=True).distinct())
+    )
+    created, all_unpriced = 0, []
+    remaining = iter(patient_ids)
+    while chunk := list(islice(remaining, batch_size)):
+        with transaction.atomic():
+            items, unpriced = _build_items(chunk, until)
+            if items:
+                created += len(_create_bills(items, user))
+        all_unpriced.extend(unpriced)
+    return created, all_unpriced
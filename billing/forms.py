@@ -0,0 +1,36 @@
+import csv
+import io
+from django import forms
+from django.utils import timezone
+from core.models import Clinic
+from .models import Payment
+
+class CloseDayForm(forms.Form):
+    clinic = forms.ModelChoiceField(queryset=Clinic.objects.order_by('name'))
+    business_date = forms.DateField(initial=timezone.localdate, widget=forms.DateInput(attrs={'type': 'date'}))
+    statement = forms.FileField(
+        required=False,
+        help_text="The card processor's statement for the day: CSV with the reference number in the first column.",
+    )
+    
+    def statement_references(self):
+        """References on the uploaded statement, or None when none was given"""
+        upload = self.cleaned_data.get('statement')
+        if not upload:
+            return None
+        text = io.TextIOWrapper(upload.file, encoding='utf-8-sig', errors='replace')
+        return [row[0] for row in csv.reader(text) if row and row[0].strip()]
+
+class PaymentPostForm(forms.Form):
+    """Validates a payment posted to the payments API, as form fields or a JSON object"""
+    amount = forms.DecimalField(max_digits=10, decimal_places=2)
+    payment_method = forms.ChoiceField(
+        choices=Payment.PAYMENT_METHODS,
+        error_messages={'invalid_choice': 'Unknown payment method %(value)s.'},
+    )
+    reference_number = forms.CharField(required=False, max_length=100)
+    notes = forms.CharField(required=False)
+    idempotency_key = forms.CharField(required=False, max_length=64)
+    
+    def error_message(self):
+        return ' '.join(f'{field}: {error}' for field, errors in self.errors.items() for error in errors)
@@ -0,0 +1,46 @@
+import csv
+from datetime import timedelta
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from billing.settlement import close_day
+from core.models import Clinic, User
+
+class Command(BaseCommand):
+    help = "Settles and locks a business day's payments for every clinic (or one)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=parse_date, help='Day to close (YYYY-MM-DD, default yesterday)')
+        parser.add_argument('--clinic', type=int, help='Only this clinic')
+        parser.add_argument('--statement', help='CSV statement from the card processor, reference number in the first column')
+        parser.add_argument('--user', help='Username recorded as closing the day (default the first superuser)')
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(username=options['user']) if options['user'] else User.objects.filter(is_superuser=True).order_by('pk')
+        user = users.first()
+        if user is None:
+            raise CommandError('No such user.' if options['user'] else 'Create a superuser or pass --user.')
+        day = options['date'] or timezone.localdate() - timedelta(days=1)
+        references = None
+        if options['statement'] and not options['clinic']:
+            raise CommandError('A statement covers one clinic; pass --clinic with --statement.')
+        if options['statement']:
+            with open(options['statement'], newline='', encoding='utf-8-sig') as f:
+                references = [row[0] for row in csv.reader(f) if row and row[0].strip()]
+
+        clinics = Clinic.objects.filter(pk=options['clinic']) if options['clinic'] else Clinic.objects.order_by('pk')
+        for clinic in clinics:
+            try:
+                settlement = close_day(clinic.pk, day, user, statement_references=references)
+            except ValidationError as e:
+                self.stdout.write(self.style.WARNING(f'{clinic}: {" ".join(e.messages)}'))
+                continue
+            self.stdout.write(self.style.SUCCESS(
+                f'{clinic}: closed {day} with {settlement.payment_count} payments totalling {settlement.total_amount}.'
+            ))
+            for discrepancy in settlement.discrepancies.all():
+                self.stdout.write(self.style.WARNING(
+                    f'  {discrepancy.get_reason_display()}: {discrepancy.reference_number or "(none)"}'
+                    + (f' (payment {discrepancy.payment_id})' if discrepancy.payment_id else '')
+                ))
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from billing.claims import export_claims
+from billing.models import InsurancePayer
+from core.models import User
+
+class Command(BaseCommand):
+    help = 'Writes claim files for insured patients\' bill items that have not been claimed yet, one batch per file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payer', action='append', help='Payer code (repeatable; default every payer)')
+        parser.add_argument('--max-lines', type=int, default=settings.CLAIM_FILE_MAX_LINES, help='Claim lines per file')
+        parser.add_argument('--user', help='Username recorded on the batches')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError('No such user.')
+        payers = None
+        if options['payer']:
+            payers = list(InsurancePayer.objects.filter(code__in=options['payer']).order_by('code'))
+            unknown = set(options['payer']) - {payer.code for payer in payers}
+            if unknown:
+                raise CommandError(f"Unknown payer: {', '.join(sorted(unknown))}")
+
+        batches = export_claims(user=user, payers=payers, max_lines=options['max_lines'])
+        for batch in batches:
+            self.stdout.write(f'{batch.payer.code}: {batch.file_name} ({batch.line_count} lines, {batch.total_amount})')
+        self.stdout.write(self.style.SUCCESS(f'Wrote {len(batches)} claim files.'))
@@ -0,0 +1,31 @@
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from billing.engine import generate_bills
+from core.models import User
+
+class Command(BaseCommand):
+    help = 'End-of-day billing: bills every dispensed prescription and completed appointment not yet billed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=parse_date, help='Bill everything up to the end of this day (YYYY-MM-DD, default today)')
+        parser.add_argument('--user', help='Username recorded as the bills\' creator (default the first superuser)')
+        parser.add_argument('--batch-size', type=int, default=settings.BILLING_BATCH_SIZE, help='Patients per transaction')
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(username=options['user']) if options['user'] else User.objects.filter(is_superuser=True).order_by('pk')
+        user = users.first()
+        if user is None:
+            raise CommandError('No such user.' if options['user'] else 'Create a superuser or pass --user.')
+        day = options['date'] or timezone.localdate()
+        until = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+        created, unpriced = generate_bills(user, until=until, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Created {created} bills.'))
+        for appointment in unpriced:
+            self.stdout.write(self.style.WARNING(
+                f'No consultation fee for appointment {appointment.pk} '
+                f'({appointment.doctor.specialization or "no specialization"}); add one to CONSULTATION_FEES.'
+            ))
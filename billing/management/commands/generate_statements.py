@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from billing.statements import RENDERERS, run_statements
+
+class Command(BaseCommand):
+    help = 'Writes a PDF statement for every patient with an outstanding balance; rerun with the same --run to resume'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--run', help='Run name, used as the spool subdirectory (default this month, YYYY-MM)')
+        parser.add_argument('--workers', type=int, default=settings.STATEMENT_WORKERS, help='Rendering processes (1 renders inline)')
+        parser.add_argument('--renderer', choices=sorted(RENDERERS), default=settings.STATEMENT_RENDERER)
+        parser.add_argument('--batch-size', type=int, default=settings.STATEMENT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        out_dir, written, skipped = run_statements(
+            run_name=options['run'], workers=options['workers'],
+            renderer=options['renderer'], batch_size=options['batch_size'],
+        )
+        if skipped:
+            self.stdout.write(f'Resumed: {skipped} statements were already written.')
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} statements to {out_dir}.'))
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0009_follow_ups'),
+        ('billing', '0003_bill_billing_bil_status_a69be1_idx'),
+        ('inventory', '0002_category_alter_inventoryitem_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billitem',
+            name='appointment',
+            field=models.OneToOneField(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='bill_item', to='appointments.appointment'),
+        ),
+        migrations.AddField(
+            model_name='billitem',
+            name='stock_transaction',
+            field=models.OneToOneField(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='bill_item', to='inventory.stocktransaction'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0005_payment_idempotency_key'),
+        ('core', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='received_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='received_payments', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.CreateModel(
+            name='Settlement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('business_date', models.DateField()),
+                ('closed_at', models.DateTimeField(auto_now_add=True)),
+                ('payment_count', models.PositiveIntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('statement_checked', models.BooleanField(default=False)),
+                ('clinic', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='core.clinic')),
+                ('closed_by', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='closed_settlements', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-business_date', 'clinic'],
+                'unique_together': {('clinic', 'business_date')},
+            },
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='settlement',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='payments', to='billing.settlement'),
+        ),
+        migrations.CreateModel(
+            name='SettlementDiscrepancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference_number', models.CharField(blank=True, max_length=100)),
+                ('reason', models.CharField(choices=[('missing', 'Missing reference'), ('duplicate', 'Duplicate reference'), ('not_on_statement', 'Not on statement'), ('not_in_payments', 'On statement, no payment')], max_length=20)),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='billing.payment')),
+                ('settlement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='discrepancies', to='billing.settlement')),
+            ],
+            options={
+                'ordering': ['reason', 'reference_number'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SettlementLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_method', models.CharField(choices=[('cash', 'Cash'), ('card', 'Credit/Debit Card'), ('insurance', 'Insurance'), ('online', 'Online Payment')], max_length=20)),
+                ('payment_count', models.PositiveIntegerField()),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('cashier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('settlement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='billing.settlement')),
+            ],
+            options={
+                'ordering': ['payment_method', 'cashier'],
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0006_settlements'),
+        ('patients', '0007_follow_ups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InsurancePayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=10, unique=True)),
+                ('name', models.CharField(max_length=200)),
+                ('claim_format', models.CharField(choices=[('csv', 'CSV'), ('fixed', 'Fixed width')], default='csv', max_length=10)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ClaimBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('file_name', models.CharField(blank=True, max_length=255)),
+                ('line_count', models.PositiveIntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('payer', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='claim_batches', to='billing.insurancepayer')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='billitem',
+            name='claim_batch',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='items', to='billing.claimbatch'),
+        ),
+        migrations.CreateModel(
+            name='InsuranceCoverage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('member_number', models.CharField(max_length=50)),
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='insurance', to='patients.patient')),
+                ('payer', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='members', to='billing.insurancepayer')),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:43
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0007_insurance_claims'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='insurancecoverage',
+            name='start_date',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+    ]
@@ -1,6 +1,10 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from patients.models import Patient
-from core.models import User
+from core.models import Clinic, User
 
 class Bill(models.Model):
     STATUS_CHOICES = (
@@ -10,6 +14,16 @@ class Bill(models.Model):
         ('cancelled', 'Cancelled'),
     )
     
+    OPEN_STATUSES = ('pending', 'partial')
+    
+    # (label, maximum days past due)
+    AGING_BUCKETS = (
+        ('0-30', 30),
+        ('31-60', 60),
+        ('61-90', 90),
+        ('90+', None),
+    )
+    
     bill_number = models.CharField(max_length=50, unique=True)
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
     bill_date = models.DateTimeField(auto_now_add=True)
@@ -26,6 +40,96 @@ class Bill(models.Model):
     @property
     def balance_due(self):
         return self.total_amount - self.paid_amount
+    
+    @classmethod
+    def apply_ledger_delta(cls, bill_id, total_delta=0, paid_delta=0):
+        """
+        Atomically shift a bill's running totals and re-derive its status.
+        
+        The amounts are updated with F-expressions so concurrent item and
+        payment postings never overwrite each other's changes.
+        """
+        with transaction.atomic():
+            cls.objects.filter(pk=bill_id).update(
+                total_amount=F('total_amount') + total_delta,
+                paid_amount=F('paid_amount') + paid_delta,
+            )
+            cls.objects.filter(pk=bill_id).exclude(status='cancelled').update(
+                status=cls._status_expression()
+            )
+    
+    @classmethod
+    def recalculate_totals(cls, bill_ids=None):
+        """Rebuild total, paid amount and status from items and payments"""
+        amount_field = models.DecimalField(max_digits=10, decimal_places=2)
+        item_total = BillItem.objects.filter(
+            bill=OuterRef('pk')
+        ).values('bill').annotate(total=Sum('amount')).values('total')
+        paid_total = Payment.objects.filter(
+            bill=OuterRef('pk')
+        ).values('bill').annotate(total=Sum('amount')).values('total')
+        
+        bills = cls.objects.all()
+        if bill_ids is not None:
+            bills = bills.filter(pk__in=bill_ids)
+        
+        with transaction.atomic():
+            bills.update(
+                total_amount=Coalesce(Subquery(item_total), Value(0), output_field=amount_field),
+                paid_amount=Coalesce(Subquery(paid_total), Value(0), output_field=amount_field),
+            )
+            bills.exclude(status='cancelled').update(status=cls._status_expression())
+    
+    @staticmethod
+    def _status_expression():
+        return Case(
+            When(paid_amount__lte=0, then=Value('pending')),
+            When(paid_amount__lt=F('total_amount'), then=Value('partial')),
+            default=Value('paid'),
+        )
+    
+    @classmethod
+    def get_outstanding_bills(cls):
+        return cls.objects.filter(status__in=cls.OPEN_STATUSES)
+    
+    @classmethod
+    def get_aging_report(cls, as_of=None):
+        """
+        Accounts-receivable aging of open bills by days past due_date.
+        
+        Runs as a single GROUP BY over the (status, due_date) index. Bills
+        that are not yet due fall into the 0-30 bucket.
+        """
+        as_of = as_of or timezone.now().date()
+        
+        bucket_cases = []
+        for label, max_days in cls.AGING_BUCKETS[:-1]:
+            bucket_cases.append(When(
+                due_date__gte=as_of - timezone.timedelta(days=max_days),
+                then=Value(label),
+            ))
+        
+        rows = cls.get_outstanding_bills().annotate(
+            bucket=Case(*bucket_cases, default=Value(cls.AGING_BUCKETS[-1][0]))
+        ).values('bucket').annotate(
+            count=Count('id'),
+            total=Sum(F('total_amount') - F('paid_amount')),
+        ).order_by()
+        
+        totals = {row['bucket']: row for row in rows}
+        return [
+            {
+                'bucket': label,
+                'count': totals.get(label, {}).get('count', 0),
+                'total': totals.get(label, {}).get('total') or 0,
+            }
+            for label, max_days in cls.AGING_BUCKETS
+        ]
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'due_date']),
+        ]
 
 class BillItem(models.Model):
     bill = models.ForeignKey(Bill, on_delete=models.CASCADE, related_name='items')
@@ -33,10 +137,32 @@ class BillItem(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # Set when the item is sent to the patient's insurer, so it is claimed once
+    claim_batch = models.ForeignKey('ClaimBatch', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='items')
+    # What the item charges for, when generated by the billing engine; each can be billed once
+    stock_transaction = models.OneToOneField('inventory.StockTransaction', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='bill_item')
+    appointment = models.OneToOneField('appointments.Appointment', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='bill_item')
     
     def save(self, *args, **kwargs):
         self.amount = self.quantity * self.unit_price
-        super().save(*args, **kwargs)
+        
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = BillItem.objects.filter(pk=self.pk).values('bill_id', 'amount').first()
+            
+            super().save(*args, **kwargs)
+            
+            # Keep the bill total in step with its items
+            if previous:
+                Bill.apply_ledger_delta(previous['bill_id'], total_delta=-previous['amount'])
+            Bill.apply_ledger_delta(self.bill_id, total_delta=self.amount)
+    
+    def delete(self, *args, **kwargs):
+        """Remove the item's amount from the bill total when deleted"""
+        with transaction.atomic():
+            Bill.apply_ledger_delta(self.bill_id, total_delta=-self.amount)
+            return super().delete(*args, **kwargs)
 
 class Payment(models.Model):
     PAYMENT_METHODS = (
@@ -52,6 +178,172 @@ class Payment(models.Model):
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHODS)
     reference_number = models.CharField(max_length=100, blank=True)
     notes = models.TextField(blank=True)
+    # Supplied by the paying client so a retried request posts the payment only once
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+    received_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='received_payments')
+    # Set when the business day is closed; the payment can no longer change
+    settlement = models.ForeignKey('Settlement', on_delete=models.PROTECT, null=True, blank=True, editable=False, related_name='payments')
+    
+    @classmethod
+    def post(cls, bill_id, amount, payment_method, idempotency_key=None, **fields):
+        """
+        Post a payment against a bill, once per idempotency key.
+        
+        The bill row is locked while the payment is checked and inserted, and
+        save() moves the bill's paid amount and status in the same
+        transaction. Repeating a key returns the payment first posted with
+        it; the unique index settles two requests racing with the same key.
+        
+        Returns:
+            tuple: the payment and whether it was created by this call.
+        
+        Raises:
+            ValidationError: the amount is not positive or exceeds the
+            balance, the bill is cancelled, or the key was used for a
+            different payment.
+        """
+        if idempotency_key:
+            existing = cls._replay(idempotency_key, bill_id, amount)
+            if existing:
+                return existing, False
+        try:
+            with transaction.atomic():
+                bill = Bill.objects.select_for_update().only('status', 'total_amount', 'paid_amount').get(pk=bill_id)
+                if amount <= 0:
+                    raise ValidationError({'amount': 'Payment amount must be positive.'})
+                if bill.status == 'cancelled':
+                    raise ValidationError('Payments cannot be posted to a cancelled bill.')
+                if amount > bill.balance_due:
+                    raise ValidationError({'amount': f'Payment exceeds the balance due of {bill.balance_due}.'})
+                payment = cls(
+                    bill_id=bill_id, amount=amount, payment_method=payment_method,
+                    idempotency_key=idempotency_key or None, **fields,
+                )
+                payment.save()
+                return payment, True
+        except IntegrityError:
+            # A concurrent request with the same key won the insert
+            existing = cls._replay(idempotency_key, bill_id, amount) if idempotency_key else None
+            if existing is None:
+                raise
+            return existing, False
+    
+    @classmethod
+    def _replay(cls, idempotency_key, bill_id, amount):
+        existing = cls.objects.filter(idempotency_key=idempotency_key).first()
+        if existing and (existing.bill_id != bill_id or existing.amount != amount):
+            raise ValidationError('This idempotency key was already used for a different payment.')
+        return existing
+    
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = Payment.objects.filter(pk=self.pk).values('bill_id', 'amount', 'settlement_id').first()
+            if previous and previous['settlement_id']:
+                raise ValidationError('This payment is part of a closed business day and cannot be changed.')
+            if not previous and Settlement.objects.filter(
+                clinic__patient__bill=self.bill_id, business_date=timezone.localdate()
+            ).exists():
+                raise ValidationError("Today's business day is closed for this clinic.")
+            
+            super().save(*args, **kwargs)
+            
+            # Post the payment against the bill balance
+            if previous:
+                Bill.apply_ledger_delta(previous['bill_id'], paid_delta=-previous['amount'])
+            Bill.apply_ledger_delta(self.bill_id, paid_delta=self.amount)
+    
+    def delete(self, *args, **kwargs):
+        """Reverse the payment on the bill when deleted"""
+        if Payment.objects.filter(pk=self.pk, settlement__isnull=False).exists():
+            raise ValidationError('This payment is part of a closed business day and cannot be deleted.')
+        with transaction.atomic():
+            Bill.apply_ledger_delta(self.bill_id, paid_delta=-self.amount)
+            return super().delete(*args, **kwargs)
+    
+    def __str__(self):
+        return f"Payment of {self.amount} for Bill {self.bill.bill_number}"
+
+class Settlement(models.Model):
+    """A clinic's closed business day: its payments totalled once and locked"""
+    clinic = models.ForeignKey(Clinic, on_delete=models.PROTECT)
+    business_date = models.DateField()
+    closed_at = models.DateTimeField(auto_now_add=True)
+    closed_by = models.ForeignKey(User, on_delete=models.PROTECT, related_name='closed_settlements')
+    payment_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    statement_checked = models.BooleanField(default=False)  # references were matched against a processor statement
+    
+    def __str__(self):
+        return f"Settlement {self.business_date} - {self.clinic}"
+    
+    class Meta:
+        ordering = ['-business_date', 'clinic']
+        unique_together = ('clinic', 'business_date')
+
+class SettlementLine(models.Model):
+    """Takings of one payment method and cashier within a settlement"""
+    settlement = models.ForeignKey(Settlement, on_delete=models.CASCADE, related_name='lines')
+    payment_method = models.CharField(max_length=20, choices=Payment.PAYMENT_METHODS)
+    cashier = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    payment_count = models.PositiveIntegerField()
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    
+    class Meta:
+        ordering = ['payment_method', 'cashier']
+
+class SettlementDiscrepancy(models.Model):
+    """A payment reference that could not be reconciled when the day was closed"""
+    REASON_CHOICES = (
+        ('missing', 'Missing reference'),
+        ('duplicate', 'Duplicate reference'),
+        ('not_on_statement', 'Not on statement'),
+        ('not_in_payments', 'On statement, no payment'),
+    )
+    
+    settlement = models.ForeignKey(Settlement, on_delete=models.CASCADE, related_name='discrepancies')
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, null=True, blank=True)
+    reference_number = models.CharField(max_length=100, blank=True)
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    
+    class Meta:
+        ordering = ['reason', 'reference_number']
+
+class InsurancePayer(models.Model):
+    """An insurer that claims are sent to, and the file layout it accepts"""
+    CLAIM_FORMAT_CHOICES = (
+        ('csv', 'CSV'),
+        ('fixed', 'Fixed width'),
+    )
+    
+    code = models.CharField(max_length=10, unique=True)
+    name = models.CharField(max_length=200)
+    claim_format = models.CharField(max_length=10, choices=CLAIM_FORMAT_CHOICES, default='csv')
+    
+    def __str__(self):
+        return self.name
+
+class InsuranceCoverage(models.Model):
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, related_name='insurance')
+    payer = models.ForeignKey(InsurancePayer, on_delete=models.PROTECT, related_name='members')
+    member_number = models.CharField(max_length=50)
+    start_date = models.DateField(default=timezone.localdate)
     
     def __str__(self):
-        return f"Payment of {self.amount} for Bill {self.bill.bill_number}"
\ No newline at end of file
+        return f"{self.patient} - {self.payer} {self.member_number}"
+
+class ClaimBatch(models.Model):
+    """One claim file sent to a payer"""
+    payer = models.ForeignKey(InsurancePayer, on_delete=models.PROTECT, related_name='claim_batches')
+    created_at = models.DateTimeField(auto_now_add=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    file_name = models.CharField(max_length=255, blank=True)
+    line_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    def __str__(self):
+        return f"Claim batch {self.pk} - {self.payer}"
+    
+    class Meta:
+        ordering = ['-created_at']
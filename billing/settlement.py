@@ -0,0 +1,133 @@
+"""
+End-of-day settlement.
+
+Closing a clinic's business day reads the day's payments in one pass,
+totals them by payment method and cashier into SettlementLine rows and
+stamps each payment with the Settlement. The settlement row is created
+first, so from then on the day is locked: Payment.save refuses new
+payments for it and refuses to change or delete settled ones.
+
+Card, online and insurance payments must carry a reference number. Missing
+and duplicated references are recorded as discrepancies, and when the
+processor's statement is supplied, so are references on only one side.
+
+Revenue reports read settled days from the settlement lines and only the
+days not yet closed from Payment (see ``revenue_by_day``).
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Payment, Settlement, SettlementDiscrepancy, SettlementLine
+
+REFERENCED_METHODS = ('card', 'online', 'insurance')
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def find_discrepancies(payments, statement_references=None):
+    """
+    Unreconciled references among ``(pk, payment_method, reference_number)`` rows.
+
+    Returns:
+        list: ``(payment_pk, reference_number, reason)`` tuples; the pk is
+        None for statement references that no payment claims.
+    """
+    referenced = [(pk, reference.strip()) for pk, method, reference in payments if method in REFERENCED_METHODS]
+    counts = Counter(reference for _, reference in referenced if reference)
+    found = []
+    for pk, reference in referenced:
+        if not reference:
+            found.append((pk, '', 'missing'))
+        elif counts[reference] > 1:
+            found.append((pk, reference, 'duplicate'))
+        elif statement_references is not None and reference not in statement_references:
+            found.append((pk, reference, 'not_on_statement'))
+    if statement_references is not None:
+        found.extend((None, reference, 'not_in_payments') for reference in sorted(set(statement_references) - set(counts)))
+    return found
+
+
+def close_day(clinic_id, day, user, statement_references=None):
+    """
+    Settle a clinic's payments for ``day`` and lock the day.
+
+    Args:
+        statement_references: reference numbers on the processor's statement
+            for the day, to reconcile against; None skips that check.
+
+    Raises:
+        ValidationError: the day is already closed or still to come.
+    """
+    if day > timezone.localdate():
+        raise ValidationError(f'{day} has not started yet.')
+    if statement_references is not None:
+        statement_references = {reference.strip() for reference in statement_references if reference.strip()}
+    start, end = day_bounds(day)
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                settlement = Settlement.objects.create(
+                    clinic_id=clinic_id, business_date=day, closed_by=user,
+                    statement_checked=statement_references is not None,
+                )
+        except IntegrityError:
+            raise ValidationError(f'{day} is already closed for this clinic.')
+        payments = list(Payment.objects.select_for_update(of=('self',)).filter(
+            bill__patient__clinic_id=clinic_id, payment_date__gte=start, payment_date__lt=end, settlement__isnull=True,
+        ).order_by('pk').values_list('pk', 'payment_method', 'received_by_id', 'amount', 'reference_number'))
+
+        totals = defaultdict(lambda: [0, Decimal('0')])
+        for _, method, cashier, amount, _ in payments:
+            totals[method, cashier][0] += 1
+            totals[method, cashier][1] += amount
+        SettlementLine.objects.bulk_create([
+            SettlementLine(settlement=settlement, payment_method=method, cashier_id=cashier,
+                           payment_count=count, total_amount=total)
+            for (method, cashier), (count, total) in totals.items()
+        ])
+        SettlementDiscrepancy.objects.bulk_create([
+            SettlementDiscrepancy(settlement=settlement, payment_id=pk, reference_number=reference, reason=reason)
+            for pk, reference, reason in find_discrepancies(
+                [(pk, method, reference) for pk, method, _, _, reference in payments], statement_references,
+            )
+        ])
+        Payment.objects.filter(pk__in=[row[0] for row in payments]).update(settlement=settlement)
+
+        settlement.payment_count = len(payments)
+        settlement.total_amount = sum((amount for _, _, _, amount, _ in payments), Decimal('0'))
+        settlement.save(update_fields=['payment_count', 'total_amount'])
+    return settlement
+
+
+def revenue_by_day(start_date, end_date):
+    """
+    Takings per day and payment method between two dates, inclusive.
+
+    Closed days come from their settlement lines; payments are only read
+    for days that have not been settled.
+
+    Returns:
+        list: ``(day, payment_method, total)`` tuples ordered by day.
+    """
+    settled = SettlementLine.objects.filter(
+        settlement__business_date__range=(start_date, end_date),
+    ).values_list('settlement__business_date', 'payment_method').annotate(total=Sum('total_amount')).order_by()
+    start, end = day_bounds(start_date)[0], day_bounds(end_date)[1]
+    unsettled = Payment.objects.filter(
+        settlement__isnull=True, payment_date__gte=start, payment_date__lt=end,
+    ).annotate(day=TruncDate('payment_date')).values_list('day', 'payment_method').annotate(total=Sum('amount')).order_by()
+
+    totals = defaultdict(Decimal)
+    for day, method, total in [*settled, *unsettled]:
+        totals[day, method] += total
+    return sorted((day, method, total) for (day, method), total in totals.items())
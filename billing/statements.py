@@ -0,0 +1,227 @@
+"""
+Batch patient statements.
+
+A statement run writes one PDF per patient with an outstanding balance
+into a spool directory for the print-and-mail service, alongside a
+manifest.csv listing the files written so far.
+
+The balances come from one grouped query over open bills. Patients are
+then read in chunks, two queries per chunk, and each chunk is handed to a
+process pool as plain data: workers never touch the database. Each worker
+builds its renderer once when it starts (WeasyPrint compiles the statement
+template, reportlab its paragraph styles) and reuses it for every
+statement it renders.
+
+A PDF is written under a temporary name and moved into place before its
+manifest row is written, so an interrupted run can simply be started
+again with the same run name: patients already in the manifest are skipped.
+"""
+import csv
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from patients.models import Patient
+from .models import Bill
+
+MANIFEST_FIELDS = ('patient_id', 'file', 'bills', 'balance')
+
+
+class WeasyPrintRenderer:
+    """Renders billing/statement.html to PDF with WeasyPrint."""
+
+    def __init__(self):
+        from django.template.loader import get_template
+        self.template = get_template('billing/statement.html')
+
+    def render(self, statement, path):
+        from weasyprint import HTML
+        HTML(string=self.template.render({'statement': statement})).write_pdf(path)
+
+
+class ReportLabRenderer:
+    """Lays the statement out directly with reportlab, without HTML."""
+
+    def __init__(self):
+        from reportlab.lib.styles import getSampleStyleSheet
+        styles = getSampleStyleSheet()
+        self.title, self.body, self.small = styles['Title'], styles['BodyText'], styles['Italic']
+
+    def render(self, statement, path):
+        from reportlab.lib import colors
+        from reportlab.lib.pagesizes import A4
+        from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+        def text(value):
+            # Paragraphs take reportlab's XML markup
+            return escape(value or '').replace('\n', '<br/>')
+
+        clinic, patient = statement['clinic'], statement['patient']
+        rows = [['Bill', 'Date', 'Due', 'Total', 'Paid', 'Balance']] + [
+            [bill['bill_number'], f"{bill['bill_date']:%d %b %Y}", f"{bill['due_date']:%d %b %Y}",
+             f"{bill['total_amount']:.2f}", f"{bill['paid_amount']:.2f}", f"{bill['balance']:.2f}"]
+            for bill in statement['bills']
+        ] + [['', '', '', '', 'Balance due', f"{statement['balance']:.2f}"]]
+        table = Table(rows, hAlign='LEFT')
+        table.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+            ('LINEBELOW', (0, 0), (-1, 0), 0.5, colors.grey),
+            ('LINEABOVE', (0, -1), (-1, -1), 0.5, colors.grey),
+            ('ALIGN', (3, 0), (-1, -1), 'RIGHT'),
+        ]))
+        SimpleDocTemplate(path, pagesize=A4, title=f"Statement {statement['statement_date']}").build([
+            Paragraph(text(clinic['name']), self.title),
+            Paragraph(f"{text(clinic['address'])}<br/>{text(clinic['phone'])}", self.body),
+            Spacer(1, 18),
+            Paragraph(f"<b>{text(patient['name'])}</b><br/>{text(patient['address'])}", self.body),
+            Spacer(1, 12),
+            Paragraph(f"Statement date: {statement['statement_date']:%d %B %Y}", self.body),
+            Spacer(1, 12),
+            table,
+            Spacer(1, 18),
+            Paragraph('Please quote the bill numbers with your payment.', self.small),
+        ])
+
+
+RENDERERS = {
+    'weasyprint': WeasyPrintRenderer,
+    'reportlab': ReportLabRenderer,
+}
+
+_renderer = None
+
+
+def _init_worker(renderer_name):
+    """Pool initializer: set Django up (under spawn) and build this worker's renderer."""
+    global _renderer
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    _renderer = RENDERERS[renderer_name]()
+
+
+def _render_batch(statements, out_dir):
+    """Render statements into ``out_dir``. Runs in a pool worker; returns manifest rows."""
+    rows = []
+    for statement in statements:
+        name = f"statement-{statement['patient']['id']}.pdf"
+        # Write under a temporary name so the spool never holds a partial file
+        tmp_path = os.path.join(out_dir, f'{name}.{os.getpid()}.tmp')
+        _renderer.render(statement, tmp_path)
+        os.replace(tmp_path, os.path.join(out_dir, name))
+        rows.append((statement['patient']['id'], name, len(statement['bills']), statement['balance']))
+    return rows
+
+
+def outstanding_balances():
+    """``(patient_id, balance)`` for every patient owing money, from one grouped query."""
+    return Bill.get_outstanding_bills().values('patient_id').annotate(
+        balance=Sum(F('total_amount') - F('paid_amount')),
+    ).filter(balance__gt=0).order_by('patient_id').values_list('patient_id', 'balance')
+
+
+def build_statements(patient_ids, statement_date):
+    """Plain-data statements for a chunk of patients, with two queries."""
+    patients = {
+        row['pk']: row for row in Patient.objects.filter(pk__in=patient_ids).values(
+            'pk', 'first_name', 'last_name', 'address', 'clinic__name', 'clinic__address', 'clinic__phone',
+        )
+    }
+    statements = {
+        pk: {
+            'statement_date': statement_date,
+            'patient': {'id': pk, 'name': f"{row['first_name']} {row['last_name']}", 'address': row['address']},
+            'clinic': {'name': row['clinic__name'], 'address': row['clinic__address'], 'phone': row['clinic__phone']},
+            'bills': [],
+            'balance': 0,
+        }
+        for pk, row in patients.items()
+    }
+    bills = Bill.get_outstanding_bills().filter(patient_id__in=patient_ids).order_by('patient_id', 'bill_date').values(
+        'patient_id', 'bill_number', 'bill_date', 'due_date', 'total_amount', 'paid_amount',
+    )
+    for bill in bills:
+        bill['balance'] = bill['total_amount'] - bill['paid_amount']
+        bill['overdue'] = bill['due_date'] < statement_date
+        statement = statements[bill.pop('patient_id')]
+        statement['bills'].append(bill)
+        statement['balance'] += bill['balance']
+    return [statement for statement in statements.values() if statement['balance'] > 0]
+
+
+def read_manifest(path):
+    """Patient ids already written by an earlier attempt at the run."""
+    if not path.exists():
+        return set()
+    with open(path, newline='', encoding='utf-8') as f:
+        # A row cut short by an interruption is ignored and its patient redone
+        return {int(row['patient_id']) for row in csv.DictReader(f) if row.get('balance')}
+
+
+def _ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def run_statements(run_name=None, workers=None, renderer=None, batch_size=None):
+    """
+    Write statements for every patient with a balance, resuming ``run_name`` if it was started before.
+
+    Returns:
+        tuple: the spool directory, the number of statements written and
+        the number skipped as already done.
+    """
+    run_name = run_name or timezone.localdate().strftime('%Y-%m')
+    workers = workers or settings.STATEMENT_WORKERS
+    renderer = renderer or settings.STATEMENT_RENDERER
+    batch_size = batch_size or settings.STATEMENT_BATCH_SIZE
+    if renderer not in RENDERERS:
+        raise ValueError(f'Unknown statement renderer: {renderer}')
+
+    out_dir = Path(settings.STATEMENT_SPOOL_DIR) / run_name
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = out_dir / 'manifest.csv'
+    done = read_manifest(manifest_path)
+    todo = [patient_id for patient_id, _ in outstanding_balances() if patient_id not in done]
+    statement_date = timezone.localdate()
+    chunks = (build_statements(todo[i:i + batch_size], statement_date) for i in range(0, len(todo), batch_size))
+
+    written = 0
+    new_manifest = not manifest_path.exists()
+    with open(manifest_path, 'a+', newline='', encoding='utf-8') as manifest:
+        writer = csv.writer(manifest)
+        if new_manifest:
+            writer.writerow(MANIFEST_FIELDS)
+        elif manifest.tell() and not _ends_with_newline(manifest_path):
+            manifest.write('\r\n')  # finish a row cut short by the interruption
+
+        def record(rows):
+            nonlocal written
+            writer.writerows(rows)
+            manifest.flush()
+            written += len(rows)
+
+        if workers <= 1:
+            _init_worker(renderer)
+            for chunk in chunks:
+                record(_render_batch(chunk, str(out_dir)))
+        else:
+            # Keep only a few chunks in flight so the run never holds every statement in memory
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(renderer,)) as executor:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(executor.submit(_render_batch, chunk, str(out_dir)))
+                    if len(pending) >= workers * 2:
+                        record(pending.popleft().result())
+                while pending:
+                    record(pending.popleft().result())
+    return out_dir, written, len(done)
@@ -1,3 +1,431 @@
-from django.test import TestCase
+import csv
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from appointments.models import Appointment
+from core.models import User, Clinic
+from inventory.models import InventoryItem, Supplier
+from patients.models import Patient
+from prescriptions.dispensing import dispense_prescriptions
+from prescriptions.models import Medicine, Prescription, PrescribedMedicine
+from .engine import bill_patient, generate_bills
+from .claims import _export_batch, export_claims
+from .models import Bill, BillItem, ClaimBatch, InsuranceCoverage, InsurancePayer, Payment, Settlement
+from .settlement import close_day, revenue_by_day
+from .statements import run_statements
 
-# Create your tests here.
+class BillLedgerTestCase(TestCase):
+    def setUp(self):
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.user = User.objects.create_user(username='cashier', password='password')
+        self.patient = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01', clinic=self.clinic)
+        self.bill = Bill.objects.create(
+            bill_number='B-0001',
+            patient=self.patient,
+            due_date=timezone.now().date(),
+            created_by=self.user,
+        )
+
+    def test_items_update_total(self):
+        BillItem.objects.create(bill=self.bill, description='Consultation', quantity=1, unit_price=Decimal('50.00'))
+        item = BillItem.objects.create(bill=self.bill, description='Dressing', quantity=2, unit_price=Decimal('10.00'))
+        self.bill.refresh_from_db()
+        self.assertEqual(self.bill.total_amount, Decimal('70.00'))
+
+        item.quantity = 3
+        item.save()
+        self.bill.refresh_from_db()
+        self.assertEqual(self.bill.total_amount, Decimal('80.00'))
+
+        item.delete()
+        self.bill.refresh_from_db()
+        self.assertEqual(self.bill.total_amount, Decimal('50.00'))
+
+    def test_payments_update_paid_amount_and_status(self):
+        BillItem.objects.create(bill=self.bill, description='Consultation', quantity=1, unit_price=Decimal('100.00'))
+
+        Payment.objects.create(bill=self.bill, amount=Decimal('40.00'), payment_method='cash')
+        self.bill.refresh_from_db()
+        self.assertEqual(self.bill.paid_amount, Decimal('40.00'))
+        self.assertEqual(self.bill.status, 'partial')
+
+        payment = Payment.objects.create(bill=self.bill, amount=Decimal('60.00'), payment_method='card')
+        self.bill.refresh_from_db()
+        self.assertEqual(self.bill.status, 'paid')
+        self.assertEqual(self.bill.balance_due, Decimal('0.00'))
+
+        payment.delete()
+        self.bill.refresh_from_db()
+        self.assertEqual(self.bill.status, 'partial')
+
+    def test_recalculate_totals(self):
+        BillItem.objects.create(bill=self.bill, description='Consultation', quantity=1, unit_price=Decimal('25.00'))
+        Bill.objects.filter(pk=self.bill.pk).update(total_amount=0)
+
+        Bill.recalculate_totals([self.bill.pk])
+        self.bill.refresh_from_db()
+        self.assertEqual(self.bill.total_amount, Decimal('25.00'))
+        self.assertEqual(self.bill.status, 'pending')
+
+class AgingReportTestCase(TestCase):
+    def setUp(self):
+        clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.user = User.objects.create_user(username='cashier', password='password')
+        self.patient = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01', clinic=clinic)
+        self.today = timezone.now().date()
+
+    def _bill(self, number, days_past_due, amount):
+        bill = Bill.objects.create(
+            bill_number=number,
+            patient=self.patient,
+            due_date=self.today - timezone.timedelta(days=days_past_due),
+            created_by=self.user,
+        )
+        BillItem.objects.create(bill=bill, description='Service', quantity=1, unit_price=Decimal(amount))
+        return bill
+
+    def test_buckets(self):
+        self._bill('B-1', -5, '10.00')
+        self._bill('B-2', 30, '20.00')
+        self._bill('B-3', 45, '30.00')
+        self._bill('B-4', 75, '40.00')
+        self._bill('B-5', 200, '50.00')
+        paid = self._bill('B-6', 200, '60.00')
+        Payment.objects.create(bill=paid, amount=Decimal('60.00'), payment_method='cash')
+
+        with self.assertNumQueries(1):
+            report = Bill.get_aging_report(as_of=self.today)
+
+        self.assertEqual(
+            [(row['bucket'], row['count'], row['total']) for row in report],
+            [
+                ('0-30', 2, Decimal('30.00')),
+                ('31-60', 1, Decimal('30.00')),
+                ('61-90', 1, Decimal('40.00')),
+                ('90+', 1, Decimal('50.00')),
+            ]
+        )
+
+class BillingEngineTestCase(TestCase):
+    def setUp(self):
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.user = User.objects.create_user(username='cashier', password='password')
+        self.client.login(username='cashier', password='password')
+        self.cardiologist = User.objects.create_user(username='heart', user_type='doctor', specialization='Cardiology')
+        self.patients = [
+            Patient.objects.create(first_name=f'Patient{i}', last_name='Doe', date_of_birth='1990-01-01', clinic=self.clinic)
+            for i in range(3)
+        ]
+        medicine = Medicine.objects.create(name='Amoxil', generic_name='Amoxicillin', strength='500mg')
+        supplier = Supplier.objects.create(name='MedSupply', phone='555-0100')
+        InventoryItem.objects.create(medicine=medicine, batch_number='A1', quantity=100, expiry_date=timezone.localdate() + timedelta(days=90),
+                                     cost_price=Decimal('1.00'), selling_price=Decimal('2.50'), supplier=supplier)
+        prescriptions = []
+        for patient in self.patients:
+            prescription = Prescription.objects.create(patient=patient, doctor=self.cardiologist)
+            PrescribedMedicine.objects.create(prescription=prescription, medicine=medicine, dosage='1 tab',
+                                              frequency='TDS', duration='5 days', quantity=4)
+            prescriptions.append(prescription.pk)
+            self.visit(patient, self.cardiologist)
+        dispense_prescriptions(prescriptions, self.user)
+
+    def visit(self, patient, doctor, status='completed'):
+        return Appointment.objects.create(patient=patient, doctor=doctor, clinic=self.clinic, reason='Checkup', status=status,
+                                          appointment_date=timezone.now() - timedelta(hours=2))
+
+    @override_settings(CONSULTATION_FEES={'cardiology': '80.00', 'default': '40.00'})
+    def test_bill_patient_once(self):
+        patient = self.patients[0]
+        self.visit(patient, self.user, status='scheduled')  # not billable yet
+        bill, unpriced = bill_patient(patient.pk, self.user)
+        self.assertEqual(unpriced, [])
+        self.assertEqual((bill.total_amount, bill.status), (Decimal('90.00'), 'pending'))  # 4 x 2.50 + 80.00
+        self.assertEqual(sorted(bill.items.values_list('amount', flat=True)), [Decimal('10.00'), Decimal('80.00')])
+        self.assertEqual(bill_patient(patient.pk, self.user), (None, []))
+
+        response = self.client.post(reverse('generate-patient-bill', args=[patient.pk]), follow=True)
+        self.assertIn('Nothing to bill.', [str(message) for message in response.context['messages']])
+
+    def test_numbering_continues_after_the_highest_number(self):
+        prefix = f"BL{timezone.now():%y%m%d}"
+        for number in ('00001', '00003'):  # 00002 was deleted
+            Bill.objects.create(bill_number=f'{prefix}{number}', patient=self.patients[1], due_date=timezone.localdate(), created_by=self.user)
+        bill, _ = bill_patient(self.patients[0].pk, self.user)
+        self.assertEqual(bill.bill_number, f'{prefix}00004')
+
+        # A concurrent run took the next number between reading and inserting
+        with mock.patch('billing.engine.last_bill_sequence', side_effect=[3, 4]):
+            bill, _ = bill_patient(self.patients[1].pk, self.user)
+        self.assertEqual(bill.bill_number, f'{prefix}00005')
+
+    @override_settings(CONSULTATION_FEES={'cardiology': '80.00'})
+    def test_generate_bills_in_chunks(self):
+        general = User.objects.create_user(username='gp', user_type='doctor')
+        unfeed = self.visit(self.patients[1], general)
+        with self.assertNumQueries(2 + 2 * 13):  # pending patients, then per chunk: sources, numbering, inserts, totals, savepoints
+            created, unpriced = generate_bills(self.user, batch_size=2)
+        self.assertEqual((created, unpriced), (3, [unfeed]))
+        self.assertEqual(sorted(Bill.objects.values_list('total_amount', flat=True)), [Decimal('90.00')] * 3)
+        self.assertEqual(len(set(Bill.objects.values_list('bill_number', flat=True))), 3)
+
+        # Only the unpriced appointment is still pending, and a fee now bills it
+        self.assertEqual(generate_bills(self.user), (0, [unfeed]))
+        with override_settings(CONSULTATION_FEES={'default': '30.00'}):
+            call_command('generate_bills', user='cashier', stdout=StringIO())
+        self.assertEqual(BillItem.objects.get(appointment=unfeed).amount, Decimal('30.00'))
+
+class PaymentPostingTestCase(TestCase):
+    def setUp(self):
+        clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.user = User.objects.create_user(username='cashier', password='password')
+        self.client.login(username='cashier', password='password')
+        patient = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01', clinic=clinic)
+        self.bill = Bill.objects.create(bill_number='B-0001', patient=patient, due_date=timezone.now().date(), created_by=self.user)
+        BillItem.objects.create(bill=self.bill, description='Consultation', quantity=1, unit_price=Decimal('100.00'))
+        self.url = reverse('api-post-payment', args=[self.bill.pk])
+
+    def test_retried_payment_is_posted_once(self):
+        first = self.client.post(self.url, {'amount': '60.00', 'payment_method': 'card'}, HTTP_IDEMPOTENCY_KEY='term-1-0001')
+        retry = self.client.post(self.url, {'amount': '60.00', 'payment_method': 'card'}, HTTP_IDEMPOTENCY_KEY='term-1-0001')
+        self.assertEqual((first.status_code, retry.status_code), (201, 200))
+        self.assertEqual(first.json()['payment'], retry.json()['payment'])
+        self.assertEqual((retry.json()['status'], retry.json()['balance_due']), ('partial', '40.00'))
+        self.assertEqual(Payment.objects.count(), 1)
+
+        response = self.client.post(self.url, '{"amount": 40, "payment_method": "cash"}', content_type='application/json',
+                                    HTTP_IDEMPOTENCY_KEY='term-1-0002')
+        self.assertEqual((response.status_code, response.json()['status']), (201, 'paid'))
+
+    def test_rejected_payments(self):
+        cases = [
+            ({'amount': '150.00', 'payment_method': 'cash'}, 'exceeds the balance'),
+            ({'amount': '0', 'payment_method': 'cash'}, 'must be positive'),
+            ({'amount': '10', 'payment_method': 'cheque'}, 'Unknown payment method'),
+            ({'amount': 'NaN', 'payment_method': 'cash'}, 'Enter a number'),
+            ({'amount': '10.005', 'payment_method': 'cash'}, 'decimal places'),
+            ({'payment_method': 'cash'}, 'amount: This field is required'),
+        ]
+        for data, error in cases:
+            response = self.client.post(self.url, data)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(error, response.json()['error'])
+        for body, error in [('[1]', 'JSON object'), ('{"amount": ', 'not valid JSON'), ('{"amount": "NaN", "payment_method": "cash"}', 'Enter a number')]:
+            response = self.client.post(self.url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(error, response.json()['error'])
+
+        response = self.client.post(self.url, '{"amount": 5, "payment_method": "cash", "notes": null, "reference_number": null}',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Payment.objects.get().notes, '')
+        Payment.objects.get().delete()
+
+        Payment.post(self.bill.pk, Decimal('10.00'), 'cash', idempotency_key='k1')
+        with self.assertRaisesMessage(ValidationError, 'different payment'):
+            Payment.post(self.bill.pk, Decimal('20.00'), 'cash', idempotency_key='k1')
+        self.bill.refresh_from_db()
+        self.assertEqual(self.bill.paid_amount, Decimal('10.00'))
+
+class SettlementTestCase(TestCase):
+    def setUp(self):
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        other_clinic = Clinic.objects.create(name='Other Clinic', address='9 Other St', established_date=timezone.now())
+        self.user = User.objects.create_user(username='cashier', password='password')
+        self.other = User.objects.create_user(username='cashier2')
+        self.client.login(username='cashier', password='password')
+        patient = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01', clinic=self.clinic)
+        elsewhere = Patient.objects.create(first_name='Jane', last_name='Roe', date_of_birth='1990-01-01', clinic=other_clinic)
+        self.bill = Bill.objects.create(bill_number='B-1', patient=patient, due_date=timezone.localdate(), created_by=self.user)
+        BillItem.objects.create(bill=self.bill, description='Surgery', quantity=1, unit_price=Decimal('1000.00'))
+        other_bill = Bill.objects.create(bill_number='B-2', patient=elsewhere, due_date=timezone.localdate(), created_by=self.user)
+        BillItem.objects.create(bill=other_bill, description='Consultation', quantity=1, unit_price=Decimal('50.00'))
+        for amount, method, cashier, reference in [
+            ('100.00', 'cash', self.user, ''), ('50.00', 'cash', self.user, ''), ('20.00', 'cash', self.other, ''),
+            ('200.00', 'card', self.user, 'TX1'), ('80.00', 'card', self.user, 'TX2'),
+            ('30.00', 'card', self.other, 'TX2'), ('40.00', 'online', self.other, ''),
+        ]:
+            Payment.post(self.bill.pk, Decimal(amount), method, received_by=cashier, reference_number=reference)
+        Payment.post(other_bill.pk, Decimal('50.00'), 'cash', received_by=self.user)
+        self.today = timezone.localdate()
+
+    def test_close_day_totals_and_locks(self):
+        settlement = close_day(self.clinic.pk, self.today, self.user, statement_references=['TX1', 'TX2', 'TX9'])
+        self.assertEqual((settlement.payment_count, settlement.total_amount), (7, Decimal('520.00')))
+        self.assertEqual(
+            sorted((line.payment_method, line.cashier.username, line.payment_count, line.total_amount) for line in settlement.lines.all()),
+            [('card', 'cashier', 2, Decimal('280.00')), ('card', 'cashier2', 1, Decimal('30.00')),
+             ('cash', 'cashier', 2, Decimal('150.00')), ('cash', 'cashier2', 1, Decimal('20.00')),
+             ('online', 'cashier2', 1, Decimal('40.00'))],
+        )
+        self.assertEqual(
+            sorted(settlement.discrepancies.values_list('reason', 'reference_number')),
+            [('duplicate', 'TX2'), ('duplicate', 'TX2'), ('missing', ''), ('not_in_payments', 'TX9')],
+        )
+        self.assertEqual(Payment.objects.filter(settlement__isnull=True).count(), 1)  # the other clinic's
+
+        payment = Payment.objects.filter(settlement=settlement).first()
+        payment.amount = Decimal('1.00')
+        with self.assertRaisesMessage(ValidationError, 'closed business day'):
+            payment.save()
+        with self.assertRaisesMessage(ValidationError, 'closed business day'):
+            payment.delete()
+        with self.assertRaisesMessage(ValidationError, 'business day is closed'):
+            Payment.post(self.bill.pk, Decimal('10.00'), 'cash')
+        with self.assertRaisesMessage(ValidationError, 'already closed'):
+            close_day(self.clinic.pk, self.today, self.user)
+
+    def test_revenue_reads_settlements(self):
+        close_day(self.clinic.pk, self.today, self.user)
+        Payment.objects.filter(settlement__isnull=False).update(amount=0)  # settled days no longer read payments
+        self.assertEqual(
+            [(method, total) for _, method, total in revenue_by_day(self.today, self.today)],
+            [('card', Decimal('310.00')), ('cash', Decimal('220.00')), ('online', Decimal('40.00'))],
+        )
+        response = self.client.get(reverse('generate-report', args=['financial']))
+        self.assertEqual(response.context['total_revenue'], Decimal('570.00'))
+
+    def test_close_day_from_the_page(self):
+        statement = SimpleUploadedFile('statement.csv', b'reference,amount\nTX1,200.00\n')
+        response = self.client.post(reverse('close-business-day'), {
+            'clinic': self.clinic.pk, 'business_date': self.today.isoformat(), 'statement': statement,
+        }, follow=True)
+        self.assertContains(response, 'Closed ')
+        settlement = Settlement.objects.get()
+        self.assertTrue(settlement.statement_checked)
+        self.assertIn(('not_in_payments', 'reference'), settlement.discrepancies.values_list('reason', 'reference_number'))
+
+        response = self.client.post(reverse('close-business-day'), {'clinic': self.clinic.pk, 'business_date': self.today.isoformat()})
+        self.assertContains(response, 'already closed')
+
+@override_settings(STATEMENT_RENDERER='reportlab')
+class StatementRunTestCase(TestCase):
+    def setUp(self):
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        self.enterContext(override_settings(STATEMENT_SPOOL_DIR=spool.name))
+        clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', phone='555-0100', established_date=timezone.now())
+        user = User.objects.create_user(username='cashier')
+        self.owing = []
+        for i in range(5):
+            patient = Patient.objects.create(first_name=f'Patient{i}', last_name='Doe & Sons', date_of_birth='1990-01-01',
+                                             clinic=clinic, address=f'{i} Main St\nSpringfield')
+            bill = Bill.objects.create(bill_number=f'B-{i}', patient=patient, due_date=timezone.localdate(), created_by=user)
+            BillItem.objects.create(bill=bill, description='Consultation', quantity=1, unit_price=Decimal('50.00'))
+            if i == 4:
+                Payment.objects.create(bill=bill, amount=Decimal('50.00'), payment_method='cash')  # settled up
+            else:
+                self.owing.append(patient.pk)
+
+    def manifest(self, out_dir):
+        with open(out_dir / 'manifest.csv', newline='') as f:
+            return list(csv.DictReader(f))
+
+    def test_statement_run_resumes(self):
+        with self.assertNumQueries(3):  # balances, then patients and bills for the one chunk
+            out_dir, written, skipped = run_statements('2026-10', workers=1)
+        self.assertEqual((written, skipped), (4, 0))
+        rows = self.manifest(out_dir)
+        self.assertEqual(sorted(int(row['patient_id']) for row in rows), self.owing)
+        self.assertTrue(all((out_dir / row['file']).read_bytes().startswith(b'%PDF') for row in rows))
+
+        # Interrupted part-way through writing the last manifest row
+        text = (out_dir / 'manifest.csv').read_text()
+        (out_dir / 'manifest.csv').write_text(text[:text.rindex(',')])
+        out_dir, written, skipped = run_statements('2026-10', workers=1)
+        self.assertEqual((written, skipped), (1, 3))
+        self.assertEqual(sorted(int(row['patient_id']) for row in self.manifest(out_dir) if row['balance']), self.owing)
+
+    def test_statement_run_in_process_pool(self):
+        out = StringIO()
+        call_command('generate_statements', run='pool', workers=2, batch_size=1, stdout=out)
+        self.assertIn('Wrote 4 statements', out.getvalue())
+        self.assertEqual(len(list((Path(settings.STATEMENT_SPOOL_DIR) / 'pool').glob('*.pdf'))), 4)
+
+class ClaimExportTestCase(TestCase):
+    def setUp(self):
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        self.enterContext(override_settings(CLAIM_EXPORT_DIR=spool.name))
+        self.spool = Path(spool.name)
+        clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.user = User.objects.create_user(username='cashier')
+        self.acme = InsurancePayer.objects.create(code='ACME', name='Acme Health', claim_format='csv')
+        self.mutual = InsurancePayer.objects.create(code='MUT', name='Mutual', claim_format='fixed')
+        for i, payer in enumerate([self.acme, self.acme, self.mutual, None]):
+            patient = Patient.objects.create(first_name='José', last_name=f'Núñez{i}', date_of_birth='1990-01-02', clinic=clinic)
+            if payer:
+                InsuranceCoverage.objects.create(patient=patient, payer=payer, member_number=f'M{i:03d}')
+            bill = Bill.objects.create(bill_number=f'B-{i}', patient=patient, due_date=timezone.localdate(), created_by=self.user)
+            BillItem.objects.create(bill=bill, description='Consultation', quantity=1, unit_price=Decimal('50.00'))
+            BillItem.objects.create(bill=bill, description='Amoxil', quantity=3, unit_price=Decimal('2.50'))
+        cancelled = Bill.objects.get(bill_number='B-1')
+        cancelled.status = 'cancelled'
+        cancelled.save()
+
+    def test_export_claims_once_per_item(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            batches = export_claims(self.user, max_lines=1)
+        self.assertEqual([(batch.payer.code, batch.line_count) for batch in batches], [('ACME', 1), ('ACME', 1), ('MUT', 1), ('MUT', 1)])
+        self.assertEqual(export_claims(self.user), [])
+        self.assertEqual(BillItem.objects.filter(claim_batch__isnull=False).count(), 4)  # not the cancelled or uninsured bills
+
+        with open(self.spool / 'ACME' / batches[0].file_name, newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(
+            [(row['member_number'], row['last_name'], row['amount']) for row in rows],
+            [('M000', 'Núñez0', '50.00')],
+        )
+
+    def test_fixed_width_file(self):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('export_claims', payer=['MUT'], stdout=out)
+        self.assertIn('Wrote 1 claim files', out.getvalue())
+        batch = ClaimBatch.objects.get()
+        lines = (self.spool / 'MUT' / batch.file_name).read_text().splitlines()
+        self.assertEqual([line[0] for line in lines], ['H', 'D', 'D', 'T'])
+        self.assertEqual(len({len(line) for line in lines[1:-1]}), 1)
+        self.assertEqual(lines[1][8:28].rstrip(), 'M002')
+        self.assertEqual(lines[1][28:53].rstrip(), 'NUNEZ2')
+        self.assertEqual(lines[-1], 'T000000002' + '0000000005750')
+        self.assertEqual((batch.line_count, batch.total_amount), (2, Decimal('57.50')))
+
+    def test_only_claims_what_the_payer_owes(self):
+        Bill.objects.filter(bill_number='B-0').update(status='paid', paid_amount=Decimal('57.50'))
+        InsuranceCoverage.objects.filter(member_number='M002').update(start_date=timezone.localdate() + timedelta(days=1))
+        self.assertEqual(export_claims(self.user), [])
+
+    def test_partly_paid_bill_is_claimed_net_of_payments(self):
+        Bill.objects.filter(bill_number='B-2').update(status='partial', paid_amount=Decimal('23.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            batch, = export_claims(self.user, payers=[self.mutual])
+        lines = (self.spool / 'MUT' / batch.file_name).read_text().splitlines()
+        self.assertEqual([line[-11:] for line in lines[1:-1]], ['00000003000', '00000000450'])
+        self.assertEqual(lines[-1], 'T000000002' + '0000000003450')
+        self.assertEqual(batch.total_amount, Decimal('34.50'))
+
+    def test_stamped_items_are_not_claimed_again(self):
+        # A second export whose pending subquery was computed before the first one committed
+        stale = lambda payer_id: BillItem.objects.filter(bill__patient__insurance__payer_id=payer_id)
+        with mock.patch('billing.claims.pending_claims', stale):
+            first = _export_batch(self.mutual, self.user, 10)
+            self.assertIsNone(_export_batch(self.mutual, self.user, 10))
+        self.assertEqual(set(BillItem.objects.filter(bill__bill_number='B-2').values_list('claim_batch', flat=True)), {first.pk})
+
+    def test_file_moved_into_place_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            batch, = export_claims(self.user, payers=[self.mutual])
+        self.assertEqual([path.name for path in (self.spool / 'MUT').iterdir()], [f'{batch.file_name}.tmp'])
+        for callback in callbacks:
+            callback()
+        self.assertEqual([path.name for path in (self.spool / 'MUT').iterdir()], [batch.file_name])
@@ -0,0 +1,9 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('patients/<int:patient_pk>/generate/', views.generate_patient_bill, name='generate-patient-bill'),
+    path('api/bills/<int:bill_pk>/payments/', views.post_payment_api, name='api-post-payment'),
+    path('settlements/', views.settlement_list, name='settlement-list'),
+    path('settlements/close/', views.close_business_day, name='close-business-day'),
+]
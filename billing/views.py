@@ -1,3 +1,101 @@
-from django.shortcuts import render
+import json
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.views.decorators.http import require_POST
+from patients.models import Patient
+from .engine import bill_patient
+from .forms import CloseDayForm, PaymentPostForm
+from .models import Bill, Payment, Settlement
+from .settlement import close_day
 
-# Create your views here.
+@login_required
+@require_POST
+def generate_patient_bill(request, patient_pk):
+    """Bill the patient's dispensed medicines and completed appointments at checkout"""
+    patient = get_object_or_404(Patient.objects.only('pk'), pk=patient_pk)
+    bill, unpriced = bill_patient(patient.pk, request.user)
+    if bill:
+        messages.success(request, f'Bill {bill.bill_number} created for {bill.total_amount}.')
+    else:
+        messages.info(request, 'Nothing to bill.')
+    for appointment in unpriced:
+        messages.warning(request, f'Appointment on {appointment.appointment_date:%d %b %Y} has no consultation fee and was not billed.')
+    return redirect('patient-detail', pk=patient.pk)
+
+@login_required
+@require_POST
+def post_payment_api(request, bill_pk):
+    """
+    Post a payment (amount, payment_method, reference_number, notes as form
+    fields or JSON) against a bill. Send the same Idempotency-Key header
+    when retrying: the payment is posted once and the retry gets it back
+    with status 200 instead of 201.
+    """
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'error': 'The body is not valid JSON.'}, status=400)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'The body must be a JSON object.'}, status=400)
+    else:
+        data = request.POST.dict()
+    if request.headers.get('Idempotency-Key'):
+        data['idempotency_key'] = request.headers['Idempotency-Key']
+    form = PaymentPostForm(data)
+    if not form.is_valid():
+        return JsonResponse({'error': form.error_message()}, status=400)
+
+    get_object_or_404(Bill.objects.only('pk'), pk=bill_pk)
+    try:
+        payment, created = Payment.post(
+            bill_pk, form.cleaned_data['amount'], form.cleaned_data['payment_method'],
+            idempotency_key=form.cleaned_data['idempotency_key'], reference_number=form.cleaned_data['reference_number'],
+            notes=form.cleaned_data['notes'], received_by=request.user,
+        )
+    except ValidationError as e:
+        return JsonResponse({'error': ' '.join(e.messages)}, status=400)
+    bill = Bill.objects.only('status', 'total_amount', 'paid_amount').get(pk=bill_pk)
+    return JsonResponse({
+        'payment': payment.pk,
+        'amount': str(payment.amount),
+        'bill': bill.pk,
+        'status': bill.status,
+        'paid_amount': str(bill.paid_amount),
+        'balance_due': str(bill.balance_due),
+    }, status=201 if created else 200)
+
+def _settlement_page(request, form):
+    settlements = Settlement.objects.select_related('clinic', 'closed_by').prefetch_related(
+        'lines__cashier', 'discrepancies',
+    )
+    page_obj = Paginator(settlements, 20).get_page(request.GET.get('page'))
+    return render(request, 'billing/settlement_list.html', {'page_obj': page_obj, 'form': form})
+
+@login_required
+def settlement_list(request):
+    """Closed business days with their takings and unmatched references"""
+    return _settlement_page(request, CloseDayForm())
+
+@login_required
+@require_POST
+def close_business_day(request):
+    form = CloseDayForm(request.POST, request.FILES)
+    if form.is_valid():
+        try:
+            settlement = close_day(
+                form.cleaned_data['clinic'].pk, form.cleaned_data['business_date'], request.user,
+                statement_references=form.statement_references(),
+            )
+        except ValidationError as e:
+            form.add_error('business_date', e)
+        else:
+            messages.success(request, f'Closed {settlement.business_date}: {settlement.payment_count} payments, {settlement.total_amount}.')
+            if settlement.discrepancies.exists():
+                messages.warning(request, 'Some payment references could not be matched; see below.')
+            return redirect('settlement-list')
+    return _settlement_page(request, form)
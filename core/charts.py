@@ -0,0 +1,150 @@
+"""
+Server-side chart rendering for exported reports.
+
+Charts are drawn with matplotlib in a process pool and stored in an on-disk
+cache named after a hash of the chart data, so an identical chart is only
+ever rendered once and PDF exports can embed it by file URL.
+"""
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+
+CHART_KINDS = ('bar', 'line', 'pie')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+    import seaborn
+    seaborn.set_theme(style='whitegrid')
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.CHART_RENDER_WORKERS,
+                initializer=_init_worker,
+            )
+    return _executor
+
+
+def _render_chart(spec, fmt, path):
+    """Draw one chart and write it to ``path``. Runs in a pool worker."""
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 3.5), dpi=120)
+    labels, values = spec['labels'], spec['values']
+
+    if spec['kind'] == 'pie':
+        ax.pie(values, labels=labels, autopct='%1.0f%%', startangle=90)
+        ax.axis('equal')
+    elif spec['kind'] == 'line':
+        ax.plot(labels, values, marker='o', color='#10b981')
+        ax.fill_between(labels, values, alpha=0.1, color='#10b981')
+    else:
+        ax.bar(labels, values, color='#3b82f6')
+
+    if spec['kind'] != 'pie':
+        ax.tick_params(axis='x', labelrotation=45, labelsize=8)
+        ax.set_ylim(bottom=0)
+    ax.set_title(spec['title'])
+    fig.tight_layout()
+
+    # Write under a temporary name so readers never see a partial file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    fig.savefig(tmp_path, format=fmt)
+    plt.close(fig)
+    os.replace(tmp_path, path)
+    return path
+
+
+def chart_key(spec, fmt='png'):
+    """Content hash identifying a chart's rendered output."""
+    payload = json.dumps([spec, fmt], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def make_chart(kind, title, rows, label_field, value_field):
+    """Build a chart spec from a list of report rows."""
+    if kind not in CHART_KINDS:
+        raise ValueError(f"Unknown chart kind: {kind}")
+    return {
+        'kind': kind,
+        'title': title,
+        'labels': [str(row[label_field]) for row in rows],
+        'values': [float(row[value_field] or 0) for row in rows],
+    }
+
+
+def render_charts(specs, fmt='png'):
+    """
+    Render chart specs, reusing any already in the cache.
+
+    Args:
+        specs: dict mapping a chart name to a spec from ``make_chart``.
+        fmt: ``'png'`` or ``'svg'``.
+
+    Returns:
+        dict: the cached file ``Path`` for each chart name.
+    """
+    cache_dir = Path(settings.CHART_CACHE_DIR)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    paths = {}
+    missing = {}
+    for name, spec in specs.items():
+        path = cache_dir / f'{chart_key(spec, fmt)}.{fmt}'
+        paths[name] = path
+        if not path.exists():
+            missing[path] = spec
+
+    if missing:
+        if settings.CHART_RENDER_WORKERS <= 1:
+            _init_worker()
+            for path, spec in missing.items():
+                _render_chart(spec, fmt, str(path))
+        else:
+            executor = _get_executor()
+            futures = [executor.submit(_render_chart, spec, fmt, str(path)) for path, spec in missing.items()]
+            for future in futures:
+                future.result(timeout=settings.CHART_RENDER_TIMEOUT)
+
+    return paths
+
+
+def get_report_charts(context, report_type):
+    """Render the charts shown in a report's PDF export, keyed by name."""
+    specs = {}
+
+    if report_type == 'patient':
+        if context.get('registrations'):
+            specs['registrations'] = make_chart(
+                'bar', 'Patient Registrations', context['registrations'], 'month', 'count'
+            )
+    elif report_type == 'appointment':
+        if context.get('status_distribution'):
+            specs['status_distribution'] = make_chart(
+                'pie', 'Appointment Status', context['status_distribution'], 'status', 'count'
+            )
+    elif report_type == 'financial':
+        if context.get('monthly_revenue'):
+            specs['revenue'] = make_chart(
+                'line', 'Monthly Revenue ($)', context['monthly_revenue'], 'month', 'total'
+            )
+    elif report_type == 'inventory':
+        if context.get('expiry_timeline'):
+            specs['expiry_timeline'] = make_chart(
+                'bar', 'Stock Expiring by Month', context['expiry_timeline'], 'month', 'items_expiring'
+            )
+
+    return {name: path.as_uri() for name, path in render_charts(specs).items()}
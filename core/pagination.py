@@ -0,0 +1,112 @@
+"""
+Keyset (cursor) pagination for large tables.
+
+Unlike ``django.core.paginator.Paginator`` this never counts the table or
+uses OFFSET: each page continues from the ordering values of the last row
+of the previous one, so page N costs the same as page 1. Going back, a
+page is read in reverse ordering from the first row of the page after it.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+
+class CursorPaginator:
+    """
+    Paginate a queryset by a unique ordering, e.g. ``('-registration_date', '-id')``.
+
+    The last ordering field must be unique (normally the primary key) so
+    that rows sharing the earlier values are neither skipped nor repeated.
+    """
+
+    def __init__(self, queryset, ordering, per_page=25):
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = ordering
+        self.per_page = per_page
+        self.fields = [name.lstrip('-') for name in ordering]
+
+    def get_page(self, cursor=None):
+        position, before = self.decode_cursor(cursor) or (None, False)
+        if before:
+            return self._page_before(position)
+
+        queryset = self.queryset
+        if position is not None:
+            queryset = queryset.filter(self._beyond(position))
+
+        rows = list(queryset[:self.per_page + 1])
+        next_cursor = previous_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            next_cursor = self.encode_cursor(rows[-1])
+        if position is not None and rows:
+            previous_cursor = self.encode_cursor(rows[0], before=True)
+        return CursorPage(rows, next_cursor, previous_cursor)
+
+    def _page_before(self, position):
+        rows = list(self.queryset.reverse().filter(self._beyond(position, before=True))[:self.per_page + 1])
+        previous_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            previous_cursor = self.encode_cursor(rows[-1], before=True)
+        rows.reverse()
+        next_cursor = self.encode_cursor(rows[-1]) if rows else None
+        return CursorPage(rows, next_cursor, previous_cursor)
+
+    def _beyond(self, position, before=False):
+        # (a, b) after (x, y)  =>  a > x OR (a = x AND b > y), flipped for descending fields and for before
+        condition = Q()
+        equal = {}
+        for name, value in zip(self.ordering, position):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') != before else 'gt'
+            condition |= Q(**equal, **{f'{field}__{lookup}': value})
+            equal[field] = value
+        return condition
+
+    def encode_cursor(self, obj, before=False):
+        # isoformat() keeps full microsecond precision, which the keyset comparison needs
+        values = [getattr(obj, field) for field in self.fields]
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        payload = json.dumps({'before' if before else 'after': values})
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """Return ``(ordering values, before)`` from ``cursor``, or None if invalid."""
+        if not cursor:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            (direction, values), = payload.items()
+            if direction not in ('after', 'before') or len(values) != len(self.fields):
+                return None
+            model_fields = [self.queryset.model._meta.get_field(field) for field in self.fields]
+            return [field.to_python(value) for field, value in zip(model_fields, values)], direction == 'before'
+        except (ValueError, TypeError, AttributeError, ValidationError):
+            return None
@@ -0,0 +1,79 @@
+"""
+Run independent ORM queries concurrently on separate database connections.
+
+Django opens one connection per thread, so each query submitted here runs
+on a pool thread with its own connection and the caller waits only as long
+as the slowest query instead of the sum of all of them.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.REPORT_QUERY_WORKERS,
+                thread_name_prefix='report-query',
+            )
+    return _executor
+
+
+def _run_query(func):
+    # Pool threads live outside the request cycle, so honour CONN_MAX_AGE here
+    close_old_connections()
+    try:
+        return func()
+    finally:
+        close_old_connections()
+
+
+def run_queries(queries, timeout=None):
+    """
+    Evaluate independent queries concurrently and return their results.
+
+    Args:
+        queries: dict mapping a result name to a zero-argument callable. Each
+            callable must fully evaluate its queryset (``count()``, ``list()``,
+            ``aggregate()``) because it runs on a different connection.
+        timeout: seconds to wait for all queries, defaulting to
+            ``settings.REPORT_QUERY_TIMEOUT``.
+
+    Returns:
+        dict: the result of each callable under its name.
+
+    Raises:
+        TimeoutError: if the queries did not all finish within ``timeout``.
+            Queries that have not started are cancelled, but a query that is
+            already running cannot be interrupted: it keeps its pool thread
+            and connection until the database finishes it, so repeated
+            timeouts can fill the REPORT_QUERY_WORKERS pool. Views should
+            answer with an error rather than retry.
+
+    Inside an atomic block the queries run inline on the current connection,
+    since other connections cannot see its uncommitted rows.
+    """
+    if timeout is None:
+        timeout = settings.REPORT_QUERY_TIMEOUT
+
+    if connection.in_atomic_block or settings.REPORT_QUERY_WORKERS <= 1:
+        return {name: func() for name, func in queries.items()}
+
+    executor = _get_executor()
+    futures = {name: executor.submit(_run_query, func) for name, func in queries.items()}
+
+    done, not_done = wait(futures.values(), timeout=timeout)
+    if not_done:
+        for future in not_done:
+            future.cancel()
+        pending = sorted(name for name, future in futures.items() if future in not_done)
+        raise TimeoutError(f"Queries did not finish within {timeout}s: {', '.join(pending)}")
+
+    return {name: future.result() for name, future in futures.items()}
@@ -1,10 +1,20 @@
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
 from django.core.management import call_command
-from django.test import TestCase
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
 from core.models import Clinic, User
 from patients.models import Patient
 from appointments.models import Appointment
 from inventory.models import Supplier, Category, InventoryItem
 from prescriptions.models import Medicine
+from core import charts
+from core.charts import make_chart, render_charts
+from core.parallel import run_queries
 
 class PopulateDbTestCase(TestCase):
     def test_populate_db_command(self):
@@ -20,3 +30,69 @@ class PopulateDbTestCase(TestCase):
         self.assertEqual(Category.objects.count(), 5)
         self.assertEqual(Medicine.objects.count(), 100)
         self.assertEqual(InventoryItem.objects.count(), 200)
+
+class FinancialReportTestCase(TestCase):
+    def setUp(self):
+        User.objects.create_user(username='testuser', password='password')
+        self.client.login(username='testuser', password='password')
+
+    def test_dashboard(self):
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_patients'], 0)
+
+    def test_financial_report_includes_aging(self):
+        response = self.client.get(reverse('generate-report', args=['financial']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['bucket'] for row in response.context['ar_aging']], ['0-30', '31-60', '61-90', '90+'])
+        self.assertEqual(response.context['outstanding_bills'], 0)
+
+    def test_slow_queries_answer_503(self):
+        with mock.patch('core.views.run_queries', side_effect=TimeoutError('Queries did not finish within 30s: revenue')):
+            dashboard = self.client.get(reverse('dashboard'))
+            report = self.client.get(reverse('generate-report', args=['financial']))
+        self.assertEqual((dashboard.status_code, report.status_code), (503, 503))
+        self.assertIn('took too long', [str(message) for message in report.context['messages']][0])
+        self.assertTrue(report.context['report_unavailable'])
+
+class RunQueriesTestCase(TransactionTestCase):
+    def setUp(self):
+        Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date='2020-01-01')
+
+    def test_queries_run_on_pool_threads(self):
+        results = run_queries({
+            'clinics': Clinic.objects.count,
+            'thread': lambda: threading.current_thread().name,
+        })
+        self.assertEqual(results['clinics'], 1)
+        self.assertTrue(results['thread'].startswith('report-query'))
+
+    def test_timeout(self):
+        with self.assertRaises(TimeoutError):
+            run_queries({'slow': lambda: time.sleep(1)}, timeout=0.05)
+
+    def test_inline_inside_transaction(self):
+        with transaction.atomic():
+            Clinic.objects.create(name='Uncommitted', address='1 St', established_date='2020-01-01')
+            results = run_queries({'clinics': Clinic.objects.count})
+        self.assertEqual(results['clinics'], 2)
+
+class ChartCacheTestCase(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.spec = make_chart('bar', 'Registrations', [{'month': '2025-01', 'count': 3}, {'month': '2025-02', 'count': 5}], 'month', 'count')
+
+    def test_identical_charts_render_once(self):
+        with self.settings(CHART_CACHE_DIR=self.cache_dir, CHART_RENDER_WORKERS=1):
+            with mock.patch('core.charts._render_chart', wraps=charts._render_chart) as render:
+                first = render_charts({'a': self.spec, 'b': dict(self.spec)})
+                second = render_charts({'c': self.spec})
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first['a'], second['c'])
+        self.assertTrue(first['a'].exists())
+
+    def test_process_pool_render(self):
+        with self.settings(CHART_CACHE_DIR=self.cache_dir, CHART_RENDER_WORKERS=2):
+            paths = render_charts({'chart': self.spec}, fmt='svg')
+        self.assertTrue(paths['chart'].read_text().lstrip().startswith('<?xml'))
@@ -1,4 +1,5 @@
 from django.shortcuts import render
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 from django.db.models import Count, Q, Sum
@@ -6,39 +7,64 @@ from datetime import datetime, timedelta
 from patients.models import Patient
 from appointments.models import Appointment
 from inventory.models import InventoryItem
-from billing.models import Bill, Payment
+from billing.models import Bill
+from billing.settlement import revenue_by_day
+from .parallel import run_queries
 import json
 
 @login_required
 def dashboard(request):
-    # Basic statistics
-    total_patients = Patient.objects.count()
-    
     today = timezone.now().date()
-    today_appointments = Appointment.objects.filter(
-        appointment_date__date=today
-    ).count()
-    
-    # Use the class method to get low stock items count
-    low_stock_items = InventoryItem.get_low_stock_items().count()
-    
-    pending_bills = Bill.objects.filter(status='pending').count()
-    
-    # Recent appointments
-    recent_appointments = Appointment.objects.select_related('patient', 'doctor').order_by('-appointment_date')[:5]
-    
-    # Low stock items for display
-    low_stock_items_list = InventoryItem.get_low_stock_items().select_related('medicine')[:5]
-    
-    # Chart data - Patient registrations by month (last 6 months)
     six_months_ago = timezone.now() - timedelta(days=180)
+    thirty_days_ago = timezone.now() - timedelta(days=30)
     
-    # For SQLite (using strftime)
-    patient_data = Patient.objects.filter(
-        registration_date__gte=six_months_ago
-    ).extra({
-        'month': "strftime('%%Y-%%m', registration_date)"
-    }).values('month').annotate(count=Count('id')).order_by('month')
+    # The dashboard queries are independent, so run them side by side
+    try:
+        results = run_queries({
+            # Basic statistics
+            'total_patients': Patient.objects.count,
+            'today_appointments': Appointment.objects.filter(
+                appointment_date__date=today
+            ).count,
+            # Use the class method to get low stock items count
+            'low_stock_items': InventoryItem.get_low_stock_items().count,
+            'pending_bills': Bill.objects.filter(status='pending').count,
+        
+            # Recent appointments
+            'recent_appointments': lambda: list(
+                Appointment.objects.select_related('patient', 'doctor').defer(
+                    *(f'patient__{field}' for field in Patient.LARGE_TEXT_FIELDS)
+                ).order_by('-appointment_date')[:5]
+            ),
+        
+            # Low stock items for display
+            'low_stock_items_list': lambda: list(
+                InventoryItem.get_low_stock_items().select_related('medicine')[:5]
+            ),
+        
+            # Chart data - Patient registrations by month (last 6 months)
+            # For SQLite (using strftime)
+            'patient_data': lambda: list(Patient.objects.filter(
+                registration_date__gte=six_months_ago
+            ).extra({
+                'month': "strftime('%%Y-%%m', registration_date)"
+            }).values('month').annotate(count=Count('id')).order_by('month')),
+        
+            # Appointment statistics for chart
+            'appointment_status_data': lambda: list(Appointment.objects.values('status').annotate(
+                count=Count('id')
+            )),
+        
+            # Revenue data (last 30 days), from settlements where the day is closed
+            'revenue_data': lambda: revenue_by_day(thirty_days_ago.date(), today),
+        })
+    except TimeoutError:
+        messages.error(request, 'The dashboard figures took too long to load. Please try again in a moment.')
+        return render(request, 'core/dashboard.html', {
+            'total_patients': '—', 'today_appointments': '—', 'low_stock_items': '—', 'pending_bills': '—',
+            'recent_appointments': [], 'low_stock_items_list': [],
+            **{name: '[]' for name in ('months', 'patient_counts', 'status_labels', 'status_counts', 'revenue_days', 'revenue_totals')},
+        }, status=503)
     
     # For PostgreSQL (use this if you're using PostgreSQL):
     # patient_data = Patient.objects.filter(
@@ -47,27 +73,24 @@ def dashboard(request):
     #     month=TruncMonth('registration_date')
     # ).values('month').annotate(count=Count('id')).order_by('month')
     
-    months = [item['month'] for item in patient_data]
-    patient_counts = [item['count'] for item in patient_data]
-    
-    # Appointment statistics for chart
-    appointment_status_data = Appointment.objects.values('status').annotate(
-        count=Count('id')
-    )
+    total_patients = results['total_patients']
+    today_appointments = results['today_appointments']
+    low_stock_items = results['low_stock_items']
+    pending_bills = results['pending_bills']
+    recent_appointments = results['recent_appointments']
+    low_stock_items_list = results['low_stock_items_list']
     
-    status_labels = [item['status'] for item in appointment_status_data]
-    status_counts = [item['count'] for item in appointment_status_data]
+    months = [item['month'] for item in results['patient_data']]
+    patient_counts = [item['count'] for item in results['patient_data']]
     
-    # Revenue data (last 30 days)
-    thirty_days_ago = timezone.now() - timedelta(days=30)
-    revenue_data = Payment.objects.filter(
-        payment_date__gte=thirty_days_ago
-    ).extra({
-        'day': "strftime('%%Y-%%m-%%d', payment_date)"
-    }).values('day').annotate(total=Sum('amount')).order_by('day')
+    status_labels = [item['status'] for item in results['appointment_status_data']]
+    status_counts = [item['count'] for item in results['appointment_status_data']]
     
-    revenue_days = [item['day'] for item in revenue_data]
-    revenue_totals = [float(item['total']) for item in revenue_data]
+    daily_totals = {}
+    for day, _, total in results['revenue_data']:
+        daily_totals[day.isoformat()] = daily_totals.get(day.isoformat(), 0) + float(total)
+    revenue_days = list(daily_totals)
+    revenue_totals = list(daily_totals.values())
     
     context = {
         'total_patients': total_patients,
@@ -92,13 +115,15 @@ from django.contrib.auth.decorators import login_required
 from django.http import HttpResponse
 from django.utils import timezone
 from django.db.models import Count, Sum, Avg, Q
+from collections import defaultdict
 from datetime import datetime, timedelta
 import pandas as pd
 import json
-from patients.models import Patient, MedicalRecord
+from patients.models import Patient, MedicalRecord, DiagnosisCode
 from appointments.models import Appointment
 from inventory.models import InventoryItem, StockTransaction
-from billing.models import Bill, Payment
+from billing.models import Bill
+from .charts import get_report_charts
 
 @login_required
 def reports(request):
@@ -138,16 +163,22 @@ def generate_report(request, report_type):
         'end_date': end_date,
     }
     
-    if report_type == 'patient':
-        context.update(generate_patient_reports(start_date, end_date))
-    elif report_type == 'appointment':
-        context.update(generate_appointment_reports(start_date, end_date))
-    elif report_type == 'inventory':
-        context.update(generate_inventory_reports(start_date, end_date))
-    elif report_type == 'financial':
-        context.update(generate_financial_reports(start_date, end_date))
-    elif report_type == 'medical':
-        context.update(generate_medical_reports(start_date, end_date))
+    try:
+        if report_type == 'patient':
+            context.update(generate_patient_reports(start_date, end_date))
+        elif report_type == 'appointment':
+            context.update(generate_appointment_reports(start_date, end_date))
+        elif report_type == 'inventory':
+            context.update(generate_inventory_reports(start_date, end_date))
+        elif report_type == 'financial':
+            context.update(generate_financial_reports(start_date, end_date))
+        elif report_type == 'medical':
+            context.update(generate_medical_reports(start_date, end_date))
+    except TimeoutError:
+        # Raised by run_queries; the slow queries finish in the background
+        messages.error(request, 'The report took too long to prepare. Please try again in a moment or choose a shorter period.')
+        context['report_unavailable'] = True
+        return render(request, 'core/report_detail.html', context, status=503)
     
     format = request.GET.get('format', 'html')
     if format == 'pdf':
@@ -186,11 +217,9 @@ def generate_patient_reports(start_date, end_date):
     }).values('age_group').annotate(count=Count('id'))
     
     # Top conditions
-    top_conditions = MedicalRecord.objects.filter(
+    top_conditions = get_top_diagnoses(MedicalRecord.objects.filter(
         visit_date__date__range=[start_date, end_date]
-    ).values('diagnosis').annotate(
-        count=Count('id')
-    ).order_by('-count')[:10]
+    ), 10)
     
     return {
         'registrations': list(registrations),
@@ -203,6 +232,24 @@ def generate_patient_reports(start_date, end_date):
         ).count(),
     }
 
+def get_top_diagnoses(medical_records, limit):
+    """Most frequent diagnoses, grouped on the indexed diagnosis code"""
+    top_codes = list(medical_records.values('diagnosis_code').annotate(
+        count=Count('id')
+    ).order_by('-count')[:limit])
+    
+    codes = DiagnosisCode.objects.in_bulk(
+        [row['diagnosis_code'] for row in top_codes if row['diagnosis_code']]
+    )
+    return [
+        {
+            'diagnosis': codes[row['diagnosis_code']].name if row['diagnosis_code'] else '',
+            'code': codes[row['diagnosis_code']].code if row['diagnosis_code'] else '',
+            'count': row['count'],
+        }
+        for row in top_codes
+    ]
+
 def generate_appointment_reports(start_date, end_date):
     """Generate appointment analytics reports"""
     appointments = Appointment.objects.filter(
@@ -263,8 +310,19 @@ def generate_inventory_reports(start_date, end_date):
         total_sold=Sum('quantity')
     ).order_by('-total_sold')[:10]
     
+    # Expiry timeline
+    expiry_timeline = InventoryItem.objects.filter(
+        status='active',
+        expiry_date__gte=timezone.now().date()
+    ).extra({
+        'month': "strftime('%%Y-%%m', expiry_date)"
+    }).values('month').annotate(
+        items_expiring=Count('id')
+    ).order_by('month')[:12]
+    
     return {
         'category_distribution': list(category_distribution),
+        'expiry_timeline': list(expiry_timeline),
         'low_stock_count': low_stock,
         'near_expiry_count': near_expiry,
         'expired_count': expired,
@@ -275,45 +333,43 @@ def generate_inventory_reports(start_date, end_date):
 
 def generate_financial_reports(start_date, end_date):
     """Generate financial analytics reports"""
-    payments = Payment.objects.filter(
-        payment_date__date__range=[start_date, end_date]
-    )
-    
-    # Revenue by payment method
-    revenue_by_method = payments.values('payment_method').annotate(
-        total=Sum('amount')
-    )
-    
-    # Monthly revenue
-    monthly_revenue = payments.extra({
-        'month': "strftime('%%Y-%%m', payment_date)"
-    }).values('month').annotate(total=Sum('amount')).order_by('month')
-    
-    # Outstanding bills - calculate using the property
-    pending_bills = Bill.objects.filter(status='pending')
-    outstanding_bills = sum(bill.balance_due for bill in pending_bills)
-    
-    # Alternative approach using annotation (if you want to use database aggregation)
-    # outstanding_bills = Bill.objects.filter(status='pending').aggregate(
-    #     total=Sum(models.F('total_amount') - models.F('paid_amount'))
-    # )['total'] or 0
-    
-    # Additional financial metrics
-    total_bills = Bill.objects.filter(bill_date__date__range=[start_date, end_date]).count()
-    paid_bills = Bill.objects.filter(status='paid', bill_date__date__range=[start_date, end_date]).count()
-    pending_bills_count = Bill.objects.filter(status='pending', bill_date__date__range=[start_date, end_date]).count()
-    
-    # Payment trends by day
-    daily_revenue = payments.extra({
-        'day': "strftime('%%Y-%%m-%%d', payment_date)"
-    }).values('day').annotate(total=Sum('amount')).order_by('day')
+    bills = Bill.objects.filter(bill_date__date__range=[start_date, end_date])
+    
+    results = run_queries({
+        # Takings per day and method; closed days are read from their settlements
+        'revenue': lambda: revenue_by_day(start_date, end_date),
+        
+        # Accounts-receivable aging - one grouped aggregate over open bills
+        'ar_aging': Bill.get_aging_report,
+        
+        # Additional financial metrics
+        'bill_counts': lambda: bills.aggregate(
+            total_bills=Count('id'),
+            paid_bills=Count('id', filter=Q(status='paid')),
+            pending_bills_count=Count('id', filter=Q(status='pending')),
+        ),
+    })
+    
+    by_method, by_month, by_day = defaultdict(int), defaultdict(int), defaultdict(int)
+    for day, method, total in results['revenue']:
+        by_method[method] += total
+        by_month[day.strftime('%Y-%m')] += total
+        by_day[day.isoformat()] += total
+    
+    ar_aging = results['ar_aging']
+    outstanding_bills = sum(bucket['total'] for bucket in ar_aging)
+    
+    total_bills = results['bill_counts']['total_bills']
+    paid_bills = results['bill_counts']['paid_bills']
+    pending_bills_count = results['bill_counts']['pending_bills_count']
     
     return {
-        'revenue_by_method': list(revenue_by_method),
-        'monthly_revenue': list(monthly_revenue),
-        'daily_revenue': list(daily_revenue),
+        'revenue_by_method': [{'payment_method': method, 'total': total} for method, total in by_method.items()],
+        'monthly_revenue': [{'month': month, 'total': total} for month, total in by_month.items()],
+        'daily_revenue': [{'day': day, 'total': total} for day, total in by_day.items()],
         'outstanding_bills': outstanding_bills,
-        'total_revenue': payments.aggregate(total=Sum('amount'))['total'] or 0,
+        'ar_aging': ar_aging,
+        'total_revenue': sum(by_method.values()),
         'total_bills': total_bills,
         'paid_bills': paid_bills,
         'pending_bills_count': pending_bills_count,
@@ -327,9 +383,7 @@ def generate_medical_reports(start_date, end_date):
     )
     
     # Common diagnoses
-    common_diagnoses = medical_records.values('diagnosis').annotate(
-        count=Count('id')
-    ).order_by('-count')[:15]
+    common_diagnoses = get_top_diagnoses(medical_records, 15)
     
     # Treatment patterns
     treatment_patterns = medical_records.values('treatment').annotate(
@@ -356,6 +410,8 @@ def generate_pdf_report(context, report_type):
     from weasyprint import HTML
     import tempfile
     
+    context['charts'] = get_report_charts(context, report_type)
+    
     html_string = render_to_string('core/report_pdf.html', context)
     html = HTML(string=html_string)
     
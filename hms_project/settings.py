@@ -146,3 +146,68 @@ AUTH_USER_MODEL = 'core.User'
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'login'
 LOGIN_URL = 'login'
+
+# Concurrent report queries (see core/parallel.py)
+# Dashboard and report views run their independent aggregates on a shared
+# thread pool; each worker thread holds its own database connection.
+REPORT_QUERY_WORKERS = 8
+REPORT_QUERY_TIMEOUT = 30  # seconds per view
+
+# Server-side report charts (see core/charts.py)
+CHART_CACHE_DIR = BASE_DIR / 'cache' / 'charts'
+CHART_RENDER_WORKERS = 2
+CHART_RENDER_TIMEOUT = 60  # seconds per chart
+
+# Patient chart timeline (see patients/timeline.py)
+# Pages are cached in the default cache and invalidated by signals. Use a
+# shared cache backend (Redis/Memcached) when running several processes.
+PATIENT_TIMELINE_PAGE_SIZE = 25
+PATIENT_TIMELINE_CACHE_TIMEOUT = 60 * 60 * 24  # seconds
+
+# Doctor scheduling (see appointments/scheduling.py)
+SLOT_CACHE_TIMEOUT = 60 * 60  # seconds a free-slot bitmap is kept
+SLOT_SEARCH_DAYS = 14  # how far ahead "next free slot" searches look
+
+# Appointment reminders (see appointments/reminders.py)
+# One transport per channel. In production use
+# 'appointments.reminders.EmailBackend' (sends through EMAIL_BACKEND, e.g.
+# SMTP) for email and an SMS gateway subclass of BaseBackend for sms.
+REMINDER_BACKENDS = {
+    'email': 'appointments.reminders.ConsoleBackend',
+    'sms': 'appointments.reminders.ConsoleBackend',
+}
+REMINDER_FILE_PATH = BASE_DIR / 'reminders.log'  # for FileBackend
+REMINDER_BATCH_SIZE = 500
+REMINDER_WORKERS = 4
+REMINDER_MAX_ATTEMPTS = 5
+REMINDER_RETRY_MINUTES = 5  # doubled after each failed attempt
+REMINDER_LEASE_SECONDS = 300  # after this a batch left by a crashed worker is sent again
+
+# Follow-up worklist (see appointments/follow_ups.py)
+FOLLOW_UP_DAYS = 7  # default look-ahead of the worklist and book_follow_ups
+FOLLOW_UP_LOOKBACK_DAYS = 90  # overdue follow-ups older than this drop off the list
+
+# Prescription screening (see prescriptions/screening.py)
+ACTIVE_PRESCRIPTION_DAYS = 30  # how long a course counts as active when its duration cannot be read
+PRESCRIPTION_LOOKBACK_DAYS = 180  # older prescriptions are never screened against
+
+# Automatic billing (see billing/engine.py)
+# Consultation fee of a completed appointment by the doctor's specialization
+# (lower case); 'default' applies to every other doctor. Remove it to leave
+# appointments of unlisted specializations unbilled.
+CONSULTATION_FEES = {
+    'default': '50.00',
+}
+BILL_DUE_DAYS = 30
+BILLING_BATCH_SIZE = 500  # patients per transaction in generate_bills
+
+# Patient statements (see billing/statements.py)
+STATEMENT_SPOOL_DIR = BASE_DIR / 'spool' / 'statements'  # one directory per run
+STATEMENT_RENDERER = 'weasyprint'  # or 'reportlab'
+STATEMENT_WORKERS = 4
+STATEMENT_BATCH_SIZE = 100  # statements per task sent to a worker
+
+# Insurance claim files (see billing/claims.py)
+CLAIM_EXPORT_DIR = BASE_DIR / 'spool' / 'claims'  # one directory per payer code
+CLAIM_FILE_MAX_LINES = 100_000
+CLAIM_EXPORT_CHUNK_SIZE = 2000  # rows fetched from the cursor at a time
@@ -13,5 +13,7 @@ urlpatterns = [
     path('patients/', include('patients.urls')),
     path('appointments/', include('appointments.urls')),
     path('inventory/', include('inventory.urls')),
+    path('prescriptions/', include('prescriptions.urls')),
+    path('billing/', include('billing.urls')),
     path('reports/', include('core.urls')),
 ]
\ No newline at end of file
@@ -16,6 +16,7 @@ from .forms import (
     PurchaseOrderForm, PurchaseOrderItemForm, InventorySearchForm, MedicineForm
 )
 from core.models import Clinic
+from prescriptions.dispensing import stock_with_equivalents
 from prescriptions.models import Medicine
 
 from django.http import JsonResponse
@@ -319,7 +320,11 @@ def stock_transaction_create(request):
 
 @login_required
 def low_stock_items(request):
-    items = InventoryItem.get_low_stock_items().select_related('medicine', 'supplier')
+    items = list(InventoryItem.get_low_stock_items().select_related('medicine', 'supplier'))
+    # A low batch matters less when other batches or equivalent medicines can cover it
+    stock = stock_with_equivalents({item.medicine_id: item.medicine for item in items}.values())
+    for item in items:
+        item.medicine_stock, item.with_equivalents = stock[item.medicine_id]
     return render(request, 'inventory/low_stock_items.html', {'items': items})
 
 @login_required
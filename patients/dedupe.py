@@ -0,0 +1,211 @@
+"""
+Duplicate patient detection (master patient index).
+
+Patients are compared only within blocks that share a blocking key, either
+the surname Soundex plus birth year or the normalized phone number. This
+keeps the work near-linear in registry size. Within a large block, each
+record is compared only with its neighbours in first-name order
+(sorted neighbourhood), so one common surname cannot make a run quadratic.
+"""
+import difflib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+# Pool workers import this module to score blocks, so it must not load
+# Django models at import time; database helpers import them lazily.
+
+MATCH_THRESHOLD = 0.75
+WINDOW_SIZE = 25
+BLOCK_BATCH_SIZE = 500
+
+RECORD_FIELDS = ('patient_id', 'first_name', 'last_name', 'phone_key', 'date_of_birth')
+
+
+def score_pair(a, b):
+    """
+    Score two records given as ``RECORD_FIELDS`` tuples.
+
+    Returns:
+        tuple: ``(score, reasons)``, with the score between 0 and 1.
+    """
+    _, first_a, last_a, phone_a, dob_a = a
+    _, first_b, last_b, phone_b, dob_b = b
+    reasons = []
+
+    last = difflib.SequenceMatcher(None, last_a, last_b).ratio()
+    first = difflib.SequenceMatcher(None, first_a, first_b).ratio()
+    if first_a and first_b and (first_a.startswith(first_b) or first_b.startswith(first_a)):
+        first = max(first, 0.85)  # "Kate" / "Katherine"
+    name = 0.55 * last + 0.45 * first
+    if name >= 0.85:
+        reasons.append('name')
+
+    if dob_a == dob_b:
+        dob = 1.0
+        reasons.append('dob')
+    elif (dob_a.year, dob_a.month, dob_a.day) == (dob_b.year, dob_b.day, dob_b.month):
+        dob = 0.8
+        reasons.append('dob-swapped')
+    elif dob_a.year == dob_b.year:
+        dob = 0.4
+    else:
+        dob = 0.0
+
+    phone = 0.0
+    if phone_a and phone_a == phone_b:
+        phone = 1.0
+        reasons.append('phone')
+
+    score = 0.5 * name + 0.3 * dob + 0.2 * phone
+    # A shared phone alone is common in families; only boost it when the names agree
+    if phone and name >= 0.85:
+        score = max(score, 0.9)
+    return round(score, 3), ','.join(reasons)
+
+
+def compare_block(records, threshold=MATCH_THRESHOLD, window=WINDOW_SIZE):
+    """Return ``(id_a, id_b, score, reasons)`` for likely duplicates in one block."""
+    records = sorted(records, key=lambda record: (record[1], record[0]))
+    matches = []
+    for i, a in enumerate(records):
+        for b in records[i + 1:i + 1 + window]:
+            score, reasons = score_pair(a, b)
+            if score >= threshold:
+                id_a, id_b = sorted((a[0], b[0]))
+                matches.append((id_a, id_b, score, reasons))
+    return matches
+
+
+def compare_blocks(blocks, threshold=MATCH_THRESHOLD):
+    """Pool worker entry point: compare a batch of blocks."""
+    matches = []
+    for records in blocks:
+        matches.extend(compare_block(records, threshold))
+    return matches
+
+
+def iter_blocks():
+    """
+    Stream blocks of candidate records from the search index.
+
+    Each blocking key is read in its index order, so a block is a run of
+    consecutive rows and memory use is bounded by the largest block.
+    """
+    from .models import PatientSearchIndex
+
+    index = PatientSearchIndex.objects.values_list(*RECORD_FIELDS, 'last_soundex')
+
+    rows = index.order_by('last_soundex', 'date_of_birth').iterator(chunk_size=5000)
+    for _, block in groupby(rows, key=lambda row: (row[5], row[4].year)):
+        block = [row[:5] for row in block]
+        if len(block) > 1:
+            yield block
+
+    rows = index.exclude(phone_key='').order_by('phone_key').iterator(chunk_size=5000)
+    for _, block in groupby(rows, key=lambda row: row[3]):
+        block = [row[:5] for row in block]
+        if len(block) > 1:
+            yield block
+
+
+def _batches(blocks, size):
+    batch = []
+    for block in blocks:
+        batch.append(block)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def save_candidates(matches):
+    """Queue matches for review, leaving already-reviewed pairs untouched."""
+    from .models import DuplicateCandidate
+
+    DuplicateCandidate.objects.bulk_create(
+        [
+            DuplicateCandidate(patient_a_id=id_a, patient_b_id=id_b, score=score, reasons=reasons)
+            for id_a, id_b, score, reasons in matches
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def run_dedupe(workers=4, threshold=MATCH_THRESHOLD):
+    """
+    Scan the whole registry and write likely duplicates to the review queue.
+
+    Returns:
+        int: number of matching pairs found (including pairs already queued).
+    """
+    found = 0
+    batches = _batches(iter_blocks(), BLOCK_BATCH_SIZE)
+
+    if workers <= 1:
+        for batch in batches:
+            matches = compare_blocks(batch, threshold)
+            save_candidates(matches)
+            found += len(matches)
+        return found
+
+    # Keep only a few batches in flight so the registry is never held in memory at once
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append(executor.submit(compare_blocks, batch, threshold))
+            if len(pending) >= workers * 2:
+                matches = pending.popleft().result()
+                save_candidates(matches)
+                found += len(matches)
+        while pending:
+            matches = pending.popleft().result()
+            save_candidates(matches)
+            found += len(matches)
+    return found
+
+
+def find_duplicates(first_name, last_name, date_of_birth, phone, exclude_id=None, threshold=MATCH_THRESHOLD):
+    """
+    Check one (possibly unsaved) patient against the registry.
+
+    Uses the same blocking keys as the batch run, so it touches only a few
+    indexed rows and is fast enough to run during registration.
+
+    Returns:
+        list: ``(patient_id, score, reasons)`` sorted by descending score.
+    """
+    from django.db.models import Q
+    from .models import PatientSearchIndex
+    from .search import normalize_name, phone_key, soundex
+
+    record = (
+        exclude_id,
+        normalize_name(first_name),
+        normalize_name(last_name),
+        phone_key(phone),
+        date_of_birth,
+    )
+
+    block = Q(last_soundex=soundex(last_name), date_of_birth__year=date_of_birth.year)
+    if record[3]:
+        block |= Q(phone_key=record[3])
+    candidates = PatientSearchIndex.objects.filter(block)
+    if exclude_id:
+        candidates = candidates.exclude(patient_id=exclude_id)
+
+    matches = []
+    for other in candidates.values_list(*RECORD_FIELDS):
+        score, reasons = score_pair(record, other)
+        if score >= threshold:
+            matches.append((other[0], score, reasons))
+    return sorted(matches, key=lambda match: -match[1])
+
+
+def queue_duplicates(patient, matches):
+    """Record registration-time matches so they reach the review queue."""
+    save_candidates([
+        (*sorted((patient.pk, patient_id)), score, reasons)
+        for patient_id, score, reasons in matches
+    ])
@@ -0,0 +1,95 @@
+"""
+Map free-text diagnoses onto DiagnosisCode dictionary entries.
+
+Text is normalized (case, punctuation, whitespace) and looked up by its
+indexed normalized form; only an exact match is assigned. Anything unknown
+becomes a new unverified code. String similarity cannot tell a misspelling
+from a different condition ("hypotension" and "hypertension"), so a near
+miss among existing entries sharing the same leading characters is only
+stored as the new code's ``suggested_match``, for someone to review with
+the review_diagnosis_codes command. It is never applied to records
+automatically. An accepted suggestion becomes a DiagnosisAlias, so the
+same spelling resolves directly to the reviewed code from then on.
+"""
+import difflib
+import hashlib
+import re
+
+SUGGESTION_CUTOFF = 0.85
+PREFIX_LENGTH = 3
+
+_non_word = re.compile(r'[^a-z0-9]+')
+
+
+def normalize_diagnosis(text):
+    """Reduce a diagnosis to a comparable key: first line, lowercase, words only."""
+    first_line = (text or '').strip().split('\n', 1)[0]
+    return _non_word.sub(' ', first_line.lower()).strip()[:200]
+
+
+def generated_code(normalized):
+    """Deterministic code for a diagnosis added by the normalizer."""
+    return f"U{hashlib.sha1(normalized.encode()).hexdigest()[:8].upper()}"
+
+
+class DiagnosisNormalizer:
+    """
+    Resolve diagnosis text to a DiagnosisCode id.
+    
+    Results are memoized per instance, so a single normalizer can be reused
+    across a whole batch of records.
+    """
+
+    def __init__(self, create=True):
+        self.create = create
+        self._resolved = {}
+        self._by_prefix = {}
+
+    def code_for(self, text):
+        normalized = normalize_diagnosis(text)
+        if not normalized:
+            return None
+        if normalized not in self._resolved:
+            self._resolved[normalized] = self._resolve(normalized, text)
+        return self._resolved[normalized]
+
+    def _resolve(self, normalized, text):
+        from .models import DiagnosisAlias, DiagnosisCode
+
+        code_id = DiagnosisCode.objects.filter(
+            normalized_name=normalized
+        ).values_list('id', flat=True).first()
+        if code_id:
+            return code_id
+        code_id = DiagnosisAlias.objects.filter(
+            normalized_name=normalized
+        ).values_list('code_id', flat=True).first()
+        if code_id:
+            return code_id
+
+        if not self.create:
+            return None
+
+        candidates = self._candidates(normalized[:PREFIX_LENGTH])
+        match = difflib.get_close_matches(normalized, candidates, n=1, cutoff=SUGGESTION_CUTOFF)
+        code, _ = DiagnosisCode.objects.get_or_create(
+            normalized_name=normalized,
+            defaults={
+                'code': generated_code(normalized),
+                'name': text.strip().split('\n', 1)[0][:200],
+                'suggested_match_id': candidates[match[0]] if match else None,
+            }
+        )
+        candidates[normalized] = code.id
+        return code.id
+
+    def _candidates(self, prefix):
+        from .models import DiagnosisCode
+
+        if prefix not in self._by_prefix:
+            self._by_prefix[prefix] = dict(
+                DiagnosisCode.objects.filter(
+                    normalized_name__startswith=prefix
+                ).values_list('normalized_name', 'id')
+            )
+        return self._by_prefix[prefix]
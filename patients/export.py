@@ -0,0 +1,177 @@
+"""
+Complete-record export for patient transfers and records requests.
+
+A patient's bundle is produced as a stream of JSON text: each section is
+read with a chunked iterator and every row is encoded as soon as it is
+read, so neither the queryset results nor the document are ever held in
+memory whole. Whole clinics are written into a zip archive one patient
+file at a time.
+"""
+import json
+import zipfile
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from appointments.models import Appointment
+from billing.models import Bill, BillItem, Payment
+from prescriptions.models import Prescription, PrescribedMedicine
+from .models import MedicalRecord, Patient
+
+CHUNK_SIZE = 500
+BUNDLE_VERSION = 1
+
+PATIENT_FIELDS = (
+    'id', 'first_name', 'last_name', 'date_of_birth', 'gender', 'blood_group', 'phone', 'email',
+    'address', 'emergency_contact', 'emergency_phone', 'medical_history', 'allergies',
+    'registration_date', 'clinic__name',
+)
+RECORD_FIELDS = (
+    'id', 'visit_date', 'doctor__username', 'symptoms', 'diagnosis', 'diagnosis_code__code',
+    'treatment', 'notes', 'follow_up_date',
+)
+APPOINTMENT_FIELDS = ('id', 'appointment_date', 'doctor__username', 'status', 'reason', 'notes')
+
+
+def _encode(value):
+    return json.dumps(value, cls=DjangoJSONEncoder)
+
+
+def _array(rows):
+    """Yield a JSON array one element at a time."""
+    yield '['
+    for i, row in enumerate(rows):
+        if i:
+            yield ','
+        yield _encode(row)
+    yield ']'
+
+
+def _prescriptions(patient_id):
+    prescriptions = Prescription.objects.filter(patient_id=patient_id).select_related('doctor').prefetch_related(
+        Prefetch('medicines', queryset=PrescribedMedicine.objects.select_related('medicine'))
+    ).order_by('prescription_date', 'pk')
+    for prescription in prescriptions.iterator(chunk_size=CHUNK_SIZE):
+        yield {
+            'id': prescription.pk,
+            'prescription_date': prescription.prescription_date,
+            'doctor': prescription.doctor.username,
+            'medical_record_id': prescription.medical_record_id,
+            'notes': prescription.notes,
+            'is_dispensed': prescription.is_dispensed,
+            'medicines': [
+                {
+                    'medicine': item.medicine.name,
+                    'generic_name': item.medicine.generic_name,
+                    'strength': item.medicine.strength,
+                    'dosage': item.dosage,
+                    'frequency': item.frequency,
+                    'duration': item.duration,
+                    'quantity': item.quantity,
+                    'instructions': item.instructions,
+                }
+                for item in prescription.medicines.all()
+            ],
+        }
+
+
+def _bills(patient_id):
+    bills = Bill.objects.filter(patient_id=patient_id).prefetch_related(
+        Prefetch('items', queryset=BillItem.objects.order_by('pk')),
+        Prefetch('payment_set', queryset=Payment.objects.order_by('payment_date', 'pk')),
+    ).order_by('bill_date', 'pk')
+    for bill in bills.iterator(chunk_size=CHUNK_SIZE):
+        yield {
+            'id': bill.pk,
+            'bill_number': bill.bill_number,
+            'bill_date': bill.bill_date,
+            'due_date': bill.due_date,
+            'status': bill.status,
+            'total_amount': bill.total_amount,
+            'paid_amount': bill.paid_amount,
+            'notes': bill.notes,
+            'items': [
+                {
+                    'description': item.description,
+                    'quantity': item.quantity,
+                    'unit_price': item.unit_price,
+                    'amount': item.amount,
+                }
+                for item in bill.items.all()
+            ],
+            'payments': [
+                {
+                    'amount': payment.amount,
+                    'payment_date': payment.payment_date,
+                    'payment_method': payment.payment_method,
+                    'reference_number': payment.reference_number,
+                }
+                for payment in bill.payment_set.all()
+            ],
+        }
+
+
+def iter_patient_bundle(patient_id):
+    """
+    Yield the JSON text of one patient's complete record.
+
+    Raises:
+        Patient.DoesNotExist: if there is no such patient.
+    """
+    demographics = Patient.objects.filter(pk=patient_id).values(*PATIENT_FIELDS).get()
+
+    yield '{"version":%d,"exported_at":%s,"patient":%s' % (
+        BUNDLE_VERSION, _encode(timezone.now()), _encode(demographics)
+    )
+
+    sections = (
+        ('medical_records', MedicalRecord.objects.filter(patient_id=patient_id).order_by(
+            'visit_date', 'pk'
+        ).values(*RECORD_FIELDS).iterator(chunk_size=CHUNK_SIZE)),
+        ('prescriptions', _prescriptions(patient_id)),
+        ('appointments', Appointment.objects.filter(patient_id=patient_id).order_by(
+            'appointment_date', 'pk'
+        ).values(*APPOINTMENT_FIELDS).iterator(chunk_size=CHUNK_SIZE)),
+        ('bills', _bills(patient_id)),
+    )
+    for name, rows in sections:
+        yield ',%s:' % _encode(name)
+        yield from _array(rows)
+    yield '}'
+
+
+def buffered(chunks, size=64 * 1024):
+    """Join small text chunks into blocks of about ``size`` characters for streaming."""
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def write_archive(patients, fileobj):
+    """
+    Write one ``patient-<id>.json`` bundle per patient into a zip archive.
+
+    Args:
+        patients: a Patient queryset; only primary keys are read from it.
+        fileobj: a path or a writable binary file object.
+
+    Returns:
+        int: the number of patients exported.
+    """
+    count = 0
+    patient_ids = patients.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=CHUNK_SIZE)
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for patient_id in patient_ids:
+            # force_zip64 because the entry size is not known before streaming it
+            with archive.open(f'patient-{patient_id}.json', 'w', force_zip64=True) as entry:
+                for chunk in buffered(iter_patient_bundle(patient_id)):
+                    entry.write(chunk.encode())
+            count += 1
+    return count
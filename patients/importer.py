@@ -0,0 +1,299 @@
+"""
+Bulk import of patients and medical records from CSV or XLSX files.
+
+Rows are streamed from the file and handled in fixed-size batches: each
+batch is validated against the model fields, has its lookups (clinic,
+patient, doctor) resolved with one query each, and is written with
+``bulk_create``. Memory use depends on the batch size, not the file size.
+Rows that fail validation are written to a rejects CSV with the reason.
+"""
+import csv
+from datetime import date, datetime
+from itertools import islice
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import Clinic, User
+from .diagnosis import DiagnosisNormalizer
+from .models import MedicalRecord, Patient
+from .search import index_patients
+from .timeline import invalidate_timeline
+
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+
+
+def read_rows(path):
+    """
+    Yield ``(row_number, row)`` for each data row of a CSV or XLSX file.
+
+    Column headers are lowercased and stripped; empty rows are skipped.
+    """
+    path = Path(path)
+    if path.suffix.lower() in ('.xlsx', '.xlsm'):
+        yield from _read_xlsx(path)
+    else:
+        yield from _read_csv(path)
+
+
+def _read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = [name.strip().lower() for name in next(reader, [])]
+        for row_number, values in enumerate(reader, start=2):
+            if any(value.strip() for value in values):
+                yield row_number, dict(zip(header, values))
+
+
+def _read_xlsx(path):
+    from openpyxl import load_workbook
+
+    # read_only streams the sheet instead of loading every cell
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(name or '').strip().lower() for name in next(rows, ())]
+        for row_number, values in enumerate(rows, start=2):
+            if any(value not in (None, '') for value in values):
+                yield row_number, dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def _clean_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (date, datetime)):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))  # spreadsheet numbers such as phone numbers
+    return str(value).strip()
+
+
+def _parse_date(value):
+    if isinstance(value, (date, datetime)) or not value:
+        return value
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    return value  # left for the model field to reject
+
+
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        self.rejected = 0
+
+
+class BaseImporter:
+    """
+    Shared batching, validation and rejects handling.
+
+    Subclasses set ``model`` and ``fields`` and implement ``resolve_batch``
+    (batch-level lookups) and ``build`` (one model instance per row).
+    """
+    model = None
+    fields = ()
+    extra_columns = ()  # non-field columns resolved per batch, e.g. a clinic name
+
+    def __init__(self, batch_size=1000, rejects=None):
+        self.batch_size = batch_size
+        self.rejects = rejects
+        self._rejects_writer = None
+        self._choices = {
+            name: self._choice_lookup(self.model._meta.get_field(name))
+            for name in self.fields
+            if self.model._meta.get_field(name).choices
+        }
+
+    @staticmethod
+    def _choice_lookup(field):
+        # Accept either the stored value ("M") or its label ("Male")
+        lookup = {}
+        for value, label in field.choices:
+            lookup[str(value).lower()] = value
+            lookup[str(label).lower()] = value
+        return lookup
+
+    def run(self, rows, progress=None):
+        """
+        Import ``(row_number, row)`` pairs, e.g. from ``read_rows``.
+
+        Args:
+            progress: optional callable given the number of rows handled
+                after each batch.
+        """
+        result = ImportResult()
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            imported, rejected = self.import_batch(batch)
+            result.imported += imported
+            result.rejected += rejected
+            if progress:
+                progress(len(batch))
+        return result
+
+    def import_batch(self, batch):
+        cleaned, errors = [], []
+        for row_number, row in batch:
+            values, row_errors = self.clean_row(row)
+            if row_errors:
+                errors.append((row_number, row, row_errors))
+            else:
+                cleaned.append((row_number, row, values))
+
+        lookups = self.resolve_batch([values for _, _, values in cleaned])
+        instances = []
+        for row_number, row, values in cleaned:
+            try:
+                instances.append(self.build(values, lookups))
+            except ValidationError as e:
+                errors.append((row_number, row, e.messages))
+
+        with transaction.atomic():
+            created = self.model.objects.bulk_create(instances, batch_size=self.batch_size)
+            self.after_create(created)
+
+        self.write_rejects(errors)
+        return len(created), len(errors)
+
+    def clean_row(self, row):
+        values, errors = {}, []
+        for name in self.fields:
+            field = self.model._meta.get_field(name)
+            value = _clean_value(row.get(name))
+            if field.get_internal_type() in ('DateField', 'DateTimeField'):
+                value = _parse_date(value)
+            if name in self._choices and value:
+                value = self._choices[name].get(str(value).lower(), value)
+            if value == '' and field.null:
+                value = None
+            try:
+                value = field.clean(value, None)
+            except ValidationError as e:
+                errors.extend(f'{name}: {message}' for message in e.messages)
+                continue
+            if isinstance(value, datetime) and timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            values[name] = value
+        return values, errors
+
+    def resolve_batch(self, rows):
+        return {}
+
+    def build(self, values, lookups):
+        raise NotImplementedError
+
+    def after_create(self, instances):
+        pass
+
+    def write_rejects(self, errors):
+        if not errors or self.rejects is None:
+            return
+        if self._rejects_writer is None:
+            self._rejects_writer = csv.writer(self.rejects)
+            self._rejects_writer.writerow(['row', 'errors', *self.fields, *self.extra_columns])
+        for row_number, row, row_errors in errors:
+            self._rejects_writer.writerow([
+                row_number, '; '.join(row_errors),
+                *(_clean_value(row.get(name)) for name in (*self.fields, *self.extra_columns)),
+            ])
+
+
+class PatientImporter(BaseImporter):
+    """
+    Import patients. An optional ``clinic`` column holds the clinic name;
+    rows without one go to ``default_clinic``.
+    """
+    model = Patient
+    fields = (
+        'first_name', 'last_name', 'date_of_birth', 'gender', 'blood_group', 'phone',
+        'email', 'address', 'emergency_contact', 'emergency_phone', 'medical_history', 'allergies',
+    )
+    extra_columns = ('clinic',)
+
+    def __init__(self, default_clinic=None, **kwargs):
+        super().__init__(**kwargs)
+        self.default_clinic = default_clinic or Clinic.objects.first()
+
+    def clean_row(self, row):
+        values, errors = super().clean_row(row)
+        values['clinic'] = _clean_value(row.get('clinic'))
+        return values, errors
+
+    def resolve_batch(self, rows):
+        names = {values['clinic'] for values in rows if values['clinic']}
+        return {'clinics': dict(Clinic.objects.filter(name__in=names).values_list('name', 'id'))}
+
+    def build(self, values, lookups):
+        clinic_name = values.pop('clinic')
+        if clinic_name:
+            if clinic_name not in lookups['clinics']:
+                raise ValidationError(f'clinic: unknown clinic "{clinic_name}"')
+            clinic_id = lookups['clinics'][clinic_name]
+        elif self.default_clinic:
+            clinic_id = self.default_clinic.pk
+        else:
+            raise ValidationError('clinic: no clinic given and no default clinic configured')
+        return Patient(clinic_id=clinic_id, **values)
+
+    def after_create(self, instances):
+        # bulk_create skips post_save, so build the search keys here
+        index_patients(instances)
+
+
+class MedicalRecordImporter(BaseImporter):
+    """
+    Import medical records for existing patients, identified by a
+    ``patient_id`` column, with the doctor given by ``doctor`` (username).
+    """
+    model = MedicalRecord
+    fields = ('visit_date', 'symptoms', 'diagnosis', 'treatment', 'notes', 'follow_up_date')
+    extra_columns = ('patient_id', 'doctor')
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.normalizer = DiagnosisNormalizer()
+
+    def clean_row(self, row):
+        values, errors = super().clean_row(row)
+        try:
+            values['patient_id'] = int(_clean_value(row.get('patient_id')))
+        except ValueError:
+            errors.append('patient_id: Enter a whole number.')
+        values['doctor'] = _clean_value(row.get('doctor'))
+        if not values['doctor']:
+            errors.append('doctor: This field cannot be blank.')
+        return values, errors
+
+    def resolve_batch(self, rows):
+        return {
+            'patients': set(Patient.objects.filter(
+                pk__in={values['patient_id'] for values in rows}
+            ).values_list('pk', flat=True)),
+            'doctors': dict(User.objects.filter(
+                username__in={values['doctor'] for values in rows}
+            ).values_list('username', 'id')),
+        }
+
+    def build(self, values, lookups):
+        username = values.pop('doctor')
+        if values['patient_id'] not in lookups['patients']:
+            raise ValidationError(f'patient_id: no patient with id {values["patient_id"]}')
+        if username not in lookups['doctors']:
+            raise ValidationError(f'doctor: unknown user "{username}"')
+        # bulk_create skips MedicalRecord.save(), which normally assigns these
+        values['diagnosis_code_id'] = self.normalizer.code_for(values['diagnosis'])
+        values['preview'] = MedicalRecord.make_preview(values['diagnosis'], values['treatment'])
+        return MedicalRecord(doctor_id=lookups['doctors'][username], **values)
+
+    def after_create(self, instances):
+        for patient_id in {record.patient_id for record in instances}:
+            invalidate_timeline(patient_id)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from tqdm import tqdm
+from patients.diagnosis import DiagnosisNormalizer
+from patients.models import MedicalRecord
+
+class Command(BaseCommand):
+    help = 'Assigns diagnosis codes to existing medical records in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Records read and updated per batch')
+        parser.add_argument('--all', action='store_true', help='Recode records that already have a diagnosis code')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        records = MedicalRecord.objects.exclude(diagnosis='')
+        if not options['all']:
+            records = records.filter(diagnosis_code__isnull=True)
+
+        normalizer = DiagnosisNormalizer()
+        updated = 0
+        last_pk = 0
+
+        with tqdm(total=records.count()) as progress:
+            while True:
+                # Keyset pagination keeps each chunk query on the primary key index
+                chunk = list(
+                    records.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'diagnosis')[:chunk_size]
+                )
+                if not chunk:
+                    break
+
+                batch = [
+                    MedicalRecord(pk=pk, diagnosis_code_id=normalizer.code_for(diagnosis))
+                    for pk, diagnosis in chunk
+                ]
+                MedicalRecord.objects.bulk_update(batch, ['diagnosis_code'])
+
+                last_pk = chunk[-1][0]
+                updated += len(batch)
+                progress.update(len(batch))
+
+        self.stdout.write(self.style.SUCCESS(f'Assigned diagnosis codes to {updated} medical records.'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Clinic
+from patients.export import write_archive
+from patients.models import Patient
+
+class Command(BaseCommand):
+    help = 'Exports complete patient records as JSON bundles into a zip archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the zip archive to write')
+        parser.add_argument('--clinic', help='Export every patient of this clinic (by name)')
+        parser.add_argument('--patient', type=int, action='append', default=[], help='Patient ID to export (repeatable)')
+
+    def handle(self, *args, **options):
+        patients = Patient.objects.all()
+        if options['clinic']:
+            clinic = Clinic.objects.filter(name=options['clinic']).first()
+            if clinic is None:
+                raise CommandError(f"Clinic '{options['clinic']}' does not exist")
+            patients = patients.filter(clinic=clinic)
+        if options['patient']:
+            patients = patients.filter(pk__in=options['patient'])
+
+        count = write_archive(patients, options['output'])
+        self.stdout.write(self.style.SUCCESS(f"Exported {count} patients to {options['output']}."))
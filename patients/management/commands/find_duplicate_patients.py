@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from patients.dedupe import MATCH_THRESHOLD, run_dedupe
+
+class Command(BaseCommand):
+    help = 'Scans the patient registry for likely duplicates and queues them for review'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Scoring processes (1 runs inline)')
+        parser.add_argument('--threshold', type=float, default=MATCH_THRESHOLD, help='Minimum match score to queue')
+
+    def handle(self, *args, **options):
+        found = run_dedupe(workers=options['workers'], threshold=options['threshold'])
+        self.stdout.write(self.style.SUCCESS(f'Found {found} possible duplicate pairs.'))
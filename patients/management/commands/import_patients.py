@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from tqdm import tqdm
+from core.models import Clinic
+from patients.importer import MedicalRecordImporter, PatientImporter, read_rows
+
+class Command(BaseCommand):
+    help = 'Imports patients (or medical records) from a CSV or XLSX file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file with a header row')
+        parser.add_argument('--records', action='store_true', help='Import medical records instead of patients')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows validated and inserted per batch')
+        parser.add_argument('--clinic', help='Clinic name for rows without a clinic column (patients only)')
+        parser.add_argument('--rejects', default='rejected_rows.csv', help='Where to write rows that failed validation')
+
+    def handle(self, *args, **options):
+        rejects = open(options['rejects'], 'w', newline='')
+        try:
+            if options['records']:
+                importer = MedicalRecordImporter(batch_size=options['batch_size'], rejects=rejects)
+            else:
+                clinic = None
+                if options['clinic']:
+                    clinic = Clinic.objects.filter(name=options['clinic']).first()
+                    if clinic is None:
+                        raise CommandError(f"Clinic '{options['clinic']}' does not exist")
+                importer = PatientImporter(default_clinic=clinic, batch_size=options['batch_size'], rejects=rejects)
+
+            with tqdm(unit='rows') as progress:
+                result = importer.run(read_rows(options['path']), progress=progress.update)
+        finally:
+            rejects.close()
+
+        self.stdout.write(self.style.SUCCESS(f'Imported {result.imported} rows.'))
+        if result.rejected:
+            self.stdout.write(self.style.WARNING(f"Rejected {result.rejected} rows, see {options['rejects']}."))
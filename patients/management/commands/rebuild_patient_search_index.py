@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.core.cache import cache
+from tqdm import tqdm
+from patients.models import Patient
+from patients.search import COMMON_TRIGRAMS_KEY, index_patients
+
+class Command(BaseCommand):
+    help = 'Rebuilds the fuzzy patient search index in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Patients indexed per batch')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        patients = Patient.objects.only('id', 'first_name', 'last_name', 'phone', 'date_of_birth')
+        last_pk = 0
+
+        with tqdm(total=patients.count()) as progress:
+            while True:
+                chunk = list(patients.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+                if not chunk:
+                    break
+                index_patients(chunk)
+                last_pk = chunk[-1].pk
+                progress.update(len(chunk))
+
+        cache.delete(COMMON_TRIGRAMS_KEY)  # recounted on the next search
+        self.stdout.write(self.style.SUCCESS('Patient search index rebuilt.'))
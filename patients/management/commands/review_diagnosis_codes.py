@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from patients.models import DiagnosisAlias, DiagnosisCode, MedicalRecord
+
+class Command(BaseCommand):
+    help = 'Lists unverified diagnosis codes with their suggested matches, and accepts or rejects a suggestion'
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--accept', metavar='CODE', help='Move the records of an unverified code onto its suggested match and keep its spelling as an alias')
+        group.add_argument('--reject', metavar='CODE', help='Keep an unverified code as a separate diagnosis')
+
+    def handle(self, *args, **options):
+        code = options['accept'] or options['reject']
+        if code is None:
+            pending = DiagnosisCode.objects.filter(is_verified=False, suggested_match__isnull=False).select_related('suggested_match')
+            for entry in pending:
+                self.stdout.write(f'{entry.code}  {entry.name!r} -> {entry.suggested_match}')
+            self.stdout.write(f'{len(pending)} suggestions to review.')
+            return
+
+        entry = DiagnosisCode.objects.filter(code=code, is_verified=False, suggested_match__isnull=False).first()
+        if entry is None:
+            raise CommandError(f'{code} is not an unverified code with a suggestion.')
+        if options['reject']:
+            entry.suggested_match = None
+            entry.save(update_fields=['suggested_match'])
+            self.stdout.write(self.style.SUCCESS(f'Kept {entry} as a separate diagnosis.'))
+            return
+
+        target = entry.suggested_match
+        with transaction.atomic():
+            moved = MedicalRecord.objects.filter(diagnosis_code=entry).update(diagnosis_code=target)
+            DiagnosisCode.objects.filter(suggested_match=entry).update(suggested_match=target)
+            entry.delete()
+            DiagnosisAlias.objects.create(normalized_name=entry.normalized_name, code=target)
+        self.stdout.write(self.style.SUCCESS(f'Moved {moved} records to {target}; {entry.name!r} is now an alias.'))
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0003_patient_patients_pa_last_na_1b32a7_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientSearchIndex',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_index', serialize=False, to='patients.patient')),
+                ('first_name', models.CharField(max_length=100)),
+                ('last_name', models.CharField(max_length=100)),
+                ('first_soundex', models.CharField(max_length=4)),
+                ('last_soundex', models.CharField(max_length=4)),
+                ('phone_digits', models.CharField(blank=True, max_length=15)),
+                ('date_of_birth', models.DateField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_soundex', 'first_soundex'], name='patients_pa_last_so_8589e6_idx'), models.Index(fields=['first_soundex'], name='patients_pa_first_s_88f60e_idx'), models.Index(fields=['phone_digits'], name='patients_pa_phone_d_94f65e_idx'), models.Index(fields=['date_of_birth'], name='patients_pa_date_of_885cb7_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PatientNameTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='name_trigrams', to='patients.patient')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['trigram', 'patient'], name='patients_pa_trigram_1ab4f9_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0004_patientsearchindex_patientnametrigram'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('reasons', models.CharField(blank=True, max_length=200)),
+                ('status', models.CharField(choices=[('pending', 'Pending Review'), ('merged', 'Merged'), ('dismissed', 'Not a Duplicate')], default='pending', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-score'],
+            },
+        ),
+        migrations.AddField(
+            model_name='patientsearchindex',
+            name='phone_key',
+            field=models.CharField(blank=True, max_length=9),
+        ),
+        migrations.AddIndex(
+            model_name='patientsearchindex',
+            index=models.Index(fields=['last_soundex', 'date_of_birth'], name='patients_pa_last_so_3ee2d5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patientsearchindex',
+            index=models.Index(fields=['phone_key'], name='patients_pa_phone_k_b19fc4_idx'),
+        ),
+        migrations.AddField(
+            model_name='duplicatecandidate',
+            name='patient_a',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='patients.patient'),
+        ),
+        migrations.AddField(
+            model_name='duplicatecandidate',
+            name='patient_b',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='patients.patient'),
+        ),
+        migrations.AddField(
+            model_name='duplicatecandidate',
+            name='reviewed_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='duplicatecandidate',
+            index=models.Index(fields=['status', 'score'], name='patients_du_status_5084c2_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='duplicatecandidate',
+            unique_together={('patient_a', 'patient_b')},
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:32
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+
+def fill_previews(apps, schema_editor):
+    # Mirrors MedicalRecord.make_preview, which historical models do not have
+    MedicalRecord = apps.get_model('patients', 'MedicalRecord')
+    last_pk = 0
+    while True:
+        chunk = list(
+            MedicalRecord.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'diagnosis', 'treatment')[:2000]
+        )
+        if not chunk:
+            break
+        for record in chunk:
+            text = ' '.join(record.diagnosis.split())
+            if record.treatment.strip():
+                text = f"{text} | {' '.join(record.treatment.split())}"
+            record.preview = Truncator(text).chars(160)
+        MedicalRecord.objects.bulk_update(chunk, ['preview'])
+        last_pk = chunk[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0005_duplicatecandidate_patientsearchindex_phone_key_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicalrecord',
+            name='preview',
+            field=models.CharField(blank=True, editable=False, max_length=160),
+        ),
+        migrations.RunPython(fill_previews, migrations.RunPython.noop),
+    ]
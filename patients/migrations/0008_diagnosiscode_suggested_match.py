@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0007_follow_ups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnosiscode',
+            name='suggested_match',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='patients.diagnosiscode'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:44
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        ('patients', '0008_diagnosiscode_suggested_match'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='patient',
+            name='patients_pa_last_na_1b32a7_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='patient',
+            name='patients_pa_first_n_a142c0_idx',
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='first_name_lower',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.Lower('first_name'), output_field=models.CharField(max_length=100)),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='last_name_lower',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.Lower('last_name'), output_field=models.CharField(max_length=100)),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['last_name_lower', 'first_name_lower'], name='patients_pa_last_na_21bc9f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['first_name_lower', 'last_name_lower'], name='patients_pa_first_n_83352d_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0009_patient_lower_names'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiagnosisAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('normalized_name', models.CharField(max_length=200, unique=True)),
+                ('code', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='patients.diagnosiscode')),
+            ],
+        ),
+    ]
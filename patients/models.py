@@ -1,7 +1,18 @@
 from django.db import models
+from django.db.models.functions import Lower
 from django.utils import timezone
+from django.utils.text import Truncator
 from core.models import User, Clinic
 
+class SummaryManager(models.Manager):
+    """
+    Manager for list views: leaves the model's ``LARGE_TEXT_FIELDS`` out of
+    the SELECT. Accessing a deferred field loads it with an extra query, so
+    detail views should use ``objects`` instead.
+    """
+    def get_queryset(self):
+        return super().get_queryset().defer(*self.model.LARGE_TEXT_FIELDS)
+
 class Patient(models.Model):
     GENDER_CHOICES = (
         ('M', 'Male'),
@@ -34,6 +45,18 @@ class Patient(models.Model):
     allergies = models.TextField(blank=True)
     registration_date = models.DateTimeField(auto_now_add=True)
     clinic = models.ForeignKey(Clinic, on_delete=models.CASCADE)
+    # Lower-cased copies of the names, indexed for case-insensitive prefix search
+    first_name_lower = models.GeneratedField(
+        expression=Lower('first_name'), output_field=models.CharField(max_length=100), db_persist=True,
+    )
+    last_name_lower = models.GeneratedField(
+        expression=Lower('last_name'), output_field=models.CharField(max_length=100), db_persist=True,
+    )
+    
+    LARGE_TEXT_FIELDS = ('address', 'medical_history', 'allergies')
+    
+    objects = models.Manager()
+    summaries = SummaryManager()
     
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
@@ -45,6 +68,44 @@ class Patient(models.Model):
         return today.year - self.date_of_birth.year - (
             (today.month, today.day) < (self.date_of_birth.month, self.date_of_birth.day)
         )
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_name_lower', 'first_name_lower']),
+            models.Index(fields=['first_name_lower', 'last_name_lower']),
+            models.Index(fields=['phone']),
+            models.Index(fields=['date_of_birth', 'last_name']),
+            models.Index(fields=['registration_date', 'id']),
+        ]
+
+class DiagnosisCode(models.Model):
+    """Dictionary entry that free-text diagnoses are normalized onto."""
+    code = models.CharField(max_length=20, unique=True)
+    name = models.CharField(max_length=200)
+    normalized_name = models.CharField(max_length=200, unique=True)
+    is_verified = models.BooleanField(default=False)  # False for codes created by the normalizer
+    # A similarly spelled existing entry, for review; never applied automatically
+    suggested_match = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    
+    def save(self, *args, **kwargs):
+        from .diagnosis import normalize_diagnosis
+        if not self.normalized_name:
+            self.normalized_name = normalize_diagnosis(self.name)
+        super().save(*args, **kwargs)
+    
+    def __str__(self):
+        return f"{self.code} - {self.name}"
+    
+    class Meta:
+        ordering = ['code']
+
+class DiagnosisAlias(models.Model):
+    """Reviewed alternative spelling that the normalizer resolves straight to its code."""
+    normalized_name = models.CharField(max_length=200, unique=True)
+    code = models.ForeignKey(DiagnosisCode, on_delete=models.CASCADE, related_name='aliases')
+    
+    def __str__(self):
+        return f"{self.normalized_name} -> {self.code}"
 
 class MedicalRecord(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE)
@@ -55,6 +116,103 @@ class MedicalRecord(models.Model):
     treatment = models.TextField()
     notes = models.TextField(blank=True)
     follow_up_date = models.DateField(null=True, blank=True)
+    diagnosis_code = models.ForeignKey(DiagnosisCode, on_delete=models.SET_NULL, null=True, blank=True, related_name='records')
+    preview = models.CharField(max_length=160, blank=True, editable=False)  # short diagnosis/treatment summary for list rows
+    
+    LARGE_TEXT_FIELDS = ('symptoms', 'diagnosis', 'treatment', 'notes')
+    PREVIEW_LENGTH = 160
+    
+    objects = models.Manager()
+    summaries = SummaryManager()
+    
+    @classmethod
+    def make_preview(cls, diagnosis, treatment):
+        text = ' '.join(diagnosis.split())
+        if treatment.strip():
+            text = f"{text} | {' '.join(treatment.split())}"
+        return Truncator(text).chars(cls.PREVIEW_LENGTH)
+    
+    def save(self, *args, **kwargs):
+        from .diagnosis import DiagnosisNormalizer
+        update_fields = kwargs.get('update_fields')
+        extra_fields = set()
+        if self.diagnosis and (update_fields is None or 'diagnosis' in update_fields):
+            self.diagnosis_code_id = DiagnosisNormalizer().code_for(self.diagnosis)
+            extra_fields.add('diagnosis_code')
+        if update_fields is None or {'diagnosis', 'treatment'} & set(update_fields):
+            self.preview = self.make_preview(self.diagnosis, self.treatment)
+            extra_fields.add('preview')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, *extra_fields}
+        super().save(*args, **kwargs)
     
     def __str__(self):
-        return f"Record for {self.patient} on {self.visit_date}"
\ No newline at end of file
+        return f"Record for {self.patient} on {self.visit_date}"
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['visit_date', 'diagnosis_code']),
+            models.Index(fields=['follow_up_date'], condition=models.Q(follow_up_date__isnull=False), name='medicalrecord_follow_up_idx'),
+        ]
+
+class PatientSearchIndex(models.Model):
+    """Normalized and phonetic search keys for a patient, maintained on save."""
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, primary_key=True, related_name='search_index')
+    first_name = models.CharField(max_length=100)
+    last_name = models.CharField(max_length=100)
+    first_soundex = models.CharField(max_length=4)
+    last_soundex = models.CharField(max_length=4)
+    phone_digits = models.CharField(max_length=15, blank=True)
+    phone_key = models.CharField(max_length=9, blank=True)  # last 9 digits, ignores country/trunk prefixes
+    date_of_birth = models.DateField()
+    
+    def __str__(self):
+        return f"Search keys for {self.patient_id}"
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_soundex', 'first_soundex']),
+            models.Index(fields=['first_soundex']),
+            models.Index(fields=['phone_digits']),
+            models.Index(fields=['date_of_birth']),
+            models.Index(fields=['last_soundex', 'date_of_birth']),
+            models.Index(fields=['phone_key']),
+        ]
+
+class PatientNameTrigram(models.Model):
+    """One row per distinct trigram of a patient's normalized name."""
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='name_trigrams')
+    trigram = models.CharField(max_length=3)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['trigram', 'patient']),
+        ]
+
+
+class DuplicateCandidate(models.Model):
+    """A pair of patients that may be the same person, queued for review."""
+    STATUS_CHOICES = (
+        ('pending', 'Pending Review'),
+        ('merged', 'Merged'),
+        ('dismissed', 'Not a Duplicate'),
+    )
+    
+    # patient_a always has the lower id so each pair is stored once
+    patient_a = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='+')
+    patient_b = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    reasons = models.CharField(max_length=200, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    created_at = models.DateTimeField(auto_now_add=True)
+    reviewed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    
+    def __str__(self):
+        return f"Possible duplicate: {self.patient_a_id} / {self.patient_b_id} ({self.score:.2f})"
+    
+    class Meta:
+        ordering = ['-score']
+        unique_together = ['patient_a', 'patient_b']
+        indexes = [
+            models.Index(fields=['status', 'score']),
+        ]
@@ -0,0 +1,218 @@
+"""
+Fuzzy patient lookup for the front desk.
+
+Each patient has a PatientSearchIndex row (normalized names, Soundex codes,
+phone digits, date of birth) and a set of PatientNameTrigram rows. A query
+gathers a bounded candidate set through those indexed keys and only the
+candidates are scored.
+
+Each candidate source reads at most CANDIDATE_LIMIT rows, taken in a fixed
+order that puts the likeliest matches first (exact names before other
+sound-alikes). Counting shared trigrams would touch every posting of every
+query trigram, and common trigrams ("  s", "an ") are in a large share of
+all names, so trigrams held by more than MAX_TRIGRAM_POSTINGS patients are
+left out of the count; such names are still found by their Soundex codes.
+The set of common trigrams is counted once and cached.
+"""
+import difflib
+import re
+import unicodedata
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, Q, Value, When
+
+from .models import Patient, PatientSearchIndex, PatientNameTrigram
+
+CANDIDATE_LIMIT = 200
+MIN_NAME_SCORE = 0.6
+MAX_TRIGRAM_POSTINGS = 5000
+COMMON_TRIGRAMS_KEY = 'patient-search:common-trigrams'
+COMMON_TRIGRAMS_SECONDS = 3600
+
+_SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'),
+    **dict.fromkeys('cgjkqsxz', '2'),
+    **dict.fromkeys('dt', '3'),
+    'l': '4',
+    **dict.fromkeys('mn', '5'),
+    'r': '6',
+}
+
+
+def normalize_name(value):
+    """Lowercase ASCII letters only, with accents folded."""
+    folded = unicodedata.normalize('NFKD', value or '').encode('ascii', 'ignore').decode()
+    return re.sub(r'[^a-z]', '', folded.lower())
+
+
+def normalize_phone(value):
+    return re.sub(r'\D', '', value or '')
+
+
+def phone_key(value):
+    """Last nine digits, so +254 711 000111 and 0711 000111 compare equal."""
+    digits = normalize_phone(value)
+    return digits[-9:] if len(digits) >= 7 else ''
+
+
+def soundex(value):
+    """American Soundex code, e.g. ``soundex('Robert') == 'R163'``."""
+    name = normalize_name(value)
+    if not name:
+        return ''
+    encoded = name[0].upper()
+    previous = _SOUNDEX_CODES.get(name[0])
+    for char in name[1:]:
+        code = _SOUNDEX_CODES.get(char)
+        if code and code != previous:
+            encoded += code
+        # 'h' and 'w' do not separate letters with the same code; vowels do
+        if char not in 'hw':
+            previous = code
+    return (encoded + '000')[:4]
+
+
+def trigrams(value):
+    padded = f'  {normalize_name(value)} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)} if padded.strip() else set()
+
+
+def common_trigrams():
+    """Trigrams in more than MAX_TRIGRAM_POSTINGS patients' names, recounted hourly."""
+    return cache.get_or_set(COMMON_TRIGRAMS_KEY, lambda: frozenset(
+        PatientNameTrigram.objects.values('trigram').annotate(
+            postings=Count('id')
+        ).filter(postings__gt=MAX_TRIGRAM_POSTINGS).values_list('trigram', flat=True)
+    ), COMMON_TRIGRAMS_SECONDS)
+
+
+def index_patients(patients):
+    """(Re)build search keys for the given patients in bulk."""
+    patients = list(patients)
+    patient_ids = [patient.pk for patient in patients]
+
+    with transaction.atomic():
+        PatientSearchIndex.objects.filter(patient_id__in=patient_ids).delete()
+        PatientNameTrigram.objects.filter(patient_id__in=patient_ids).delete()
+
+        PatientSearchIndex.objects.bulk_create([
+            PatientSearchIndex(
+                patient_id=patient.pk,
+                first_name=normalize_name(patient.first_name),
+                last_name=normalize_name(patient.last_name),
+                first_soundex=soundex(patient.first_name),
+                last_soundex=soundex(patient.last_name),
+                phone_digits=normalize_phone(patient.phone),
+                phone_key=phone_key(patient.phone),
+                date_of_birth=patient.date_of_birth,
+            )
+            for patient in patients
+        ])
+        PatientNameTrigram.objects.bulk_create([
+            PatientNameTrigram(patient_id=patient.pk, trigram=trigram)
+            for patient in patients
+            for trigram in trigrams(patient.first_name) | trigrams(patient.last_name)
+        ])
+
+
+def parse_query(query):
+    """Split a free-form query into name tokens, phone digits and a date of birth."""
+    names, phone, date_of_birth = [], '', None
+    for token in query.split():
+        for date_format in ('%Y-%m-%d', '%d/%m/%Y'):
+            try:
+                date_of_birth = datetime.strptime(token, date_format).date()
+                break
+            except ValueError:
+                continue
+        else:
+            if re.fullmatch(r'\+?[\d\-()]*\d[\d\-()]*', token):
+                phone += normalize_phone(token)
+            elif normalize_name(token):
+                names.append(normalize_name(token))
+    return names, phone, date_of_birth
+
+
+def _name_score(token, keys):
+    best = 0.0
+    for name, code in ((keys.first_name, keys.first_soundex), (keys.last_name, keys.last_soundex)):
+        if not name:
+            continue
+        score = difflib.SequenceMatcher(None, token, name).ratio()
+        if name.startswith(token):
+            score = max(score, 0.9)
+        if soundex(token) == code:
+            score += 0.15
+        best = max(best, score)
+    return best
+
+
+def find_patients(query, limit=10):
+    """
+    Return up to ``limit`` ``(score, patient)`` pairs that best match ``query``.
+
+    The query may mix names (typos allowed), a phone number and a date of
+    birth; each part that matches adds to the score.
+    """
+    names, phone, date_of_birth = parse_query(query)
+    if not (names or phone or date_of_birth):
+        return []
+
+    candidates = set()
+    if phone:
+        candidates.update(PatientSearchIndex.objects.filter(
+            phone_digits__startswith=phone
+        ).order_by('phone_digits', 'patient_id').values_list('patient_id', flat=True)[:CANDIDATE_LIMIT])
+    if date_of_birth:
+        candidates.update(PatientSearchIndex.objects.filter(
+            date_of_birth=date_of_birth
+        ).order_by('patient_id').values_list('patient_id', flat=True)[:CANDIDATE_LIMIT])
+    if names:
+        codes = [soundex(name) for name in names]
+        if len(codes) > 1:
+            phonetic = PatientSearchIndex.objects.filter(last_soundex__in=codes, first_soundex__in=codes)
+        else:
+            phonetic = PatientSearchIndex.objects.filter(
+                Q(last_soundex=codes[0]) | Q(first_soundex=codes[0])
+            )
+        # Patients whose name is spelled as typed come first
+        phonetic = phonetic.annotate(exact=Case(
+            When(Q(last_name__in=names) | Q(first_name__in=names), then=Value(0)), default=Value(1),
+        )).order_by('exact', 'patient_id')
+        candidates.update(phonetic.values_list('patient_id', flat=True)[:CANDIDATE_LIMIT])
+
+        query_trigrams = set().union(*(trigrams(name) for name in names)) - common_trigrams()
+        if query_trigrams:
+            candidates.update(PatientNameTrigram.objects.filter(
+                trigram__in=query_trigrams
+            ).values('patient').annotate(
+                hits=Count('id')
+            ).order_by('-hits', 'patient').values_list('patient', flat=True)[:CANDIDATE_LIMIT])
+
+    scored = []
+    for keys in PatientSearchIndex.objects.filter(patient_id__in=candidates):
+        score = 0.0
+        if names:
+            name_score = sum(_name_score(name, keys) for name in names) / len(names)
+            if name_score < MIN_NAME_SCORE:
+                continue
+            score += name_score
+        if phone:
+            if not keys.phone_digits.startswith(phone):
+                continue
+            score += 1.0
+        if date_of_birth:
+            if keys.date_of_birth != date_of_birth:
+                continue
+            score += 1.0
+        scored.append((score, keys.patient_id))
+
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    scored = scored[:limit]
+
+    patients = Patient.objects.only(
+        'id', 'first_name', 'last_name', 'phone', 'date_of_birth'
+    ).in_bulk([patient_id for _, patient_id in scored])
+    return [(round(score, 3), patients[patient_id]) for score, patient_id in scored if patient_id in patients]
@@ -0,0 +1,44 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Patient, MedicalRecord
+from .search import index_patients
+from .timeline import invalidate_timeline
+
+@receiver(post_save, sender=Patient)
+def update_patient_search_index(sender, instance, raw=False, **kwargs):
+    """
+    Keep the fuzzy search keys in step with the patient's name, phone and date of birth
+    """
+    if not raw:
+        index_patients([instance])
+
+@receiver(post_save, sender=MedicalRecord)
+@receiver(post_delete, sender=MedicalRecord)
+@receiver(post_save, sender='prescriptions.Prescription')
+@receiver(post_delete, sender='prescriptions.Prescription')
+@receiver(post_save, sender='appointments.Appointment')
+@receiver(post_delete, sender='appointments.Appointment')
+@receiver(post_save, sender='billing.Bill')
+@receiver(post_delete, sender='billing.Bill')
+def invalidate_patient_timeline(sender, instance, **kwargs):
+    """Refresh the patient's cached timeline when one of its events changes"""
+    invalidate_timeline(instance.patient_id)
+
+@receiver(post_save, sender='prescriptions.PrescribedMedicine')
+@receiver(post_delete, sender='prescriptions.PrescribedMedicine')
+def invalidate_timeline_for_prescription(sender, instance, **kwargs):
+    from prescriptions.models import Prescription
+    patient_id = Prescription.objects.filter(pk=instance.prescription_id).values_list('patient_id', flat=True).first()
+    if patient_id:
+        invalidate_timeline(patient_id)
+
+@receiver(post_save, sender='billing.BillItem')
+@receiver(post_delete, sender='billing.BillItem')
+@receiver(post_save, sender='billing.Payment')
+@receiver(post_delete, sender='billing.Payment')
+def invalidate_timeline_for_bill(sender, instance, **kwargs):
+    """Item and payment postings change the bill's totals without saving the bill"""
+    from billing.models import Bill
+    patient_id = Bill.objects.filter(pk=instance.bill_id).values_list('patient_id', flat=True).first()
+    if patient_id:
+        invalidate_timeline(patient_id)
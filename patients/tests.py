@@ -1,3 +1,451 @@
+import io
+import json
+import os
+import tempfile
+import zipfile
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from core.models import User, Clinic
+from core.views import get_top_diagnoses
+from .diagnosis import DiagnosisNormalizer, normalize_diagnosis
+from .dedupe import find_duplicates, run_dedupe
+from .export import iter_patient_bundle, write_archive
+from .importer import MedicalRecordImporter, PatientImporter, read_rows
+from .models import Patient, MedicalRecord, DiagnosisCode, PatientSearchIndex, DuplicateCandidate
+from .search import common_trigrams, find_patients, soundex
+from .timeline import build_timeline_page, get_timeline_page
+from .views import search_patients
+from appointments.models import Appointment
+from billing.models import Bill, BillItem, Payment
+from prescriptions.models import Medicine, Prescription, PrescribedMedicine
 
-# Create your tests here.
+class DiagnosisCodingTestCase(TestCase):
+    def setUp(self):
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.doctor = User.objects.create_user(username='doctor', password='password', user_type='doctor')
+        self.patient = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01', clinic=self.clinic)
+        self.malaria = DiagnosisCode.objects.create(code='B54', name='Malaria', is_verified=True)
+
+    def _record(self, diagnosis):
+        return MedicalRecord.objects.create(
+            patient=self.patient, doctor=self.doctor, symptoms='Fever', diagnosis=diagnosis, treatment='Rest'
+        )
+
+    def test_normalize(self):
+        self.assertEqual(normalize_diagnosis('  Acute Bronchitis,  viral.\nSecond line'), 'acute bronchitis viral')
+
+    def test_spelling_variants_share_a_code(self):
+        self.assertEqual(self._record('MALARIA').diagnosis_code, self.malaria)
+        self.assertEqual(self._record('Malaria.').diagnosis_code, self.malaria)
+
+    def test_near_misses_are_only_suggested(self):
+        misspelt = self._record('Malarai').diagnosis_code
+        self.assertNotEqual(misspelt, self.malaria)
+        self.assertEqual(misspelt.suggested_match, self.malaria)
+
+        hypertension = DiagnosisCode.objects.create(code='I10', name='Hypertension', is_verified=True)
+        hypotension = self._record('Hypotension').diagnosis_code
+        self.assertNotEqual(hypotension, hypertension)
+        self.assertEqual(hypotension.suggested_match, hypertension)
+
+        call_command('review_diagnosis_codes', reject=hypotension.code, stdout=io.StringIO())
+        call_command('review_diagnosis_codes', accept=misspelt.code, stdout=io.StringIO())
+        self.assertEqual(MedicalRecord.objects.filter(diagnosis_code=self.malaria).count(), 1)
+        self.assertFalse(DiagnosisCode.objects.filter(pk=misspelt.pk).exists())
+        # The accepted spelling now resolves directly, without a new suggestion to review
+        self.assertEqual(self._record('Malarai').diagnosis_code, self.malaria)
+        self.assertFalse(DiagnosisCode.objects.filter(is_verified=False, suggested_match=self.malaria).exists())
+        hypotension.refresh_from_db()
+        self.assertIsNone(hypotension.suggested_match)
+
+    def test_unknown_diagnosis_creates_unverified_code(self):
+        record = self._record('Typhoid fever')
+        self.assertFalse(record.diagnosis_code.is_verified)
+        self.assertEqual(self._record('typhoid  fever').diagnosis_code, record.diagnosis_code)
+        self.assertIsNone(DiagnosisNormalizer(create=False).code_for('Dengue'))
+
+    def test_backfill_command(self):
+        record = self._record('Malaria')
+        MedicalRecord.objects.filter(pk=record.pk).update(diagnosis_code=None)
+
+        call_command('backfill_diagnosis_codes', chunk_size=1, stdout=io.StringIO())
+        record.refresh_from_db()
+        self.assertEqual(record.diagnosis_code, self.malaria)
+
+    def test_top_diagnoses_group_on_code(self):
+        self._record('Malaria')
+        self._record('malaria')
+        self._record('Typhoid')
+
+        top = get_top_diagnoses(MedicalRecord.objects.all(), 10)
+        self.assertEqual(top[0], {'diagnosis': 'Malaria', 'code': 'B54', 'count': 2})
+        self.assertEqual(len(top), 2)
+
+class PatientDirectoryTestCase(TestCase):
+    def setUp(self):
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.login(username='testuser', password='password')
+        self.john = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01', phone='0711000111', clinic=self.clinic)
+        self.jane = Patient.objects.create(first_name='Jane', last_name='Smith', date_of_birth='1985-06-15', phone='0722000222', clinic=self.clinic)
+
+    def _search(self, query):
+        response = self.client.get(reverse('patient-list'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['patients'])
+
+    def test_search(self):
+        self.assertEqual(self._search('doe'), [self.john])
+        self.assertEqual(self._search('Jane Smith'), [self.jane])
+        self.assertEqual(self._search('Smith Jane'), [self.jane])
+        self.assertEqual(self._search('0722'), [self.jane])
+        self.assertEqual(self._search('1985-06-15'), [self.jane])
+        self.assertEqual(self._search(f'#{self.john.pk}'), [self.john])
+
+    def test_cursor_pagination(self):
+        for i in range(30):
+            Patient.objects.create(first_name=f'Patient{i}', last_name='Test', date_of_birth='2000-01-01', phone='0700', clinic=self.clinic)
+
+        first = self.client.get(reverse('patient-list')).context['page']
+        self.assertEqual(len(first), 25)
+        self.assertTrue(first.has_next)
+
+        second = self.client.get(reverse('patient-list'), {'cursor': first.next_cursor}).context['page']
+        self.assertEqual(len(second), 7)
+        self.assertFalse(second.has_next)
+
+        seen = {p.pk for p in first} | {p.pk for p in second}
+        self.assertEqual(seen, set(Patient.objects.values_list('pk', flat=True)))
+
+        self.assertFalse(first.has_previous)
+        back = self.client.get(reverse('patient-list'), {'cursor': second.previous_cursor}).context['page']
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous)
+        self.assertEqual(back.next_cursor, first.next_cursor)
+
+    def test_name_search_uses_lower_case_index(self):
+        queryset = search_patients(Patient.objects.all(), 'SMITH j')
+        self.assertEqual(list(queryset), [self.jane])
+        self.assertIn('USING INDEX', queryset.explain())
+
+    def test_invalid_cursor_starts_from_first_page(self):
+        response = self.client.get(reverse('patient-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(len(response.context['page']), 2)
+
+class PatientSearchIndexTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.login(username='testuser', password='password')
+        self.catherine = Patient.objects.create(first_name='Catherine', last_name='Wanjiku', date_of_birth='1988-03-12', phone='+254 711 000111', clinic=self.clinic)
+        self.robert = Patient.objects.create(first_name='Robert', last_name='Otieno', date_of_birth='1975-11-02', phone='0733 123456', clinic=self.clinic)
+
+    def test_soundex(self):
+        self.assertEqual(soundex('Robert'), 'R163')
+        self.assertEqual(soundex('Rupert'), 'R163')
+        self.assertEqual(soundex('Ashcraft'), 'A261')
+        self.assertEqual(soundex('Tymczak'), 'T522')
+
+    def test_index_maintained_on_save(self):
+        self.robert.last_name = 'Odhiambo'
+        self.robert.save()
+        self.assertEqual(self.robert.search_index.last_name, 'odhiambo')
+        self.assertIn(' od', set(self.robert.name_trigrams.values_list('trigram', flat=True)))
+
+    def test_typos_and_phonetic_matches(self):
+        self.assertEqual(find_patients('Katherine Wanjku')[0][1], self.catherine)
+        self.assertEqual(find_patients('rupert')[0][1], self.robert)
+
+    def test_bounded_candidates_keep_exact_names_and_skip_common_trigrams(self):
+        Patient.objects.create(first_name='Mary', last_name='Smyth', date_of_birth='1990-01-01', clinic=self.clinic)
+        smith = Patient.objects.create(first_name='Mary', last_name='Smith', date_of_birth='1990-01-01', clinic=self.clinic)
+        with mock.patch('patients.search.MAX_TRIGRAM_POSTINGS', 1):
+            self.assertEqual(common_trigrams() & {' sm', 'smi', 'mar'}, {' sm', 'mar'})
+        cache.clear()
+        # With every trigram too common, only the Soundex step finds candidates
+        with mock.patch('patients.search.CANDIDATE_LIMIT', 1), mock.patch('patients.search.MAX_TRIGRAM_POSTINGS', 0):
+            self.assertEqual([patient for _, patient in find_patients('smith')], [smith])
+
+    def test_phone_and_date_of_birth(self):
+        self.assertEqual([p for _, p in find_patients('0733-123')], [self.robert])
+        self.assertEqual([p for _, p in find_patients('Catherine 12/03/1988')], [self.catherine])
+        self.assertEqual(find_patients('Catherine 1975-11-02'), [])
+
+    def test_search_api(self):
+        response = self.client.get(reverse('api-patient-search'), {'q': 'otieno'})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(results[0]['id'], self.robert.id)
+        self.assertEqual(results[0]['date_of_birth'], '1975-11-02')
+
+    def test_rebuild_command(self):
+        PatientSearchIndex.objects.all().delete()
+        call_command('rebuild_patient_search_index', stdout=io.StringIO())
+        self.assertEqual(PatientSearchIndex.objects.count(), 2)
+
+class DuplicatePatientTestCase(TestCase):
+    def setUp(self):
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.login(username='testuser', password='password')
+        self.grace = Patient.objects.create(first_name='Grace', last_name='Achieng', date_of_birth='1990-05-14', phone='+254 722 555001', clinic=self.clinic)
+        Patient.objects.create(first_name='Brian', last_name='Achieng', date_of_birth='1990-08-01', phone='0722 555001', clinic=self.clinic)
+
+    def post_patient(self, **extra):
+        data = {
+            'first_name': 'Grace', 'last_name': 'Acheing', 'date_of_birth': '1990-05-14',
+            'gender': 'F', 'phone': '0722555001', 'address': '1 Clinic Rd',
+        }
+        data.update(extra)
+        return self.client.post(reverse('patient-create'), data)
+
+    def test_find_duplicates(self):
+        matches = find_duplicates('Grace', 'Acheing', timezone.datetime(1990, 5, 14).date(), '0722 555 001')
+        self.assertEqual([patient_id for patient_id, _, _ in matches], [self.grace.pk])
+        self.assertIn('phone', matches[0][2])
+
+        # Same family phone but a different person
+        self.assertEqual(find_duplicates('Kevin', 'Mutua', timezone.datetime(2015, 1, 1).date(), '0722 555001'), [])
+
+    def test_registration_warns_before_saving(self):
+        response = self.post_patient()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([match for _, match in response.context['duplicates']], [self.grace])
+        self.assertEqual(Patient.objects.count(), 2)
+
+        response = self.post_patient(confirm_duplicate='1')
+        self.assertRedirects(response, reverse('patient-list'))
+        self.assertEqual(Patient.objects.count(), 3)
+        self.assertTrue(DuplicateCandidate.objects.filter(patient_a=self.grace, status='pending').exists())
+
+    def test_batch_run(self):
+        Patient.objects.create(first_name='Gracie', last_name='Achieng', date_of_birth='1990-05-14', phone='0700 000000', clinic=self.clinic)
+        for workers in (1, 2):
+            self.assertEqual(run_dedupe(workers=workers), 1)
+        self.assertEqual(DuplicateCandidate.objects.count(), 1)
+
+        call_command('find_duplicate_patients', '--workers', '1', stdout=io.StringIO())
+        self.assertEqual(DuplicateCandidate.objects.count(), 1)
+
+class PatientTimelineTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.login(username='testuser', password='password')
+        self.patient = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01', clinic=self.clinic)
+        self.medicine = Medicine.objects.create(name='Amoxicillin')
+
+    def add_history(self, visits):
+        start = timezone.now() - timezone.timedelta(days=visits)
+        for i in range(visits):
+            day = start + timezone.timedelta(days=i)
+            MedicalRecord.objects.create(patient=self.patient, doctor=self.user, visit_date=day, symptoms='Cough', diagnosis='Flu', treatment='Rest')
+            prescription = Prescription.objects.create(patient=self.patient, doctor=self.user, prescription_date=day)
+            PrescribedMedicine.objects.create(prescription=prescription, medicine=self.medicine, dosage='500mg', frequency='TDS', duration='5 days')
+            Appointment.objects.create(patient=self.patient, doctor=self.user, appointment_date=day, clinic=self.clinic, reason='Review')
+            Bill.objects.create(bill_number=f'B-{Bill.objects.count()}', patient=self.patient, due_date=day.date(), created_by=self.user)
+
+    def test_query_count_is_constant(self):
+        self.add_history(2)
+        with self.assertNumQueries(5):
+            build_timeline_page(self.patient.pk, per_page=10)
+
+        self.add_history(20)
+        with self.assertNumQueries(5):
+            page = build_timeline_page(self.patient.pk, per_page=10)
+        self.assertEqual(len(page['events']), 10)
+
+    def test_pages_cover_every_event_in_order(self):
+        self.add_history(8)
+        events, cursor = [], None
+        while True:
+            page = build_timeline_page(self.patient.pk, cursor, per_page=7)
+            events.extend(page['events'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+
+        self.assertEqual(len(events), 32)
+        self.assertEqual(len({(event['kind'], event['id']) for event in events}), 32)
+        dates = [event['date'] for event in events]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+        prescription = next(event for event in events if event['kind'] == 'prescription')
+        self.assertEqual(prescription['medicines'], ['Amoxicillin 500mg, TDS for 5 days (x1)'])
+
+    def test_cache_invalidated_on_write(self):
+        self.add_history(1)
+        get_timeline_page(self.patient.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_timeline_page(self.patient.pk)['events']), 4)
+
+        Appointment.objects.create(patient=self.patient, doctor=self.user, appointment_date=timezone.now(), clinic=self.clinic, reason='Follow-up')
+        self.assertEqual(len(get_timeline_page(self.patient.pk)['events']), 5)
+
+    def test_detail_view(self):
+        self.add_history(30)
+        response = self.client.get(reverse('patient-detail', args=[self.patient.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['timeline']['events']), 25)
+
+        response = self.client.get(reverse('patient-detail', args=[self.patient.pk]), {'cursor': response.context['timeline']['next_cursor']})
+        self.assertEqual(len(response.context['timeline']['events']), 25)
+
+class PatientImportTestCase(TestCase):
+    def setUp(self):
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.user = User.objects.create_user(username='drsmith', password='password')
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write_csv(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_csv_import_with_rejects(self):
+        path = self.write_csv('patients.csv', (
+            'First_Name,Last_Name,Date_of_Birth,Gender,Phone,Address\n'
+            'Amina,Hassan,1985-02-11,Female,0712000001,Mombasa\n'
+            'Peter,Kamau,11/02/1979,M,0712000002,Nakuru\n'
+            'Bad,Date,1979-13-45,M,0712000003,Nakuru\n'
+            ',NoFirst,1990-01-01,X,0712000004,Kisumu\n'
+        ))
+        rejects = io.StringIO()
+        result = PatientImporter(batch_size=2, rejects=rejects).run(read_rows(path))
+
+        self.assertEqual((result.imported, result.rejected), (2, 2))
+        amina = Patient.objects.get(first_name='Amina')
+        self.assertEqual((amina.gender, amina.clinic), ('F', self.clinic))
+        self.assertEqual(Patient.objects.get(first_name='Peter').date_of_birth.isoformat(), '1979-02-11')
+        self.assertEqual(find_patients('amina hasan')[0][1], amina)
+
+        report = rejects.getvalue().splitlines()
+        self.assertEqual(len(report), 3)
+        self.assertTrue(report[1].startswith('4,date_of_birth:'))
+        self.assertIn('first_name: This field cannot be blank.', report[2])
+        self.assertIn('gender:', report[2])
+
+    def test_xlsx_import(self):
+        from openpyxl import Workbook
+        path = os.path.join(self.tmpdir.name, 'patients.xlsx')
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['first_name', 'last_name', 'date_of_birth', 'gender', 'phone', 'address', 'clinic'])
+        sheet.append(['Joseph', 'Mwangi', timezone.datetime(1960, 7, 1), 'M', 722000111, 'Nyeri', 'Test Clinic'])
+        sheet.append(['Lucy', 'Njeri', timezone.datetime(1995, 3, 9), 'F', 722000222, 'Thika', 'Unknown Clinic'])
+        workbook.save(path)
+
+        result = PatientImporter(rejects=io.StringIO()).run(read_rows(path))
+        self.assertEqual((result.imported, result.rejected), (1, 1))
+        self.assertEqual(Patient.objects.get().phone, '722000111')
+
+    def test_medical_record_import(self):
+        patient = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01', clinic=self.clinic)
+        path = self.write_csv('records.csv', (
+            'patient_id,doctor,visit_date,symptoms,diagnosis,treatment\n'
+            f'{patient.pk},drsmith,2024-03-01 09:30,Fever,Malaria,Artemether\n'
+            f'{patient.pk},nobody,2024-03-02 09:30,Fever,Malaria,Artemether\n'
+            '999999,drsmith,2024-03-03 09:30,Fever,Malaria,Artemether\n'
+        ))
+        result = MedicalRecordImporter(rejects=io.StringIO()).run(read_rows(path))
+
+        self.assertEqual((result.imported, result.rejected), (1, 2))
+        record = MedicalRecord.objects.get()
+        self.assertEqual(record.diagnosis_code.normalized_name, 'malaria')
+        self.assertEqual(record.visit_date.hour, 9)
+
+    def test_import_command(self):
+        path = self.write_csv('patients.csv', 'first_name,last_name,date_of_birth,gender,phone,address\nAmina,Hassan,1985-02-11,F,0712000001,Mombasa\n')
+        rejects = os.path.join(self.tmpdir.name, 'rejects.csv')
+        call_command('import_patients', path, '--rejects', rejects, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(Patient.objects.count(), 1)
+
+class PatientExportTestCase(TestCase):
+    def setUp(self):
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.login(username='testuser', password='password')
+        self.patient = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01', clinic=self.clinic)
+        self.other = Patient.objects.create(first_name='Jane', last_name='Roe', date_of_birth='1992-01-01', clinic=self.clinic)
+
+        record = MedicalRecord.objects.create(patient=self.patient, doctor=self.user, symptoms='Cough', diagnosis='Flu', treatment='Rest')
+        prescription = Prescription.objects.create(patient=self.patient, doctor=self.user, medical_record=record)
+        PrescribedMedicine.objects.create(prescription=prescription, medicine=Medicine.objects.create(name='Paracetamol'), dosage='1g', frequency='QID', duration='3 days')
+        Appointment.objects.create(patient=self.patient, doctor=self.user, appointment_date=timezone.now(), clinic=self.clinic, reason='Review')
+        bill = Bill.objects.create(bill_number='B-1', patient=self.patient, due_date=timezone.now().date(), created_by=self.user)
+        BillItem.objects.create(bill=bill, description='Consultation', unit_price=50)
+        Payment.objects.create(bill=bill, amount=20, payment_method='cash')
+
+    def test_bundle_contents(self):
+        bundle = json.loads(''.join(iter_patient_bundle(self.patient.pk)))
+        self.assertEqual(bundle['patient']['last_name'], 'Doe')
+        self.assertEqual(bundle['medical_records'][0]['diagnosis'], 'Flu')
+        self.assertEqual(bundle['prescriptions'][0]['medicines'][0]['medicine'], 'Paracetamol')
+        self.assertEqual(bundle['appointments'][0]['reason'], 'Review')
+        self.assertEqual(bundle['bills'][0]['total_amount'], '50.00')
+        self.assertEqual(bundle['bills'][0]['payments'][0]['amount'], '20.00')
+
+        empty = json.loads(''.join(iter_patient_bundle(self.other.pk)))
+        self.assertEqual(empty['bills'], [])
+
+    def test_export_view_streams(self):
+        response = self.client.get(reverse('patient-export', args=[self.patient.pk]))
+        self.assertTrue(response.streaming)
+        self.assertIn('patient-%d.json' % self.patient.pk, response['Content-Disposition'])
+        bundle = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(bundle['patient']['id'], self.patient.pk)
+
+    def test_archive(self):
+        buffer = io.BytesIO()
+        self.assertEqual(write_archive(Patient.objects.filter(clinic=self.clinic), buffer), 2)
+        with zipfile.ZipFile(buffer) as archive:
+            self.assertEqual(sorted(archive.namelist()), [f'patient-{self.patient.pk}.json', f'patient-{self.other.pk}.json'])
+            bundle = json.loads(archive.read(f'patient-{self.patient.pk}.json'))
+        self.assertEqual(len(bundle['prescriptions']), 1)
+
+class MedicalRecordSummaryTestCase(TestCase):
+    def setUp(self):
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.client.login(username='testuser', password='password')
+        self.patient = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01', clinic=self.clinic)
+        self.record = MedicalRecord.objects.create(
+            patient=self.patient, doctor=self.user, symptoms='Fever ' * 500,
+            diagnosis='Malaria\nconfirmed by RDT', treatment='Artemether', notes='Long note ' * 1000,
+        )
+
+    def test_preview_maintained_on_save(self):
+        self.assertEqual(self.record.preview, 'Malaria confirmed by RDT | Artemether')
+
+        self.record.treatment = 'Quinine ' * 50
+        self.record.save(update_fields=['treatment'])
+        self.record.refresh_from_db()
+        self.assertEqual(len(self.record.preview), MedicalRecord.PREVIEW_LENGTH)
+        self.assertTrue(self.record.preview.startswith('Malaria confirmed by RDT | Quinine'))
+
+    def test_summaries_defer_large_text(self):
+        record = MedicalRecord.summaries.get(pk=self.record.pk)
+        self.assertEqual(record.get_deferred_fields(), set(MedicalRecord.LARGE_TEXT_FIELDS))
+        patient = Patient.summaries.get(pk=self.patient.pk)
+        self.assertEqual(patient.get_deferred_fields(), set(Patient.LARGE_TEXT_FIELDS))
+        self.assertEqual(MedicalRecord.objects.get(pk=self.record.pk).get_deferred_fields(), set())
+
+    def test_list_and_detail_views(self):
+        for _ in range(5):
+            MedicalRecord.objects.create(patient=self.patient, doctor=self.user, symptoms='Cough', diagnosis='Flu', treatment='Rest')
+
+        with self.assertNumQueries(4):  # session, user, patient, records
+            response = self.client.get(reverse('medical-record-list', args=[self.patient.pk]))
+        self.assertContains(response, 'Malaria confirmed by RDT | Artemether')
+        self.assertNotContains(response, 'Long note')
+
+        response = self.client.get(reverse('medical-record-detail', args=[self.patient.pk, self.record.pk]))
+        self.assertContains(response, 'Long note')
+        self.assertEqual(self.client.get(reverse('medical-record-detail', args=[self.patient.pk + 1, self.record.pk])).status_code, 404)
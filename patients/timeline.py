@@ -0,0 +1,196 @@
+"""
+Patient chart timeline.
+
+Merges medical records, prescriptions, appointments and bills into one
+date-ordered event stream. Each page costs a fixed number of queries (one
+per source plus one prefetch for prescribed medicines) however long the
+patient's history is, and rendered pages are cached per patient until one
+of the sources changes.
+"""
+import base64
+import heapq
+import json
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch, Q
+
+from appointments.models import Appointment
+from billing.models import Bill
+from prescriptions.models import Prescription, PrescribedMedicine
+from .models import MedicalRecord
+
+
+def _version_key(patient_id):
+    return f'patient-timeline:{patient_id}:version'
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+def invalidate_timeline(patient_id):
+    """Drop every cached page for a patient by moving to a new cache version."""
+    cache.set(_version_key(patient_id), _new_version(), None)
+
+
+def encode_cursor(event):
+    payload = json.dumps([event['date'].isoformat(), event['kind'], event['id']])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return ``(date, kind, id)`` from a cursor, or None if invalid."""
+    if not cursor:
+        return None
+    try:
+        date, kind, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(date), str(kind), int(pk)
+    except (ValueError, TypeError):
+        return None
+
+
+def _before(date_field, kind, position):
+    """Rows of one source that sort after ``position`` in (date, kind, id) descending order."""
+    date, cursor_kind, pk = position
+    if kind < cursor_kind:
+        return Q(**{f'{date_field}__lte': date})
+    if kind > cursor_kind:
+        return Q(**{f'{date_field}__lt': date})
+    return Q(**{f'{date_field}__lt': date}) | Q(**{date_field: date, 'pk__lt': pk})
+
+
+def _doctor_name(doctor):
+    return doctor.get_full_name() or doctor.username
+
+
+def _record_events(patient_id, position, limit):
+    records = MedicalRecord.objects.filter(patient_id=patient_id).select_related('doctor').only(
+        'visit_date', 'preview', 'follow_up_date',
+        'doctor__first_name', 'doctor__last_name', 'doctor__username',
+    )
+    if position:
+        records = records.filter(_before('visit_date', 'record', position))
+    for record in records.order_by('-visit_date', '-pk')[:limit]:
+        yield {
+            'kind': 'record',
+            'id': record.pk,
+            'date': record.visit_date,
+            'title': 'Visit',
+            'doctor': _doctor_name(record.doctor),
+            'preview': record.preview,
+            'follow_up_date': record.follow_up_date,
+        }
+
+
+def _prescription_events(patient_id, position, limit):
+    prescriptions = Prescription.objects.filter(patient_id=patient_id).select_related('doctor').only(
+        'prescription_date', 'notes', 'is_dispensed',
+        'doctor__first_name', 'doctor__last_name', 'doctor__username',
+    ).prefetch_related(Prefetch(
+        'medicines',
+        queryset=PrescribedMedicine.objects.select_related('medicine').only(
+            'prescription_id', 'dosage', 'frequency', 'duration', 'quantity', 'medicine__name'
+        ),
+    ))
+    if position:
+        prescriptions = prescriptions.filter(_before('prescription_date', 'prescription', position))
+    for prescription in prescriptions.order_by('-prescription_date', '-pk')[:limit]:
+        yield {
+            'kind': 'prescription',
+            'id': prescription.pk,
+            'date': prescription.prescription_date,
+            'title': 'Prescription',
+            'doctor': _doctor_name(prescription.doctor),
+            'status': 'Dispensed' if prescription.is_dispensed else 'Not dispensed',
+            'notes': prescription.notes,
+            'medicines': [
+                f'{item.medicine.name} {item.dosage}, {item.frequency} for {item.duration} (x{item.quantity})'
+                for item in prescription.medicines.all()
+            ],
+        }
+
+
+def _appointment_events(patient_id, position, limit):
+    appointments = Appointment.objects.filter(patient_id=patient_id).select_related('doctor').only(
+        'appointment_date', 'status', 'reason',
+        'doctor__first_name', 'doctor__last_name', 'doctor__username',
+    )
+    if position:
+        appointments = appointments.filter(_before('appointment_date', 'appointment', position))
+    for appointment in appointments.order_by('-appointment_date', '-pk')[:limit]:
+        yield {
+            'kind': 'appointment',
+            'id': appointment.pk,
+            'date': appointment.appointment_date,
+            'title': 'Appointment',
+            'doctor': _doctor_name(appointment.doctor),
+            'status': appointment.get_status_display(),
+            'reason': appointment.reason,
+        }
+
+
+def _bill_events(patient_id, position, limit):
+    bills = Bill.objects.filter(patient_id=patient_id).only(
+        'bill_number', 'bill_date', 'due_date', 'status', 'total_amount', 'paid_amount'
+    )
+    if position:
+        bills = bills.filter(_before('bill_date', 'bill', position))
+    for bill in bills.order_by('-bill_date', '-pk')[:limit]:
+        yield {
+            'kind': 'bill',
+            'id': bill.pk,
+            'date': bill.bill_date,
+            'title': f'Bill {bill.bill_number}',
+            'status': bill.get_status_display(),
+            'total_amount': bill.total_amount,
+            'balance_due': bill.balance_due,
+            'due_date': bill.due_date,
+        }
+
+
+SOURCES = (_record_events, _prescription_events, _appointment_events, _bill_events)
+
+
+def build_timeline_page(patient_id, cursor=None, per_page=None):
+    """
+    Assemble one page of the timeline straight from the database.
+
+    Each source contributes at most ``per_page + 1`` rows after the cursor,
+    which is all a merged page can need.
+
+    Returns:
+        dict: ``events`` (newest first) and ``next_cursor`` (None on the last page).
+    """
+    per_page = per_page or settings.PATIENT_TIMELINE_PAGE_SIZE
+    position = decode_cursor(cursor)
+
+    streams = [list(source(patient_id, position, per_page + 1)) for source in SOURCES]
+    merged = heapq.merge(
+        *streams, key=lambda event: (event['date'], event['kind'], event['id']), reverse=True
+    )
+    events = [event for event, _ in zip(merged, range(per_page + 1))]
+
+    next_cursor = None
+    if len(events) > per_page:
+        events = events[:per_page]
+        next_cursor = encode_cursor(events[-1])
+    return {'events': events, 'next_cursor': next_cursor}
+
+
+def get_timeline_page(patient_id, cursor=None, per_page=None):
+    """Return a timeline page, from the per-patient cache when possible."""
+    per_page = per_page or settings.PATIENT_TIMELINE_PAGE_SIZE
+    if decode_cursor(cursor) is None:
+        cursor = None
+    # A random version means an evicted version key can never revive stale pages
+    version = cache.get_or_set(_version_key(patient_id), _new_version, None)
+    key = f'patient-timeline:{patient_id}:{version}:{per_page}:{cursor or ""}'
+
+    page = cache.get(key)
+    if page is None:
+        page = build_timeline_page(patient_id, cursor, per_page)
+        cache.set(key, page, settings.PATIENT_TIMELINE_CACHE_TIMEOUT)
+    return page
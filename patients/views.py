@@ -1,13 +1,82 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.http import JsonResponse, StreamingHttpResponse
+from django.db.models import Q
+from datetime import datetime
+import re
 from .models import Patient, MedicalRecord, Clinic
 from .forms import PatientForm, MedicalRecordForm
+from .search import find_patients
+from .dedupe import find_duplicates, queue_duplicates
+from .timeline import get_timeline_page
+from .export import buffered, iter_patient_bundle
+from core.pagination import CursorPaginator
+
+PATIENT_LIST_FIELDS = ('id', 'first_name', 'last_name', 'phone', 'date_of_birth', 'gender', 'registration_date')
+PATIENT_LIST_PAGE_SIZE = 25
+
+def prefix_range(field, prefix):
+    """
+    Match values of ``field`` starting with ``prefix`` as a range.
+    
+    SQLite's LIKE (and so ``startswith``) never uses an ordinary index, but
+    ``>= prefix AND < prefix + U+10FFFF`` is an index range scan.
+    """
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + '\U0010ffff'})
+
+def search_patients(queryset, query):
+    """
+    Filter patients by ID, date of birth, phone or name.
+    
+    Every branch is an exact match or a prefix range so it can use the
+    Patient indexes; names are matched on their lower-cased columns.
+    """
+    query = query.strip()
+    if not query:
+        return queryset
+    
+    for date_format in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            date_of_birth = datetime.strptime(query, date_format).date()
+        except ValueError:
+            continue
+        return queryset.filter(date_of_birth=date_of_birth)
+    
+    if query.startswith('#') and query[1:].isdigit():
+        return queryset.filter(pk=int(query[1:]))
+    
+    digits = re.sub(r'[\s\-()]', '', query)
+    if re.fullmatch(r'\+?\d+', digits):
+        condition = prefix_range('phone', digits)
+        if digits.isdigit():
+            condition |= Q(pk=int(digits))
+        return queryset.filter(condition)
+    
+    names = query.lower().split()
+    if len(names) == 1:
+        return queryset.filter(
+            prefix_range('last_name_lower', names[0]) | prefix_range('first_name_lower', names[0])
+        )
+    first_name, last_name = names[0], ' '.join(names[1:])
+    return queryset.filter(
+        (prefix_range('first_name_lower', first_name) & prefix_range('last_name_lower', last_name)) |
+        (prefix_range('last_name_lower', first_name) & prefix_range('first_name_lower', last_name))
+    )
 
 @login_required
 def patient_list(request):
-    patients = Patient.objects.all().order_by('-registration_date')
-    return render(request, 'patients/patient_list.html', {'patients': patients})
+    search_query = request.GET.get('q', '')
+    patients = search_patients(Patient.objects.only(*PATIENT_LIST_FIELDS), search_query)
+    
+    paginator = CursorPaginator(patients, ('-registration_date', '-id'), per_page=PATIENT_LIST_PAGE_SIZE)
+    page = paginator.get_page(request.GET.get('cursor'))
+    
+    return render(request, 'patients/patient_list.html', {
+        'patients': page,
+        'page': page,
+        'search_query': search_query,
+    })
 
 @login_required
 def patient_create(request):
@@ -18,31 +87,62 @@ def patient_create(request):
         messages.error(request, "No clinic configured. Please contact administrator.")
         return redirect('patient-list')
     
+    duplicates = []
     if request.method == 'POST':
         form = PatientForm(request.POST)
         if form.is_valid():
             patient = form.save(commit=False)
             patient.clinic = default_clinic  # Set the clinic
-            patient.save()
-            messages.success(request, f'Patient {patient.first_name} {patient.last_name} created successfully.')
-            return redirect('patient-list')
+            
+            # Check the registry for the same person before saving
+            matches = find_duplicates(
+                patient.first_name, patient.last_name, patient.date_of_birth, patient.phone
+            )
+            if matches and request.POST.get('confirm_duplicate') != '1':
+                scores = {patient_id: score for patient_id, score, _ in matches}
+                duplicates = [
+                    (scores[match.pk], match)
+                    for match in Patient.objects.only(
+                        'id', 'first_name', 'last_name', 'phone', 'date_of_birth'
+                    ).filter(pk__in=scores)
+                ]
+                duplicates.sort(key=lambda item: -item[0])
+                messages.warning(request, 'This patient may already be registered. Review the matches below.')
+            else:
+                patient.save()
+                if matches:
+                    queue_duplicates(patient, matches)
+                messages.success(request, f'Patient {patient.first_name} {patient.last_name} created successfully.')
+                return redirect('patient-list')
     else:
         form = PatientForm()
     
     return render(request, 'patients/patient_form.html', {
         'form': form, 
-        'title': 'Add Patient'
+        'title': 'Add Patient',
+        'duplicates': duplicates,
     })
 
 @login_required
 def patient_detail(request, pk):
     patient = get_object_or_404(Patient, pk=pk)
-    medical_records = MedicalRecord.objects.filter(patient=patient).order_by('-visit_date')
+    timeline = get_timeline_page(patient.pk, request.GET.get('cursor'))
     return render(request, 'patients/patient_detail.html', {
         'patient': patient,
-        'medical_records': medical_records
+        'timeline': timeline,
+        'cursor': request.GET.get('cursor', ''),
     })
 
+@login_required
+def patient_export(request, pk):
+    """Stream the patient's complete record as a JSON bundle"""
+    patient = get_object_or_404(Patient.objects.only('id'), pk=pk)
+    response = StreamingHttpResponse(
+        buffered(iter_patient_bundle(patient.pk)), content_type='application/json'
+    )
+    response['Content-Disposition'] = f'attachment; filename="patient-{patient.pk}.json"'
+    return response
+
 @login_required
 def patient_update(request, pk):
     patient = get_object_or_404(Patient, pk=pk)
@@ -67,13 +167,27 @@ def patient_delete(request, pk):
 
 @login_required
 def medical_record_list(request, pk):
-    patient = get_object_or_404(Patient, pk=pk)
-    medical_records = MedicalRecord.objects.filter(patient=patient).order_by('-visit_date')
+    patient = get_object_or_404(Patient.summaries, pk=pk)
+    # Summary rows show the preview; the full notes load on the detail page
+    medical_records = MedicalRecord.summaries.filter(
+        patient=patient
+    ).select_related('doctor', 'diagnosis_code').order_by('-visit_date')
     return render(request, 'patients/medical_record_list.html', {
         'patient': patient,
         'medical_records': medical_records
     })
 
+@login_required
+def medical_record_detail(request, pk, record_pk):
+    record = get_object_or_404(
+        MedicalRecord.objects.select_related('patient', 'doctor', 'diagnosis_code'),
+        pk=record_pk, patient_id=pk,
+    )
+    return render(request, 'patients/medical_record_detail.html', {
+        'patient': record.patient,
+        'record': record,
+    })
+
 @login_required
 def medical_record_create(request, pk):
     patient = get_object_or_404(Patient, pk=pk)
@@ -92,4 +206,20 @@ def medical_record_create(request, pk):
         'form': form,
         'patient': patient,
         'title': 'Add Medical Record'
-    })
\ No newline at end of file
+    })
+
+@login_required
+def patient_search_api(request):
+    """Ranked fuzzy lookup by name, phone and date of birth for front-desk widgets"""
+    query = request.GET.get('q', '')
+    results = [
+        {
+            'id': patient.id,
+            'text': f"{patient.first_name} {patient.last_name}",
+            'phone': patient.phone,
+            'date_of_birth': patient.date_of_birth.strftime('%Y-%m-%d'),
+            'score': score,
+        }
+        for score, patient in find_patients(query, limit=10)
+    ]
+    return JsonResponse({'results': results})
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PrescriptionsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'prescriptions'
+
+    def ready(self):
+        import prescriptions.signals
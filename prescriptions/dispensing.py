@@ -0,0 +1,185 @@
+"""
+Batch dispensing for the pharmacy workbench.
+
+A batch of prescriptions is dispensed in one transaction with a fixed
+number of queries whatever its size: the prescriptions, their lines and
+every usable stock batch of the medicines involved are each read (and
+locked) with one query, quantities are allocated in Python, and the stock
+transactions and new batch quantities are written back in bulk.
+
+Stock is taken from the batches that expire first and a line may be split
+across batches. When substitution is allowed, a line falls back to the
+batches of equivalent medicines (same generic, strength and form, see
+prescriptions/equivalence.py) once the prescribed one runs out. A
+prescription is dispensed completely or not at all; if any of its lines
+cannot be covered it is left in the queue and the shortage is reported.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from inventory.models import InventoryItem, StockTransaction
+from patients.timeline import invalidate_timeline
+from .models import PrescribedMedicine, Prescription
+
+
+def usable_stock():
+    """Batches that may be dispensed from: active, in stock and not expired."""
+    return InventoryItem.objects.filter(status='active', quantity__gt=0, expiry_date__gte=timezone.localdate())
+
+
+def stock_with_equivalents(medicines):
+    """
+    Dispensable stock of each medicine, on its own and together with its
+    equivalents, from one grouped query.
+
+    Returns:
+        dict: ``{medicine_id: (own, with_equivalents)}``.
+    """
+    medicines = list(medicines)
+    keys = {medicine.equivalence_key for medicine in medicines if medicine.equivalence_key}
+    by_medicine, by_key = defaultdict(int), defaultdict(int)
+    rows = usable_stock().filter(
+        Q(medicine_id__in={medicine.pk for medicine in medicines}) | Q(medicine__equivalence_key__in=keys)
+    ).order_by().values('medicine_id', 'medicine__equivalence_key').annotate(total=Sum('quantity'))
+    for row in rows:
+        by_medicine[row['medicine_id']] += row['total']
+        by_key[row['medicine__equivalence_key']] += row['total']
+    return {
+        medicine.pk: (
+            by_medicine[medicine.pk],
+            by_key[medicine.equivalence_key] if medicine.equivalence_key else by_medicine[medicine.pk],
+        )
+        for medicine in medicines
+    }
+
+
+def _allocate(lines, candidates_for):
+    """
+    Take each line's quantity from its candidate batches (earliest expiry
+    first, each with a ``remaining`` count), all lines or none.
+
+    Returns:
+        tuple: ``(allocations, shortages)``; allocations are ``(batch, line, quantity)``.
+    """
+    taken = defaultdict(int)  # batch pk -> quantity this prescription takes
+    allocations, shortages = [], []
+    for line in lines:
+        needed = line.quantity
+        candidates = candidates_for(line)
+        for batch in candidates:
+            available = batch.remaining - taken[batch.pk]
+            if needed and available > 0:
+                quantity = min(needed, available)
+                taken[batch.pk] += quantity
+                allocations.append((batch, line, quantity))
+                needed -= quantity
+        if needed:
+            available = sum(batch.remaining for batch in candidates)
+            shortages.append({
+                'prescription_id': line.prescription_id,
+                'medicine': line.medicine.name,
+                'requested': line.quantity,
+                'available': available,
+            })
+    if shortages:
+        return [], shortages
+    return allocations, []
+
+
+def dispense_prescriptions(prescription_ids, user, substitute=False):
+    """
+    Dispense the given prescriptions from stock as one transaction.
+
+    Prescriptions that are already dispensed are ignored. With
+    ``substitute``, lines may be filled from equivalent medicines.
+
+    Returns:
+        tuple: the ids of the prescriptions dispensed, and a list of
+        shortages (dicts with ``prescription_id``, ``medicine``,
+        ``requested`` and ``available``) for the ones left undispensed.
+    """
+    dispensed, all_shortages = [], []
+    with transaction.atomic():
+        prescriptions = {
+            prescription.pk: prescription
+            for prescription in Prescription.objects.select_for_update().filter(
+                pk__in=prescription_ids, is_dispensed=False
+            ).only('patient_id').order_by('pk')
+        }
+
+        lines = defaultdict(list)
+        for line in PrescribedMedicine.objects.filter(prescription_id__in=prescriptions).select_related(
+            'medicine'
+        ).only(
+            'prescription_id', 'medicine_id', 'quantity', 'medicine__name', 'medicine__equivalence_key'
+        ).order_by('pk'):
+            lines[line.prescription_id].append(line)
+
+        medicines = {line.medicine_id: line.medicine for prescription_lines in lines.values() for line in prescription_lines}
+        keys = {medicine.equivalence_key for medicine in medicines.values() if medicine.equivalence_key} if substitute else set()
+        batches, equivalents = defaultdict(list), defaultdict(list)
+        for batch in usable_stock().select_for_update(of=('self',)).filter(
+            Q(medicine_id__in=medicines) | Q(medicine__equivalence_key__in=keys)
+        ).select_related('medicine').order_by('expiry_date', 'pk'):
+            batch.remaining = batch.quantity
+            batches[batch.medicine_id].append(batch)
+            if batch.medicine.equivalence_key in keys:
+                equivalents[batch.medicine.equivalence_key].append(batch)
+
+        def candidates_for(line):
+            # The prescribed medicine first, then its equivalents
+            substitutes = [
+                batch for batch in equivalents.get(line.medicine.equivalence_key, [])
+                if batch.medicine_id != line.medicine_id
+            ] if substitute else []
+            return batches.get(line.medicine_id, []) + substitutes
+
+        now = timezone.now()
+        allocations = []
+        for pk, prescription in prescriptions.items():
+            prescription_allocations, shortages = _allocate(lines[pk], candidates_for)
+            if shortages:
+                all_shortages.extend(shortages)
+                continue
+            for batch, line, quantity in prescription_allocations:
+                batch.remaining -= quantity
+            allocations.extend((prescription, batch, line, quantity) for batch, line, quantity in prescription_allocations)
+            dispensed.append(pk)
+
+        # Same numbering as StockTransaction.save, assigned for the whole batch at once
+        prefix, sequence = f"ST{now.strftime('%y%m%d')}", StockTransaction.objects.count()
+        transactions = []
+        for i, (prescription, batch, line, quantity) in enumerate(allocations, start=1):
+            transactions.append(StockTransaction(
+                transaction_id=f"{prefix}{sequence + i:04d}",
+                inventory_item=batch,
+                transaction_type='sale',
+                quantity=-quantity,
+                unit_price=batch.selling_price,
+                total_amount=quantity * batch.selling_price,
+                reference=f'Prescription #{prescription.pk}',
+                notes='Dispensed from the pharmacy workbench' if batch.medicine_id == line.medicine_id
+                else f'Dispensed from the pharmacy workbench: {batch.medicine.name} substituted for {line.medicine.name}',
+                created_by=user,
+                transaction_date=now,
+                patient_id=prescription.patient_id,
+                prescription=prescription,
+            ))
+        StockTransaction.objects.bulk_create(transactions)
+
+        changed = {batch.pk: batch for _, batch, _, _ in allocations}.values()
+        for batch in changed:
+            batch.quantity = batch.remaining
+            if batch.quantity == 0:
+                batch.status = 'inactive'  # as StockTransaction.update_inventory does
+        InventoryItem.objects.bulk_update(changed, ['quantity', 'status'])
+
+        # update() rather than save(): the stock has been taken above, so the
+        # post_save dispensing signal must not take it again
+        Prescription.objects.filter(pk__in=dispensed).update(is_dispensed=True)
+        for patient_id in {prescriptions[pk].patient_id for pk in dispensed}:
+            invalidate_timeline(patient_id)
+    return dispensed, all_shortages
@@ -0,0 +1,82 @@
+"""
+Equivalence keys for generic substitution.
+
+Two medicines are interchangeable when they have the same generic name,
+strength and dosage form. Each of the three is normalized so that spelling
+differences ("500 mg" / "0.5g", "Tabs" / "tablet") give the same key, and
+medicines with the same key form an equivalence group.
+
+This module has no model imports so migrations can use it.
+"""
+import re
+
+FORM_SYNONYMS = {
+    'tab': 'tablet', 'tabs': 'tablet', 'tablets': 'tablet',
+    'cap': 'capsule', 'caps': 'capsule', 'capsules': 'capsule',
+    'inj': 'injection', 'injections': 'injection',
+    'susp': 'suspension', 'syr': 'syrup',
+    'oint': 'ointment', 'cr': 'cream',
+    'soln': 'solution', 'sol': 'solution',
+    'supp': 'suppository', 'suppositories': 'suppository',
+}
+UNIT_SYNONYMS = {
+    'mg': ('mg', 1), 'g': ('mg', 1000), 'gm': ('mg', 1000), 'gram': ('mg', 1000), 'grams': ('mg', 1000),
+    'mcg': ('mcg', 1), 'ug': ('mcg', 1), 'µg': ('mcg', 1), 'microgram': ('mcg', 1), 'micrograms': ('mcg', 1),
+    'ml': ('ml', 1), 'l': ('ml', 1000),
+    'iu': ('iu', 1), 'units': ('iu', 1), 'unit': ('iu', 1),
+    '%': ('%', 1),
+}
+STRENGTH_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(mg|grams?|gm|g|mcg|ug|µg|micrograms?|ml|l|iu|units?|%)?', re.IGNORECASE)
+
+
+def _number(value):
+    return f'{value:.4f}'.rstrip('0').rstrip('.')
+
+
+def normalize_strength(strength):
+    """E.g. "0.5 g" -> "500mg", "250mg/5 mL" -> "250mg/5ml"."""
+    parts = []
+    for amount, unit in STRENGTH_RE.findall(strength or ''):
+        unit, factor = UNIT_SYNONYMS.get(unit.lower(), (unit.lower(), 1))
+        parts.append(_number(float(amount) * factor) + unit)
+    return '/'.join(parts)
+
+
+def normalize_form(dosage_form):
+    words = (dosage_form or '').lower().replace('-', ' ').split()
+    return ' '.join(FORM_SYNONYMS.get(word, word) for word in words)
+
+
+def equivalence_key(generic_name, strength, dosage_form):
+    """The key shared by substitutable medicines, or '' without a generic name."""
+    generic = ' '.join((generic_name or '').lower().split())
+    if not generic:
+        return ''
+    return f'{generic}|{normalize_strength(strength)}|{normalize_form(dosage_form)}'
+
+
+def backfill_keys(medicine_model, chunk_size=2000):
+    """
+    Recompute every medicine's key in chunks with bulk updates.
+
+    Takes the model class so data migrations can pass their historical model.
+
+    Returns:
+        int: the number of keys that changed.
+    """
+    changed, last_pk = 0, 0
+    while True:
+        chunk = list(medicine_model.objects.filter(pk__gt=last_pk).order_by('pk').only(
+            'pk', 'generic_name', 'strength', 'dosage_form', 'equivalence_key'
+        )[:chunk_size])
+        if not chunk:
+            return changed
+        stale = []
+        for medicine in chunk:
+            key = equivalence_key(medicine.generic_name, medicine.strength, medicine.dosage_form)
+            if key != medicine.equivalence_key:
+                medicine.equivalence_key = key
+                stale.append(medicine)
+        medicine_model.objects.bulk_update(stale, ['equivalence_key'])
+        changed += len(stale)
+        last_pk = chunk[-1].pk
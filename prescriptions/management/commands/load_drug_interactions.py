@@ -0,0 +1,35 @@
+import csv
+from django.core.management.base import BaseCommand, CommandError
+from prescriptions.models import DrugInteraction, Medicine
+from prescriptions.screening import invalidate_index, rescreen_active_prescriptions
+
+class Command(BaseCommand):
+    help = 'Loads drug interactions from a CSV file (drug_a, drug_b, severity, description), replacing existing pairs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with a header row')
+        parser.add_argument('--rescreen', action='store_true', help='Screen active prescriptions again afterwards')
+
+    def handle(self, *args, **options):
+        severities = dict(DrugInteraction.SEVERITY_CHOICES)
+        interactions = {}
+        with open(options['path'], newline='', encoding='utf-8-sig') as f:
+            for line, row in enumerate(csv.DictReader(f), start=2):
+                drug_a, drug_b = sorted((Medicine.normalize_generic(row['drug_a']), Medicine.normalize_generic(row['drug_b'])))
+                severity = row['severity'].strip().lower()
+                if not drug_a or drug_a == drug_b or severity not in severities:
+                    raise CommandError(f'Line {line}: expected two different drugs and one of {", ".join(severities)}.')
+                interactions[drug_a, drug_b] = DrugInteraction(
+                    drug_a=drug_a, drug_b=drug_b, severity=severity, description=row.get('description', '').strip()
+                )
+
+        DrugInteraction.objects.bulk_create(
+            interactions.values(), batch_size=1000, update_conflicts=True,
+            unique_fields=['drug_a', 'drug_b'], update_fields=['severity', 'description'],
+        )
+        invalidate_index()  # bulk_create sends no signals
+        self.stdout.write(self.style.SUCCESS(f'Loaded {len(interactions)} interactions.'))
+
+        if options['rescreen']:
+            screened, alerts = rescreen_active_prescriptions()
+            self.stdout.write(f'Screened {screened} active prescriptions, {alerts} alerts.')
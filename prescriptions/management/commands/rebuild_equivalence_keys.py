@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from prescriptions.equivalence import backfill_keys
+from prescriptions.models import Medicine
+
+class Command(BaseCommand):
+    help = 'Recomputes the generic-substitution key of every medicine, e.g. after changing the normalization rules'
+
+    def handle(self, *args, **options):
+        changed = backfill_keys(Medicine)
+        self.stdout.write(self.style.SUCCESS(f'Updated {changed} medicines.'))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from prescriptions.screening import rescreen_active_prescriptions
+
+class Command(BaseCommand):
+    help = 'Screens all active prescriptions again for interactions and allergies'
+
+    def handle(self, *args, **options):
+        screened, alerts = rescreen_active_prescriptions()
+        self.stdout.write(self.style.SUCCESS(f'Screened {screened} active prescriptions, {alerts} alerts.'))
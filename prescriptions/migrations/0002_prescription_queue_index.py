@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0007_follow_ups'),
+        ('prescriptions', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['is_dispensed', 'prescription_date'], name='prescriptio_is_disp_cb1776_idx'),
+        ),
+    ]
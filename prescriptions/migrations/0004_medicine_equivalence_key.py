@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:01
+
+from django.db import migrations, models
+
+from prescriptions.equivalence import backfill_keys
+
+
+def fill_equivalence_keys(apps, schema_editor):
+    backfill_keys(apps.get_model('prescriptions', 'Medicine'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prescriptions', '0003_drug_screening'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicine',
+            name='equivalence_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_equivalence_keys, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,7 @@ from django.db import models
 from django.utils import timezone
 from core.models import User
 from patients.models import Patient, MedicalRecord
+from .equivalence import equivalence_key
 
 class Medicine(models.Model):
     name = models.CharField(max_length=200)
@@ -10,6 +11,18 @@ class Medicine(models.Model):
     description = models.TextField(blank=True)
     dosage_form = models.CharField(max_length=100, blank=True)
     strength = models.CharField(max_length=100, blank=True)
+    equivalence_key = models.CharField(max_length=255, blank=True, editable=False, db_index=True)  # equal keys are substitutable
+    
+    @staticmethod
+    def normalize_generic(name):
+        return ' '.join(name.lower().split())
+    
+    def save(self, *args, **kwargs):
+        self.equivalence_key = equivalence_key(self.generic_name, self.strength, self.dosage_form)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'equivalence_key'}
+        super().save(*args, **kwargs)
     
     def __str__(self):
         return self.name
@@ -24,6 +37,11 @@ class Prescription(models.Model):
     
     def __str__(self):
         return f"Prescription for {self.patient} on {self.prescription_date}"
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_dispensed', 'prescription_date']),
+        ]
 
 class PrescribedMedicine(models.Model):
     prescription = models.ForeignKey(Prescription, on_delete=models.CASCADE, related_name='medicines')
@@ -35,4 +53,51 @@ class PrescribedMedicine(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     
     def __str__(self):
-        return f"{self.medicine.name} for {self.prescription.patient}"
\ No newline at end of file
+        return f"{self.medicine.name} for {self.prescription.patient}"
+
+class DrugInteraction(models.Model):
+    """A known interaction between two generic drugs, stored once per pair with drug_a < drug_b."""
+    SEVERITY_CHOICES = (
+        ('minor', 'Minor'),
+        ('moderate', 'Moderate'),
+        ('major', 'Major'),
+        ('contraindicated', 'Contraindicated'),
+    )
+    
+    drug_a = models.CharField(max_length=200)
+    drug_b = models.CharField(max_length=200)
+    severity = models.CharField(max_length=20, choices=SEVERITY_CHOICES)
+    description = models.TextField(blank=True)
+    
+    def save(self, *args, **kwargs):
+        self.drug_a, self.drug_b = sorted((Medicine.normalize_generic(self.drug_a), Medicine.normalize_generic(self.drug_b)))
+        super().save(*args, **kwargs)
+    
+    def __str__(self):
+        return f"{self.drug_a} + {self.drug_b} ({self.severity})"
+    
+    class Meta:
+        ordering = ['drug_a', 'drug_b']
+        unique_together = ['drug_a', 'drug_b']
+
+class ScreeningAlert(models.Model):
+    """An interaction or allergy found when screening a prescription."""
+    KIND_CHOICES = (
+        ('interaction', 'Drug Interaction'),
+        ('allergy', 'Allergy'),
+    )
+    
+    prescription = models.ForeignKey(Prescription, on_delete=models.CASCADE, related_name='alerts')
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='+')
+    other_medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    severity = models.CharField(max_length=20, choices=DrugInteraction.SEVERITY_CHOICES)
+    message = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+    acknowledged_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    
+    def __str__(self):
+        return self.message
+    
+    class Meta:
+        ordering = ['prescription', '-created_at']
@@ -0,0 +1,272 @@
+"""
+Drug-interaction and allergy screening.
+
+The interaction table is held in memory as an InteractionIndex: every
+generic name is interned to a small integer, each medicine maps to its
+generic's integer, and each interacting pair is one entry in a dict keyed
+on the two integers packed into one. Screening a prescription is then a
+handful of dict lookups per pair of medicines, with no queries beyond
+reading the patient's active medicines.
+
+Allergies are free text, usually annotated ("Amoxicillin - rash",
+"allergic to penicillin"), so each entry is searched for a medicine's
+generic name, brand name or the distinctive words of either as whole
+words, rather than compared with them exactly. Salt and dosage-form words
+("sodium", "acid") are not matched on their own.
+
+Each process builds the index on first use and rebuilds it when the
+shared version key changes; the signals bump it whenever an interaction
+or a medicine is saved or deleted. Bulk loads must call invalidate_index
+themselves.
+"""
+import re
+import threading
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DrugInteraction, Medicine, PrescribedMedicine, ScreeningAlert
+
+SEVERITY_RANK = {severity: rank for rank, (severity, _) in enumerate(DrugInteraction.SEVERITY_CHOICES)}
+VERSION_KEY = 'drug-interactions:version'
+NO_ALLERGY_TERMS = {'', 'none', 'nil', 'nkda', 'nka', 'no known allergies', 'no known drug allergies', 'n a'}
+NON_DRUG_WORDS = {
+    'acid', 'sodium', 'potassium', 'calcium', 'magnesium', 'hydrochloride', 'hcl', 'sulfate', 'sulphate',
+    'phosphate', 'acetate', 'tablet', 'tablets', 'capsule', 'capsules', 'syrup', 'suspension', 'injection',
+    'cream', 'ointment', 'drops', 'forte', 'extended', 'release', 'with', 'and', 'plus',
+}
+WORD_RE = re.compile(r'[a-z0-9]+')
+DURATION_RE = re.compile(r'(\d+)\s*(day|d|week|wk|w|month|mo)s?\b', re.IGNORECASE)
+DURATION_DAYS = {'day': 1, 'd': 1, 'week': 7, 'wk': 7, 'w': 7, 'month': 30, 'mo': 30}
+
+
+def _words(text):
+    return ' '.join(WORD_RE.findall((text or '').lower()))
+
+
+def _pair_key(a, b):
+    return (a << 32) | b if a < b else (b << 32) | a
+
+
+class InteractionIndex:
+    """The interaction table and medicine-to-generic mapping, keyed on integers."""
+
+    def __init__(self, interactions, medicines):
+        """
+        Args:
+            interactions: ``(drug_a, drug_b, severity, description)`` rows.
+            medicines: ``(pk, name, generic_name)`` rows.
+        """
+        self.drug_ids = {}
+        self.pairs = {}
+        self.medicine_drugs = {}
+        self.medicine_names = {}
+        self.medicine_terms = {}
+        for drug_a, drug_b, severity, description in interactions:
+            self.pairs[_pair_key(self._intern(drug_a), self._intern(drug_b))] = (severity, description)
+        for pk, name, generic_name in medicines:
+            generic = Medicine.normalize_generic(generic_name or name)
+            self.medicine_drugs[pk] = self._intern(generic)
+            self.medicine_names[pk] = name
+            names = {_words(generic), _words(name)} - {''}
+            words = {word for term in names for word in term.split() if len(word) > 3 and word not in NON_DRUG_WORDS}
+            self.medicine_terms[pk] = frozenset(names | words)
+
+    def _intern(self, name):
+        return self.drug_ids.setdefault(Medicine.normalize_generic(name), len(self.drug_ids))
+
+    def interaction(self, medicine_a, medicine_b):
+        """``(severity, description)`` for two medicines, or None."""
+        drug_a, drug_b = self.medicine_drugs.get(medicine_a), self.medicine_drugs.get(medicine_b)
+        if drug_a is None or drug_b is None or drug_a == drug_b:
+            return None
+        return self.pairs.get(_pair_key(drug_a, drug_b))
+
+    def check(self, medicine_ids, active_ids=(), allergies=frozenset()):
+        """
+        Screen new medicines against each other, the patient's active
+        medicines and their allergy entries (from parse_allergies).
+
+        Returns:
+            list: alert dicts with ``kind``, ``medicine_id``,
+            ``other_medicine_id``, ``severity`` and ``message``, most severe first.
+        """
+        alerts = []
+        medicine_ids = list(dict.fromkeys(medicine_ids))
+        for i, medicine_id in enumerate(medicine_ids):
+            name = self.medicine_names.get(medicine_id, f'Medicine #{medicine_id}')
+            matched = {
+                term for term in self.medicine_terms.get(medicine_id, ()) for allergy in allergies
+                if f' {term} ' in f' {allergy} '
+            }
+            if matched:
+                alerts.append({
+                    'kind': 'allergy',
+                    'medicine_id': medicine_id,
+                    'other_medicine_id': None,
+                    'severity': 'contraindicated',
+                    'message': f"{name}: patient is allergic to {', '.join(sorted(matched))}",
+                })
+            others = [*medicine_ids[i + 1:], *(pk for pk in dict.fromkeys(active_ids) if pk not in medicine_ids)]
+            for other_id in others:
+                found = self.interaction(medicine_id, other_id)
+                if found:
+                    severity, description = found
+                    other_name = self.medicine_names.get(other_id, f'Medicine #{other_id}')
+                    alerts.append({
+                        'kind': 'interaction',
+                        'medicine_id': medicine_id,
+                        'other_medicine_id': other_id,
+                        'severity': severity,
+                        'message': f"{name} + {other_name}: {description or severity}"[:255],
+                    })
+        alerts.sort(key=lambda alert: -SEVERITY_RANK[alert['severity']])
+        return alerts
+
+
+def load_index():
+    return InteractionIndex(
+        DrugInteraction.objects.values_list('drug_a', 'drug_b', 'severity', 'description').iterator(),
+        Medicine.objects.values_list('pk', 'name', 'generic_name').iterator(),
+    )
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def invalidate_index():
+    """Make every process rebuild its index on next use."""
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def get_index():
+    global _index, _index_version
+    version = cache.get_or_set(VERSION_KEY, lambda: uuid.uuid4().hex, None)
+    if _index is None or _index_version != version:
+        with _index_lock:
+            if _index is None or _index_version != version:
+                _index = load_index()
+                _index_version = version
+    return _index
+
+
+def parse_allergies(text):
+    """
+    The entries of the free-text ``Patient.allergies``, one per comma,
+    semicolon or line, reduced to lowercase words.
+    """
+    entries = {_words(entry) for entry in re.split(r'[,;\n]+', text or '')}
+    return frozenset(entries - NO_ALLERGY_TERMS)
+
+
+def parse_duration(text):
+    """Length of a course such as "5 days" or "2 weeks", or None if it cannot be read."""
+    match = DURATION_RE.search(text or '')
+    if not match:
+        return None
+    return timedelta(days=int(match.group(1)) * DURATION_DAYS[match.group(2).lower()])
+
+
+def is_active(prescription_date, duration, now):
+    course = parse_duration(duration) or timedelta(days=settings.ACTIVE_PRESCRIPTION_DAYS)
+    return prescription_date + course >= now
+
+
+def _active_lines():
+    """Lines of prescriptions recent enough that they may still be active."""
+    since = timezone.now() - timedelta(days=settings.PRESCRIPTION_LOOKBACK_DAYS)
+    return PrescribedMedicine.objects.filter(prescription__prescription_date__gte=since)
+
+
+def active_medicine_ids(patient_id, exclude_prescription_id=None):
+    now = timezone.now()
+    lines = _active_lines().filter(prescription__patient_id=patient_id)
+    if exclude_prescription_id:
+        lines = lines.exclude(prescription_id=exclude_prescription_id)
+    return [
+        medicine_id
+        for medicine_id, duration, prescribed in lines.values_list('medicine_id', 'duration', 'prescription__prescription_date')
+        if is_active(prescribed, duration, now)
+    ]
+
+
+def screen_medicines(patient, medicine_ids, exclude_prescription_id=None):
+    """Alerts for prescribing ``medicine_ids`` to ``patient``, for checking before saving."""
+    return get_index().check(
+        medicine_ids,
+        active_medicine_ids(patient.pk, exclude_prescription_id),
+        parse_allergies(patient.allergies),
+    )
+
+
+def _replace_alerts(alerts_by_prescription):
+    """Swap the unacknowledged alerts of the given prescriptions for new ones."""
+    acknowledged = set(ScreeningAlert.objects.filter(
+        prescription_id__in=alerts_by_prescription, acknowledged_by__isnull=False,
+    ).values_list('prescription_id', 'kind', 'medicine_id', 'other_medicine_id'))
+    ScreeningAlert.objects.filter(prescription_id__in=alerts_by_prescription, acknowledged_by__isnull=True).delete()
+    ScreeningAlert.objects.bulk_create([
+        ScreeningAlert(prescription_id=prescription_id, **alert)
+        for prescription_id, alerts in alerts_by_prescription.items()
+        for alert in alerts
+        if (prescription_id, alert['kind'], alert['medicine_id'], alert['other_medicine_id']) not in acknowledged
+    ])
+
+
+def screen_prescription(prescription):
+    """Screen a saved prescription and record its alerts."""
+    medicine_ids = list(prescription.medicines.values_list('medicine_id', flat=True))
+    alerts = screen_medicines(prescription.patient, medicine_ids, exclude_prescription_id=prescription.pk)
+    with transaction.atomic():
+        _replace_alerts({prescription.pk: alerts})
+    return alerts
+
+
+def rescreen_active_prescriptions(batch_size=1000):
+    """
+    Screen every active prescription again, e.g. after the interaction table changed.
+
+    Lines are read in one pass ordered by patient, so each patient's active
+    medicines are known without further queries.
+
+    Returns:
+        tuple: the number of prescriptions screened and of alerts recorded.
+    """
+    index = get_index()
+    now = timezone.now()
+    rows = _active_lines().order_by('prescription__patient_id', 'prescription_id').values_list(
+        'prescription__patient_id', 'prescription__patient__allergies', 'prescription_id',
+        'medicine_id', 'duration', 'prescription__prescription_date',
+    ).iterator(chunk_size=batch_size)
+
+    screened = alerted = 0
+    pending = {}
+    for (patient_id, allergies), patient_rows in groupby(rows, key=lambda row: row[:2]):
+        by_prescription = defaultdict(list)
+        for _, _, prescription_id, medicine_id, duration, prescribed in patient_rows:
+            if is_active(prescribed, duration, now):
+                by_prescription[prescription_id].append(medicine_id)
+        allergy_terms = parse_allergies(allergies)
+        for prescription_id, medicine_ids in by_prescription.items():
+            others = [pk for other, ids in by_prescription.items() if other != prescription_id for pk in ids]
+            pending[prescription_id] = index.check(medicine_ids, others, allergy_terms)
+        if len(pending) >= batch_size:
+            with transaction.atomic():
+                _replace_alerts(pending)
+            screened += len(pending)
+            alerted += sum(map(len, pending.values()))
+            pending = {}
+    if pending:
+        with transaction.atomic():
+            _replace_alerts(pending)
+        screened += len(pending)
+        alerted += sum(map(len, pending.values()))
+    return screened, alerted
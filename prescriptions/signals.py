@@ -0,0 +1,28 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import DrugInteraction, Medicine, PrescribedMedicine, Prescription
+from .screening import invalidate_index, screen_prescription
+
+@receiver(post_save, sender=DrugInteraction)
+@receiver(post_delete, sender=DrugInteraction)
+@receiver(post_save, sender=Medicine)
+@receiver(post_delete, sender=Medicine)
+def reload_interaction_index(sender, **kwargs):
+    invalidate_index()
+
+@receiver(post_save, sender=PrescribedMedicine)
+def screen_prescribed_medicine(sender, instance, raw=False, **kwargs):
+    """Check the prescription against interactions and allergies as medicines are added"""
+    if not raw:
+        screen_prescription(instance.prescription)
+
+@receiver(post_delete, sender=PrescribedMedicine)
+def rescreen_after_removal(sender, instance, **kwargs):
+    # The whole prescription may be being deleted, so wait for the commit to see
+    prescription_id = instance.prescription_id
+    def rescreen():
+        prescription = Prescription.objects.select_related('patient').filter(pk=prescription_id).first()
+        if prescription:
+            screen_prescription(prescription)
+    transaction.on_commit(rescreen)
@@ -1,3 +1,205 @@
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from core.models import User, Clinic
+from inventory.models import InventoryItem, StockTransaction, Supplier
+from patients.models import Patient
+from .dispensing import dispense_prescriptions, stock_with_equivalents
+from .equivalence import equivalence_key
+from .models import DrugInteraction, Medicine, Prescription, PrescribedMedicine, ScreeningAlert
+from .screening import get_index, parse_allergies, screen_medicines
 
-# Create your tests here.
+class DispensingTestCase(TestCase):
+    def setUp(self):
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.user = User.objects.create_user(username='pharmacist', password='password')
+        self.client.login(username='pharmacist', password='password')
+        self.patient = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01', clinic=self.clinic)
+        self.amoxicillin = Medicine.objects.create(name='Amoxil', generic_name='Amoxicillin', strength='500mg')
+        self.ibuprofen = Medicine.objects.create(name='Brufen', generic_name='Ibuprofen', strength='400mg')
+        self.supplier = Supplier.objects.create(name='MedSupply', phone='555-0100')
+        today = timezone.localdate()
+        self.early = self.batch(self.amoxicillin, 'A1', 6, today + timedelta(days=30))
+        self.late = self.batch(self.amoxicillin, 'A2', 10, today + timedelta(days=300))
+        self.batch(self.ibuprofen, 'B1', 5, today + timedelta(days=100))
+
+    def batch(self, medicine, number, quantity, expiry):
+        return InventoryItem.objects.create(medicine=medicine, batch_number=number, quantity=quantity, expiry_date=expiry,
+                                            cost_price=Decimal('1.00'), selling_price=Decimal('2.50'), supplier=self.supplier)
+
+    def prescription(self, *lines):
+        prescription = Prescription.objects.create(patient=self.patient, doctor=self.user)
+        for medicine, quantity in lines:
+            PrescribedMedicine.objects.create(prescription=prescription, medicine=medicine, dosage='1 tab',
+                                              frequency='TDS', duration='5 days', quantity=quantity)
+        return prescription
+
+    def test_dispense_batch_takes_earliest_expiry_first(self):
+        first = self.prescription((self.amoxicillin, 8), (self.ibuprofen, 2))
+        second = self.prescription((self.amoxicillin, 4))
+        with self.assertNumQueries(9):  # fixed whatever the batch size
+            dispensed, shortages = dispense_prescriptions([first.pk, second.pk], self.user)
+        self.assertEqual((dispensed, shortages), ([first.pk, second.pk], []))
+
+        self.early.refresh_from_db()
+        self.late.refresh_from_db()
+        self.assertEqual((self.early.quantity, self.early.status), (0, 'inactive'))
+        self.assertEqual(self.late.quantity, 4)
+        self.assertEqual(StockTransaction.objects.filter(prescription=first).count(), 3)  # split across two batches
+        self.assertEqual(stock_with_equivalents([self.amoxicillin, self.ibuprofen]), {self.amoxicillin.pk: (4, 4), self.ibuprofen.pk: (3, 3)})
+        self.assertTrue(Prescription.objects.get(pk=first.pk).is_dispensed)
+
+        # Dispensing again takes nothing
+        self.assertEqual(dispense_prescriptions([first.pk], self.user), ([], []))
+        self.assertEqual(StockTransaction.objects.count(), 4)
+
+    def test_shortage_leaves_whole_prescription_undispensed(self):
+        short = self.prescription((self.ibuprofen, 2), (self.amoxicillin, 20))
+        fine = self.prescription((self.ibuprofen, 5))
+        dispensed, shortages = dispense_prescriptions([short.pk, fine.pk], self.user)
+        self.assertEqual(dispensed, [fine.pk])
+        self.assertEqual(shortages, [{'prescription_id': short.pk, 'medicine': 'Amoxil', 'requested': 20, 'available': 16}])
+        self.assertFalse(Prescription.objects.get(pk=short.pk).is_dispensed)
+        self.assertFalse(StockTransaction.objects.filter(prescription=short).exists())
+
+    def test_equivalence_key_normalization(self):
+        self.assertEqual(equivalence_key(' Amoxicillin ', '0.5 g', 'Caps'), equivalence_key('amoxicillin', '500mg', 'capsule'))
+        self.assertEqual(equivalence_key('Amoxicillin', '250mg/5 mL', 'Susp'), 'amoxicillin|250mg/5ml|suspension')
+        self.assertNotEqual(equivalence_key('Amoxicillin', '250mg', ''), equivalence_key('Amoxicillin', '500mg', ''))
+        self.assertEqual(equivalence_key('', '500mg', 'tablet'), '')
+
+    def test_substitution_from_equivalents(self):
+        generic = Medicine.objects.create(name='Amoxicillin Generic', generic_name='AMOXICILLIN', strength='0.5 g')
+        self.assertEqual(generic.equivalence_key, self.amoxicillin.equivalence_key)
+        self.batch(generic, 'G1', 10, timezone.localdate() + timedelta(days=200))
+        self.assertEqual(stock_with_equivalents([self.amoxicillin])[self.amoxicillin.pk], (16, 26))
+
+        prescription = self.prescription((self.amoxicillin, 20))
+        self.assertEqual(dispense_prescriptions([prescription.pk], self.user)[0], [])
+        self.assertEqual(dispense_prescriptions([prescription.pk], self.user, substitute=True), ([prescription.pk], []))
+        substituted = StockTransaction.objects.get(prescription=prescription, inventory_item__medicine=generic)
+        self.assertEqual(substituted.quantity, -4)  # the prescribed medicine's own batches go first
+        self.assertIn('Amoxicillin Generic substituted for Amoxil', substituted.notes)
+
+        Medicine.objects.filter(pk=generic.pk).update(equivalence_key='stale')
+        call_command('rebuild_equivalence_keys', stdout=StringIO())
+        generic.refresh_from_db()
+        self.assertEqual(generic.equivalence_key, 'amoxicillin|500mg|')
+
+    def test_low_stock_view_counts_equivalents(self):
+        generic = Medicine.objects.create(name='Amoxicillin Generic', generic_name='Amoxicillin', strength='500 mg')
+        self.batch(generic, 'G1', 50, timezone.localdate() + timedelta(days=200))
+        InventoryItem.objects.exclude(pk=self.early.pk).update(min_stock_level=0)
+        response = self.client.get(reverse('low-stock-items'))
+        [item] = response.context['items']
+        self.assertEqual((item.medicine_stock, item.with_equivalents), (16, 66))
+
+        response = self.client.get(reverse('api-medicine-availability'), {'medicine': [self.amoxicillin.pk]})
+        self.assertEqual(response.json()['results'], [{'id': self.amoxicillin.pk, 'name': 'Amoxil', 'in_stock': 16, 'with_equivalents': 66}])
+
+    def test_workbench_queue_and_dispense_selected(self):
+        prescriptions = [self.prescription((self.amoxicillin, 2), (self.ibuprofen, 9)) for _ in range(3)]
+        with self.assertNumQueries(7):  # session, user, count, page, medicines, alerts, stock
+            response = self.client.get(reverse('dispensing-queue'))
+        lines = list(response.context['page_obj'][0].medicines.all())
+        self.assertEqual([(line.in_stock, line.stock_status) for line in lines], [(16, 'ok'), (5, 'short')])
+
+        response = self.client.post(reverse('dispense-selected'), {'prescriptions': [p.pk for p in prescriptions]}, follow=True)
+        text = [str(message) for message in response.context['messages']]
+        self.assertEqual(len(text), 3)
+        self.assertIn('Brufen needs 9, 5 in stock', text[0])
+
+
+class ScreeningTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.clinic = Clinic.objects.create(name='Test Clinic', address='123 Test St', established_date=timezone.now())
+        self.doctor = User.objects.create_user(username='doctor1', password='password')
+        self.client.login(username='doctor1', password='password')
+        self.patient = Patient.objects.create(first_name='John', last_name='Doe', date_of_birth='1990-01-01',
+                                              allergies='Ibuprofen; NKDA', clinic=self.clinic)
+        self.warfarin = Medicine.objects.create(name='Coumadin', generic_name='Warfarin')
+        self.aspirin = Medicine.objects.create(name='Aspirin', generic_name='Acetylsalicylic acid')
+        self.brufen = Medicine.objects.create(name='Brufen', generic_name='Ibuprofen')
+        DrugInteraction.objects.create(drug_a='WARFARIN', drug_b='acetylsalicylic  acid', severity='major',
+                                       description='Increased bleeding risk')
+
+    def prescribe(self, *medicines, days_ago=0, duration='7 days'):
+        prescription = Prescription.objects.create(patient=self.patient, doctor=self.doctor,
+                                                   prescription_date=timezone.now() - timedelta(days=days_ago))
+        for medicine in medicines:
+            PrescribedMedicine.objects.create(prescription=prescription, medicine=medicine, dosage='1 tab',
+                                              frequency='OD', duration=duration, quantity=7)
+        return prescription
+
+    def test_index_check_needs_no_queries(self):
+        index = get_index()
+        with self.assertNumQueries(0):
+            alerts = index.check([self.aspirin.pk, self.brufen.pk], [self.warfarin.pk], parse_allergies(self.patient.allergies))
+        self.assertEqual([(a['kind'], a['severity'], a['medicine_id']) for a in alerts],
+                         [('allergy', 'contraindicated', self.brufen.pk), ('interaction', 'major', self.aspirin.pk)])
+        self.assertEqual(parse_allergies('None'), frozenset())
+
+    def test_annotated_allergy_entries(self):
+        amoxil = Medicine.objects.create(name='Amoxil', generic_name='Amoxicillin')
+        penicillin = Medicine.objects.create(name='Pen-V', generic_name='Penicillin V')
+        index = get_index()
+
+        def allergic(allergies, medicine):
+            return [alert['kind'] for alert in index.check([medicine.pk], allergies=parse_allergies(allergies))] == ['allergy']
+
+        self.assertTrue(allergic('Amoxicillin - rash', amoxil))
+        self.assertTrue(allergic('AMOXIL (hives)', amoxil))
+        self.assertTrue(allergic('penicillin (rash)', penicillin))
+        self.assertTrue(allergic('Sulfa; allergic to penicillin', penicillin))
+        self.assertTrue(allergic('Aspirin/NSAIDs', self.aspirin))
+        self.assertFalse(allergic('Amoxicillin - rash', penicillin))
+        self.assertFalse(allergic('Ibuprofenol', self.brufen))  # whole words only
+        self.assertFalse(allergic('Folic acid', self.aspirin))  # salt and form words alone do not match
+
+        # Changing the table reloads the index
+        DrugInteraction.objects.filter(drug_a='acetylsalicylic acid').delete()
+        self.assertIsNone(get_index().interaction(self.aspirin.pk, self.warfarin.pk))
+
+    def test_prescribing_against_active_medicines(self):
+        self.prescribe(self.warfarin, days_ago=3)
+        prescription = self.prescribe(self.aspirin)
+        alert = ScreeningAlert.objects.get(prescription=prescription)
+        self.assertEqual((alert.kind, alert.other_medicine_id), ('interaction', self.warfarin.pk))
+        self.assertIn('bleeding', alert.message)
+
+        # A finished course is no longer screened against
+        self.assertEqual(screen_medicines(Patient.objects.create(
+            first_name='Jane', last_name='Doe', date_of_birth='1990-01-01', clinic=self.clinic), [self.aspirin.pk]), [])
+        Prescription.objects.exclude(pk=prescription.pk).update(prescription_date=timezone.now() - timedelta(days=10))
+        self.assertEqual(screen_medicines(self.patient, [self.aspirin.pk], exclude_prescription_id=prescription.pk), [])
+
+        response = self.client.get(reverse('api-screen-prescription'), {'patient': self.patient.pk, 'medicine': [self.brufen.pk]})
+        self.assertEqual(response.json()['results'][0]['kind'], 'allergy')
+
+    def test_bulk_load_and_rescreen(self):
+        self.prescribe(self.warfarin, days_ago=3)
+        prescription = self.prescribe(self.brufen)
+        alert = ScreeningAlert.objects.get(prescription=prescription)
+        response = self.client.post(reverse('acknowledge-alert', args=[alert.pk]))  # the allergy was reviewed
+        self.assertRedirects(response, reverse('dispensing-queue'))
+        alert.refresh_from_db()
+        self.assertEqual(alert.acknowledged_by, self.doctor)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('drug_a,drug_b,severity,description\nIbuprofen,Warfarin,Major,Bleeding risk\n')
+        try:
+            call_command('load_drug_interactions', f.name, '--rescreen', stdout=StringIO())
+        finally:
+            os.unlink(f.name)
+
+        alerts = ScreeningAlert.objects.filter(prescription=prescription)
+        self.assertEqual(sorted((a.kind, a.acknowledged_by_id) for a in alerts),
+                         [('allergy', self.doctor.pk), ('interaction', None)])
@@ -0,0 +1,10 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('dispensing/', views.dispensing_queue, name='dispensing-queue'),
+    path('dispensing/dispense/', views.dispense_selected, name='dispense-selected'),
+    path('alerts/<int:pk>/acknowledge/', views.acknowledge_alert, name='acknowledge-alert'),
+    path('api/screen/', views.screen_api, name='api-screen-prescription'),
+    path('api/availability/', views.availability_api, name='api-medicine-availability'),
+]
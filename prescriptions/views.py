@@ -1,3 +1,88 @@
-from django.shortcuts import render
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.db.models import Prefetch
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
+from django.views.decorators.http import require_POST
+from patients.models import Patient
+from .dispensing import dispense_prescriptions, stock_with_equivalents
+from .models import Medicine, PrescribedMedicine, Prescription, ScreeningAlert
+from .screening import screen_medicines
 
-# Create your views here.
+@login_required
+def dispensing_queue(request):
+    """Pharmacy workbench: undispensed prescriptions, oldest first, with stock for each line"""
+    prescriptions = Prescription.objects.filter(is_dispensed=False).select_related('patient', 'doctor').defer(
+        'notes', *(f'patient__{field}' for field in Patient.LARGE_TEXT_FIELDS)
+    ).prefetch_related(
+        Prefetch('medicines', queryset=PrescribedMedicine.objects.select_related('medicine').order_by('pk')),
+        Prefetch('alerts', queryset=ScreeningAlert.objects.filter(acknowledged_by__isnull=True)),
+    ).order_by('prescription_date', 'pk')
+
+    paginator = Paginator(prescriptions, 20)
+    page_obj = paginator.get_page(request.GET.get('page'))
+
+    lines = [line for prescription in page_obj for line in prescription.medicines.all()]
+    stock = stock_with_equivalents({line.medicine_id: line.medicine for line in lines}.values())
+    for line in lines:
+        line.in_stock, line.with_equivalents = stock[line.medicine_id]
+        if line.in_stock >= line.quantity:
+            line.stock_status = 'ok'
+        elif line.with_equivalents >= line.quantity:
+            line.stock_status = 'substitute'
+        else:
+            line.stock_status = 'short' if line.with_equivalents else 'out'
+
+    return render(request, 'prescriptions/dispensing_queue.html', {'page_obj': page_obj})
+
+@login_required
+@require_POST
+def dispense_selected(request):
+    ids = [int(pk) for pk in request.POST.getlist('prescriptions') if pk.isdigit()]
+    if not ids:
+        messages.error(request, 'Select the prescriptions to dispense.')
+        return redirect('dispensing-queue')
+
+    dispensed, shortages = dispense_prescriptions(ids, request.user, substitute=bool(request.POST.get('substitute')))
+    if dispensed:
+        messages.success(request, f'{len(dispensed)} prescriptions dispensed.')
+    for shortage in shortages:
+        messages.error(request, 'Prescription #{prescription_id} not dispensed: {medicine} needs {requested}, {available} in stock.'.format(**shortage))
+    page = request.POST.get('page', '')
+    return redirect(reverse('dispensing-queue') + (f'?page={page}' if page.isdigit() else ''))
+
+@login_required
+@require_POST
+def acknowledge_alert(request, pk):
+    """Record that a screening alert was reviewed; it leaves the workbench and is kept when rescreening"""
+    alert = get_object_or_404(ScreeningAlert.objects.only('message'), pk=pk)
+    if ScreeningAlert.objects.filter(pk=pk, acknowledged_by__isnull=True).update(acknowledged_by=request.user):
+        messages.success(request, f'Alert acknowledged: {alert.message}')
+    page = request.POST.get('page', '')
+    return redirect(reverse('dispensing-queue') + (f'?page={page}' if page.isdigit() else ''))
+
+@login_required
+def screen_api(request):
+    """Interaction and allergy alerts for prescribing ?medicine= (repeatable) to ?patient="""
+    try:
+        patient = get_object_or_404(Patient.objects.only('allergies'), pk=int(request.GET['patient']))
+        medicine_ids = [int(pk) for pk in request.GET.getlist('medicine')]
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Give a patient id and medicine ids.'}, status=400)
+    return JsonResponse({'results': screen_medicines(patient, medicine_ids)})
+
+@login_required
+def availability_api(request):
+    """Dispensable stock of ?medicine= (repeatable), on its own and with its equivalents"""
+    try:
+        medicine_ids = [int(pk) for pk in request.GET.getlist('medicine')]
+    except ValueError:
+        return JsonResponse({'error': 'Give medicine ids.'}, status=400)
+    medicines = Medicine.objects.filter(pk__in=medicine_ids).only('name', 'equivalence_key').order_by('name')
+    stock = stock_with_equivalents(medicines)
+    return JsonResponse({'results': [
+        {'id': medicine.pk, 'name': medicine.name, 'in_stock': stock[medicine.pk][0], 'with_equivalents': stock[medicine.pk][1]}
+        for medicine in medicines
+    ]})